@@ -0,0 +1,152 @@
+"""
+Comprobación aleatoria de `TaskIndex` contra el recorrido lineal original de
+`find_task_by_title_enhanced` (puntuación `palabras_en_común * 2 + similitud` con
+difflib.get_close_matches, gana la primera tarea con la puntuación máxima): para
+cualquier búsqueda, ambos deben devolver la misma tarea. Opcionalmente mide la latencia
+de `search()` sobre las tareas sintéticas del benchmark.
+
+Uso:
+    python bench/check_index.py                         # 3000 búsquedas sobre bases aleatorias
+    python bench/check_index.py --queries 20000 --seed 7
+    python bench/check_index.py --timing 20000,50000    # además, latencia con 20k y 50k tareas
+    python bench/check_index.py --timing 100000 --semantic  # latencia con SEMANTIC_SEARCH (requiere numpy)
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from difflib import get_close_matches
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_services import generate_tasks, percentile  # noqa: E402
+
+# Palabras cortas de un alfabeto pequeño: muchas tareas quedan cerca del umbral de similitud
+SYLLABLES = ["ab", "cd", "ef", "gh", "re", "un", "ion", "eq", "ui", "po", "de", "la", "sa", "to"]
+# Búsquedas fijas de la medición de latencia: palabras frecuentes, sin coincidencias, con erratas
+TIMING_QUERIES = ["liquidaciones de sueldo", "revisar informe mensual", "pagar factura de la oficina",
+                  "xqzt", "reunion equipo", "presupuesto anual del proyecto", "comprar regalo de maria",
+                  "informe mensaul", "de la", "llamar"]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compara TaskIndex con la búsqueda lineal original.")
+    parser.add_argument("--queries", type=int, default=3000, help="Búsquedas aleatorias a comparar.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timing", default="", help="Tamaños (separados por comas) para medir la latencia de search().")
+    parser.add_argument("--semantic", action="store_true", help="Mide la latencia con el índice semántico (SEMANTIC_SEARCH).")
+    return parser.parse_args(argv)
+
+def import_main():
+    os.environ.update({"OPENAI_API_KEY": "sk-check", "NOTION_API_TOKEN": "secret_check", "NOTION_DATABASE_ID": "db",
+                       "TELEGRAM_TOKEN": "123456:check", "ASSISTANT_ID": "asst_check", "SEMANTIC_SEARCH": "false"})
+    os.chdir(tempfile.mkdtemp(prefix="check_index_"))
+    sys.path.insert(0, REPO_DIR)
+    import main
+    return main
+
+def linear_search(tasks: list[tuple[str, str, str]], norm_title_to_find: str) -> tuple[str | None, str | None]:
+    """La búsqueda original: recorre todas las tareas (task_id, real_title, norm_title) en orden."""
+    best_match = {"id": None, "title": None, "score": 0}
+    search_words = set(norm_title_to_find.split())
+    for task_id, real_title, norm_title in tasks:
+        keyword_score = len(search_words.intersection(norm_title.split()))
+        similarity_score = 1 if get_close_matches(norm_title_to_find, [norm_title], n=1, cutoff=0.6) else 0
+        total_score = (keyword_score * 2) + similarity_score
+        if total_score > best_match["score"]:
+            best_match = {"id": task_id, "title": real_title, "score": total_score}
+    return best_match["id"], best_match["title"]
+
+def random_title(rng: random.Random) -> str:
+    return " ".join("".join(rng.choices(SYLLABLES, k=rng.randint(1, 3))) for _ in range(rng.randint(1, 4)))
+
+def random_query(rng: random.Random, titles: list[str]) -> str:
+    """Una variación de un título existente (sin espacios, con erratas, menos palabras...) o una búsqueda al azar."""
+    title = rng.choice(titles)
+    kind = rng.randrange(6)
+    if kind == 0:
+        return title.replace(" ", "")
+    if kind == 1:
+        chars = list(title)
+        for _ in range(rng.randint(1, 3)):
+            chars[rng.randrange(len(chars))] = rng.choice("abcdefghinoqrstu ")
+        return "".join(chars)
+    if kind == 2:
+        words = title.split()
+        return " ".join(rng.sample(words, rng.randint(1, len(words))))
+    if kind == 3:
+        return f"{title} {rng.choice(SYLLABLES)}"
+    if kind == 4:
+        return title[:rng.randint(1, len(title))]
+    return random_title(rng)
+
+def check_equivalence(main, queries: int, seed: int) -> int:
+    rng = random.Random(seed)
+    mismatches = 0
+    done = 0
+    while done < queries:
+        index, tasks = main.TaskIndex(), []
+        for i in range(rng.randint(1, 300)):
+            real_title = random_title(rng) if rng.random() < 0.7 else generate_tasks(1, seed=rng.randrange(10**6))[0]["title"]
+            tasks.append((f"t{i}", real_title, main.normalize_title(real_title)))
+        # Renombres y bajas para ejercitar también la actualización del índice
+        for task_id, real_title, norm_title in tasks:
+            index.add(task_id, real_title, norm_title)
+        for _ in range(rng.randint(0, 10)):
+            if len(tasks) < 2: break
+            position = rng.randrange(len(tasks))
+            task_id = tasks[position][0]
+            if rng.random() < 0.5:
+                index.remove(task_id)
+                del tasks[position]
+            else:
+                real_title = random_title(rng)
+                index.add(task_id, real_title, main.normalize_title(real_title))
+                tasks[position] = (task_id, real_title, main.normalize_title(real_title))
+        if not tasks: continue
+
+        titles = [norm_title for _, _, norm_title in tasks if norm_title]
+        for _ in range(min(50, queries - done)):
+            query = main.normalize_title(random_query(rng, titles))
+            done += 1
+            if not query: continue
+            expected, got = linear_search(tasks, query), index.search(query)
+            if expected != got:
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"DISTINTO  búsqueda={query!r}  lineal={expected}  índice={got}")
+    print(f"{done} búsquedas comparadas, {mismatches} distintas.")
+    return mismatches
+
+def measure_timing(main, sizes: list[int], semantic: bool = False):
+    # La comparación con la búsqueda lineal va siempre sin el índice semántico, que cambia el resultado
+    main.SEMANTIC_SEARCH = semantic
+    for size in sizes:
+        index = main.TaskIndex()
+        if semantic and index._semantic is None:
+            print("El índice semántico necesita numpy.")
+            return
+        for i, task in enumerate(generate_tasks(size)):
+            index.add(f"t{i}", task["title"], main.normalize_title(task["title"]), task["description"])
+        for query in TIMING_QUERIES:
+            norm_query = main.normalize_title(query)
+            samples = []
+            for _ in range(20):
+                start = time.perf_counter()
+                index.search(norm_query)
+                samples.append((time.perf_counter() - start) * 1000)
+            print(f"[{size} tareas] {query!r:32} p50 {percentile(samples, 50):7.2f} ms   p99 {percentile(samples, 99):7.2f} ms")
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    main = import_main()
+    mismatches = check_equivalence(main, args.queries, args.seed)
+    if args.timing:
+        measure_timing(main, [int(size) for size in args.timing.split(",")], args.semantic)
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,561 @@
+"""
+Servicios falsos para los benchmarks: Notion, la API de Assistants de OpenAI y la Bot API
+de Telegram, servidos por HTTP desde un único servidor asyncio local (solo biblioteca
+estándar). Cada servicio añade una latencia configurable y, si se le indica, aplica un
+límite de peticiones por segundo respondiendo 429 como el servicio real.
+
+Rutas:
+  /notion/v1/...            databases.retrieve, databases.query, pages.create/retrieve/update
+  /openai/v1/...            threads, messages, runs (con y sin streaming), submit_tool_outputs
+  /telegram/bot<token>/...  getMe, sendMessage, editMessageText, sendChatAction
+  /_bench/...               estadísticas y control del benchmark
+
+El asistente falso no usa ningún modelo: cada línea del mensaje del usuario es un JSON
+`{"tool": nombre, "args": {...}}` y se convierte en una llamada a esa herramienta. La
+respuesta final termina en END_MARKER, que Telegram usa para marcar el fin del turno.
+"""
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, urlsplit
+
+DATABASE_ID = "bench-database"
+END_MARKER = "✅"
+ERROR_PREFIXES = ("Lo siento", "Hubo un problema")  # Respuestas de error de run_turn
+
+STATUSES = ["Por hacer", "En progreso", "Listo"]
+CATEGORIES = ["Trabajo", "Personal", "Casa", "Estudios", "Salud", "Finanzas"]
+VERBS = ["Revisar", "Preparar", "Enviar", "Llamar a", "Comprar", "Organizar", "Actualizar", "Pagar",
+         "Planificar", "Escribir", "Reservar", "Limpiar", "Renovar", "Agendar", "Terminar", "Leer"]
+OBJECTS = ["informe", "presupuesto", "factura", "contrato", "presentación", "correo", "reunión",
+           "dentista", "seguro", "vacaciones", "regalo", "cumpleaños", "auto", "departamento",
+           "impuestos", "curso", "libro", "gimnasio", "proveedor", "cliente", "banco", "médico",
+           "jardín", "mudanza", "pasaporte", "licencia", "tarjeta", "notebook", "servidor", "tesis"]
+QUALIFIERS = ["mensual", "anual", "de Juan", "de María", "del equipo", "pendiente", "urgente",
+              "de marzo", "de invierno", "del colegio", "de la oficina", "nuevo", "antiguo",
+              "trimestral", "de Pedro", "de la casa", "del proyecto", "final", "borrador", "semanal"]
+
+def synthetic_title(rng: random.Random, i: int) -> str:
+    """Título verosímil; el sufijo numérico solo aparece en una parte de las tareas."""
+    title = f"{rng.choice(VERBS)} {rng.choice(OBJECTS)} {rng.choice(QUALIFIERS)}"
+    return f"{title} {i}" if rng.random() < 0.3 else title
+
+def generate_tasks(count: int, seed: int = 42) -> list[dict]:
+    """Base de datos sintética reproducible: el benchmark y el servidor generan las mismas tareas."""
+    rng = random.Random(seed)
+    today = datetime.now(timezone.utc).date()
+    tasks = []
+    for i in range(count):
+        due_date = None
+        if rng.random() < 0.85:
+            day = today + timedelta(days=rng.randint(-30, 60))
+            due_date = day.isoformat()
+            if rng.random() < 0.2:
+                due_date += f"T{rng.randint(8, 20):02d}:{rng.choice(['00', '30'])}:00.000-03:00"
+        tasks.append({
+            "title": synthetic_title(rng, i),
+            "status": rng.choice(STATUSES),
+            "due_date": due_date,
+            "categories": rng.sample(CATEGORIES, rng.randint(0, 2)),
+            "description": "Tarea generada para el benchmark." if rng.random() < 0.3 else "",
+        })
+    return tasks
+
+def notion_timestamp(ts: float) -> str:
+    # Notion redondea last_edited_time al minuto
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:00.000Z")
+
+def percentile(values: list[float], pct: float) -> float | None:
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class RateLimiter:
+    """Token bucket sin espera: indica si la petición entra en el límite o debe recibir un 429."""
+
+    def __init__(self, rate: float | None):
+        self.rate = rate
+        self._tokens = rate or 0
+        self._updated = time.monotonic()
+
+    def allow(self) -> bool:
+        if not self.rate: return True
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+class FakeService:
+    """Base común: latencia con jitter, límite de tasa y contadores por ruta."""
+
+    name = ""
+
+    def __init__(self, latency: float = 0.0, rate: float | None = None):
+        self.latency = latency
+        self.limiter = RateLimiter(rate)
+        self.enabled_limits = True
+        self.requests = Counter()
+        self.throttled = 0
+
+    async def handle(self, method: str, path: str, query: dict, body: dict) -> tuple[int, dict, bytes]:
+        route = self.route_name(method, path)
+        self.requests[route] += 1
+        if self.enabled_limits:
+            if self.latency:
+                await asyncio.sleep(self.latency * random.uniform(0.8, 1.2))
+            if not self.limiter.allow():
+                self.throttled += 1
+                return self.rate_limited()
+        return await self.dispatch(method, path, query, body)
+
+    def route_name(self, method: str, path: str) -> str:
+        # Los identificadores se sustituyen para agrupar las peticiones por tipo
+        return f"{method} " + re.sub(r"/(?:thread|run|msg|call)_\w+|/[0-9a-f-]{36}|/bench-database", "/{id}", path)
+
+    def stats(self) -> dict:
+        return {"requests": sum(self.requests.values()), "throttled": self.throttled, "by_route": dict(self.requests)}
+
+    def reset_stats(self):
+        self.requests.clear()
+        self.throttled = 0
+
+    def rate_limited(self) -> tuple[int, dict, bytes]:
+        raise NotImplementedError
+
+    async def dispatch(self, method: str, path: str, query: dict, body: dict) -> tuple[int, dict, bytes]:
+        raise NotImplementedError
+
+def json_response(payload, status: int = 200, headers: dict = None) -> tuple[int, dict, bytes]:
+    return status, {"Content-Type": "application/json", **(headers or {})}, json.dumps(payload).encode()
+
+# -----------------------------------------------------------------------------
+# NOTION
+# -----------------------------------------------------------------------------
+
+class FakeNotion(FakeService):
+    name = "notion"
+    PROPERTIES = {"Nombre de tarea": ("title", "title"), "Estado": ("st%3A", "status"), "Fecha límite": ("dl%3A", "date"),
+                  "Etiquetas": ("tg%3A", "multi_select"), "Descripción": ("ds%3A", "rich_text")}
+
+    def __init__(self, tasks: list[dict], **kwargs):
+        super().__init__(**kwargs)
+        self.pages = {}
+        self._version = 0
+        self._query_cache = {}  # {(filtro, orden, versión): [página]} para paginar sin reordenar
+        created = time.time() - 3600
+        for task in tasks:
+            page = self._new_page(created)
+            page["properties"]["Nombre de tarea"]["title"] = self._rich_text(task["title"])
+            page["properties"]["Estado"]["status"] = {"name": task["status"]}
+            page["properties"]["Fecha límite"]["date"] = {"start": task["due_date"], "end": None} if task["due_date"] else None
+            page["properties"]["Etiquetas"]["multi_select"] = [{"name": c} for c in task["categories"]]
+            page["properties"]["Descripción"]["rich_text"] = self._rich_text(task["description"])
+            self.pages[page["id"]] = page
+
+    @staticmethod
+    def _rich_text(text: str) -> list[dict]:
+        return [{"type": "text", "text": {"content": text}, "plain_text": text}] if text else []
+
+    def _new_page(self, ts: float) -> dict:
+        return {
+            "object": "page", "id": str(uuid.uuid4()), "created_time": notion_timestamp(ts),
+            "last_edited_time": notion_timestamp(ts), "archived": False, "in_trash": False,
+            "parent": {"type": "database_id", "database_id": DATABASE_ID},
+            "properties": {name: {"id": pid, "type": kind, kind: [] if kind in ("title", "multi_select", "rich_text") else None}
+                           for name, (pid, kind) in self.PROPERTIES.items()},
+        }
+
+    def _apply(self, page: dict, body: dict):
+        for name, value in (body.get("properties") or {}).items():
+            prop = page["properties"].setdefault(name, {"id": name, "type": next(iter(value))})
+            if "title" in value:
+                prop["title"] = self._rich_text("".join(t["text"]["content"] for t in value["title"]))
+            elif "rich_text" in value:
+                prop["rich_text"] = self._rich_text("".join(t["text"]["content"] for t in value["rich_text"]))
+            else:
+                prop.update(value)
+        if "archived" in body:
+            page["archived"] = page["in_trash"] = bool(body["archived"])
+        page["last_edited_time"] = notion_timestamp(time.time())
+        self._version += 1
+
+    def rate_limited(self):
+        return json_response({"object": "error", "status": 429, "code": "rate_limited",
+                              "message": "You have been rate limited. Please try again in a few minutes."},
+                             status=429, headers={"Retry-After": "1"})
+
+    def _not_found(self, object_id: str):
+        return json_response({"object": "error", "status": 404, "code": "object_not_found",
+                              "message": f"Could not find page with ID: {object_id}."}, status=404)
+
+    def _matches(self, page: dict, f: dict) -> bool:
+        if "and" in f: return all(self._matches(page, sub) for sub in f["and"])
+        if "or" in f: return any(self._matches(page, sub) for sub in f["or"])
+        if f.get("timestamp") in ("last_edited_time", "created_time"):
+            timestamp, condition = page[f["timestamp"]], f[f["timestamp"]]
+            if "on_or_after" in condition: return timestamp >= condition["on_or_after"]
+            if "after" in condition: return timestamp > condition["after"]
+            return True
+        prop = page["properties"].get(f.get("property"), {})
+        if "status" in f:
+            return (prop.get("status") or {}).get("name") == f["status"].get("equals")
+        if "multi_select" in f:
+            return f["multi_select"].get("contains") in [o["name"] for o in prop.get("multi_select", [])]
+        if "date" in f:
+            start = (prop.get("date") or {}).get("start") or ""
+            return bool(start) and start[:10] == f["date"].get("equals", "")[:10]
+        if "title" in f:
+            title = "".join(t["plain_text"] for t in prop.get("title", []))
+            if "equals" in f["title"]: return title == f["title"]["equals"]
+            return f["title"].get("contains", "").lower() in title.lower()
+        return True
+
+    def _query(self, body: dict) -> dict:
+        query_filter, sorts = body.get("filter"), body.get("sorts")
+        key = (json.dumps(query_filter, sort_keys=True), json.dumps(sorts, sort_keys=True), self._version)
+        results = self._query_cache.get(key)
+        if results is None:
+            results = [p for p in self.pages.values() if not p["archived"] and (not query_filter or self._matches(p, query_filter))]
+            for sort in reversed(sorts or []):
+                results.sort(key=lambda p: p.get(sort.get("timestamp", "created_time"), ""), reverse=sort.get("direction") == "descending")
+            self._query_cache = {key: results}
+        start = int(body.get("start_cursor") or 0)
+        end = start + min(int(body.get("page_size", 100)), 100)
+        has_more = end < len(results)
+        return {"object": "list", "results": results[start:end], "has_more": has_more,
+                "next_cursor": str(end) if has_more else None, "type": "page_or_database"}
+
+    async def dispatch(self, method, path, query, body):
+        parts = path.strip("/").split("/")[1:]  # sin el prefijo "v1"
+        if parts[0] == "databases" and method == "GET":
+            properties = {name: {"id": pid, "name": name, "type": kind} for name, (pid, kind) in self.PROPERTIES.items()}
+            return json_response({"object": "database", "id": DATABASE_ID, "properties": properties})
+        if parts[0] == "databases" and parts[-1] == "query":
+            return json_response(self._query(body))
+        if parts[0] == "pages" and len(parts) == 1 and method == "POST":
+            page = self._new_page(time.time())
+            self._apply(page, body)
+            self.pages[page["id"]] = page
+            return json_response(page)
+        if parts[0] == "pages" and len(parts) == 2:
+            page = self.pages.get(parts[1])
+            if page is None: return self._not_found(parts[1])
+            if method == "PATCH":
+                self._apply(page, body)
+            return json_response(page)
+        return self._not_found(path)
+
+# -----------------------------------------------------------------------------
+# OPENAI (ASSISTANTS)
+# -----------------------------------------------------------------------------
+
+class FakeOpenAI(FakeService):
+    name = "openai"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.threads = {}  # {thread_id: {"user": texto, "assistant": texto}}
+        self.runs = {}  # {run_id: {"thread_id", "status", "tool_calls"}}
+        self.tool_outputs = Counter()  # Estados devueltos por las herramientas ("success", "error"...)
+
+    def rate_limited(self):
+        return json_response({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                             status=429, headers={"Retry-After": "1"})
+
+    def stats(self) -> dict:
+        return {**super().stats(), "tool_outputs": dict(self.tool_outputs)}
+
+    def reset_stats(self):
+        super().reset_stats()
+        self.tool_outputs.clear()
+
+    @staticmethod
+    def _message(thread_id: str, role: str, text: str) -> dict:
+        return {"id": f"msg_{uuid.uuid4().hex[:12]}", "object": "thread.message", "created_at": int(time.time()),
+                "thread_id": thread_id, "role": role, "status": "completed", "attachments": [], "metadata": {},
+                "content": [{"type": "text", "text": {"value": text, "annotations": []}}] if text else []}
+
+    def _run(self, run_id: str) -> dict:
+        state = self.runs[run_id]
+        run = {"id": run_id, "object": "thread.run", "status": state["status"], "thread_id": state["thread_id"],
+               "assistant_id": "asst_bench", "created_at": int(time.time()), "instructions": "", "model": "bench",
+               "tools": [], "parallel_tool_calls": True, "last_error": None}
+        if state["status"] == "requires_action":
+            run["required_action"] = {"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": state["tool_calls"]}}
+        return run
+
+    @staticmethod
+    def _tool_calls(user_text: str) -> list[dict]:
+        calls = []
+        for line in user_text.splitlines():
+            try:
+                request = json.loads(line)
+            except ValueError:
+                continue
+            calls.append({"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                          "function": {"name": request["tool"], "arguments": json.dumps(request.get("args", {}))}})
+        return calls
+
+    def _final_text(self, run_id: str) -> str:
+        count = len(self.runs[run_id]["tool_calls"])
+        return f"Listo, procesé {count} herramienta(s). {END_MARKER}"
+
+    def _sse(self, events: list[tuple[str, dict]]) -> tuple[int, dict, bytes]:
+        body = "".join(f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in events)
+        body += "event: done\ndata: [DONE]\n\n"
+        return 200, {"Content-Type": "text/event-stream"}, body.encode()
+
+    def _completion_events(self, run_id: str) -> list[tuple[str, dict]]:
+        state = self.runs[run_id]
+        state["status"] = "completed"
+        text = self._final_text(run_id)
+        self.threads[state["thread_id"]]["assistant"] = text
+        message = self._message(state["thread_id"], "assistant", "")
+        message["status"] = "in_progress"
+        events = [("thread.message.created", message)]
+        # El texto llega en varios fragmentos, como en un stream real
+        for chunk in re.findall(r"\S+\s*", text):
+            events.append(("thread.message.delta", {"id": message["id"], "object": "thread.message.delta",
+                                                    "delta": {"content": [{"index": 0, "type": "text", "text": {"value": chunk}}]}}))
+        events.append(("thread.run.completed", self._run(run_id)))
+        return events
+
+    async def dispatch(self, method, path, query, body):
+        parts = path.strip("/").split("/")[1:]  # sin el prefijo "v1"
+        if parts == ["threads"]:
+            thread_id = f"thread_{uuid.uuid4().hex[:12]}"
+            self.threads[thread_id] = {"user": "", "assistant": ""}
+            return json_response({"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}})
+
+        thread_id = parts[1]
+        thread = self.threads.get(thread_id)
+        if thread is None:
+            return json_response({"error": {"message": f"No thread found with id '{thread_id}'."}}, status=404)
+
+        if parts[2:] == ["messages"]:
+            if method == "POST":
+                content = body.get("content")
+                thread["user"] = content if isinstance(content, str) else "".join(c.get("text", "") for c in content)
+                return json_response(self._message(thread_id, "user", thread["user"]))
+            data = [self._message(thread_id, "assistant", thread["assistant"])]
+            return json_response({"object": "list", "data": data, "first_id": data[0]["id"], "last_id": data[0]["id"], "has_more": False})
+
+        if parts[2:] == ["runs"]:
+            run_id = f"run_{uuid.uuid4().hex[:12]}"
+            tool_calls = self._tool_calls(thread["user"])
+            self.runs[run_id] = {"thread_id": thread_id, "status": "queued", "tool_calls": tool_calls}
+            if not body.get("stream"):
+                return json_response(self._run(run_id))
+            events = [("thread.run.created", self._run(run_id))]
+            if tool_calls:
+                self.runs[run_id]["status"] = "requires_action"
+                events.append(("thread.run.requires_action", self._run(run_id)))
+            else:
+                events += self._completion_events(run_id)
+            return self._sse(events)
+
+        run_id = parts[3]
+        if run_id not in self.runs:
+            return json_response({"error": {"message": f"No run found with id '{run_id}'."}}, status=404)
+        state = self.runs[run_id]
+
+        if parts[4:] == ["submit_tool_outputs"]:
+            for output in body.get("tool_outputs", []):
+                try:
+                    self.tool_outputs[json.loads(output["output"]).get("status", "?")] += 1
+                except (ValueError, AttributeError):
+                    self.tool_outputs["?"] += 1
+            if body.get("stream"):
+                return self._sse(self._completion_events(run_id))
+            state["status"] = "in_progress"
+            return json_response(self._run(run_id))
+
+        # runs.retrieve (polling): queued -> requires_action/in_progress -> completed
+        if state["status"] == "queued":
+            state["status"] = "requires_action" if state["tool_calls"] else "in_progress"
+        elif state["status"] == "in_progress":
+            self._completion_events(run_id)
+        return json_response(self._run(run_id))
+
+# -----------------------------------------------------------------------------
+# TELEGRAM
+# -----------------------------------------------------------------------------
+
+class FakeTelegram(FakeService):
+    name = "telegram"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sent = []  # [(ts, chat_id, texto)] todos los textos enviados o editados
+        self.finals = defaultdict(list)  # {chat_id: [{"ts", "ok", "text"}]} fin de cada turno
+        self._final_messages = set()
+        self._changed = asyncio.Condition()
+        self._next_message_id = 1
+
+    def rate_limited(self):
+        return json_response({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                              "parameters": {"retry_after": 1}}, status=429)
+
+    def route_name(self, method, path):
+        return path.rsplit("/", 1)[-1]  # Sin el token del bot
+
+    async def _record(self, chat_id: int, message_id: int, text: str):
+        now = time.time()
+        self.sent.append((now, chat_id, text))
+        ok = END_MARKER in text
+        if (ok or text.startswith(ERROR_PREFIXES)) and (chat_id, message_id) not in self._final_messages:
+            self._final_messages.add((chat_id, message_id))
+            self.finals[chat_id].append({"ts": now, "ok": ok, "text": text})
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def wait_for(self, predicate, timeout: float) -> bool:
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(predicate), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+    def _message(self, chat_id: int, message_id: int, text: str) -> dict:
+        return {"message_id": message_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Olivia"}}
+
+    async def dispatch(self, method, path, query, body):
+        action = path.rsplit("/", 1)[-1]
+        if action == "getMe":
+            return json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Olivia", "username": "olivia_bench_bot"}})
+        if action in ("sendChatAction", "setWebhook", "deleteWebhook"):
+            return json_response({"ok": True, "result": True})
+        chat_id = int(body.get("chat_id", 0))
+        text = body.get("text", "")
+        if action == "sendMessage":
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        elif action == "editMessageText":
+            message_id = int(body.get("message_id", 0))
+        else:
+            return json_response({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+        await self._record(chat_id, message_id, text)
+        return json_response({"ok": True, "result": self._message(chat_id, message_id, text)})
+
+# -----------------------------------------------------------------------------
+# SERVIDOR HTTP
+# -----------------------------------------------------------------------------
+
+class FakeServer:
+    """Servidor HTTP/1.1 mínimo con keep-alive que reparte las peticiones por prefijo de ruta."""
+
+    def __init__(self, services: list[FakeService]):
+        self.services = {service.name: service for service in services}
+        self.telegram = self.services["telegram"]
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._handle_connection, host, port, backlog=1024)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _read_body(self, reader: asyncio.StreamReader, headers: dict) -> bytes:
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).strip().split(b";")[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0: return body
+                body += chunk[:-2]
+        return await reader.readexactly(int(headers.get("content-length", 0)))
+
+    @staticmethod
+    def _parse_body(headers: dict, raw: bytes) -> dict:
+        if not raw: return {}
+        content_type = headers.get("content-type", "")
+        if "application/json" in content_type:
+            return json.loads(raw)
+        if "x-www-form-urlencoded" in content_type:
+            return dict(parse_qsl(raw.decode()))
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return {}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line: break
+                method, target, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = self._parse_body(headers, await self._read_body(reader, headers))
+                url = urlsplit(target)
+                status, response_headers, payload = await self._dispatch(method, url.path, dict(parse_qsl(url.query)), body)
+                head = f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\nContent-Length: {len(payload)}\r\nConnection: keep-alive\r\n"
+                head += "".join(f"{name}: {value}\r\n" for name, value in response_headers.items())
+                writer.write(head.encode() + b"\r\n" + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, query: dict, body: dict) -> tuple[int, dict, bytes]:
+        prefix, _, rest = path.lstrip("/").partition("/")
+        if prefix == "_bench":
+            return await self._control(rest, query, body)
+        service = self.services.get(prefix)
+        if service is None:
+            return json_response({"error": f"Ruta desconocida: {path}"}, status=404)
+        return await service.handle(method, "/" + rest, query, body)
+
+    async def _control(self, action: str, query: dict, body: dict) -> tuple[int, dict, bytes]:
+        if action == "stats":
+            return json_response({name: service.stats() for name, service in self.services.items()})
+        if action == "reset":
+            for service in self.services.values():
+                service.reset_stats()
+            return json_response({"ok": True})
+        if action == "limits":
+            # Latencia y límites de tasa: se desactivan durante la preparación (p. ej. la sincronización inicial)
+            for service in self.services.values():
+                service.enabled_limits = bool(body.get("enabled", True))
+            return json_response({"ok": True})
+        if action == "wait_final":
+            # Espera a que el chat reciba su respuesta final número `count`
+            chat_id, count = int(query["chat_id"]), int(query["count"])
+            finals = self.telegram.finals[chat_id]
+            arrived = await self.telegram.wait_for(lambda: len(finals) >= count, float(query.get("timeout", 60)))
+            return json_response(finals[count - 1] if arrived else {"timeout": True})
+        if action == "sent":
+            # Mensajes enviados desde la posición `since`, con espera opcional hasta que haya `min` nuevos
+            since = int(query.get("since", 0))
+            minimum = int(query.get("min", 0))
+            await self.telegram.wait_for(lambda: len(self.telegram.sent) - since >= minimum, float(query.get("timeout", 0)))
+            return json_response({"messages": self.telegram.sent[since:], "next": len(self.telegram.sent)})
+        return json_response({"error": f"Acción desconocida: {action}"}, status=404)
+
+def serve(conn, config: dict):
+    """Punto de entrada del proceso de los servicios falsos; envía el puerto por `conn` y sirve hasta que lo maten."""
+    async def run():
+        services = [
+            FakeNotion(generate_tasks(config["pages"], config.get("seed", 42)),
+                       latency=config.get("notion_latency", 0.0), rate=config.get("notion_rate")),
+            FakeOpenAI(latency=config.get("openai_latency", 0.0), rate=config.get("openai_rate")),
+            FakeTelegram(latency=config.get("telegram_latency", 0.0), rate=config.get("telegram_rate")),
+        ]
+        server = FakeServer(services)
+        conn.send(await server.start(port=config.get("port", 0)))
+        conn.close()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
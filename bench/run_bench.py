@@ -0,0 +1,435 @@
+"""
+Benchmark offline del bot: ejecuta las herramientas de `main.py`, `handle_message` y el
+envío de recordatorios contra los servicios falsos de `fake_services.py` (Notion, OpenAI
+y Telegram con latencia y límites de tasa configurables), sin credenciales ni red.
+
+Para cada tamaño de base de datos se lanza un proceso nuevo (estado de `main` limpio) que:
+  1. Sincroniza el espejo completo (sin latencia ni límites: es preparación).
+  2. Mide cada herramienta por separado: latencia p50/p99 y llamadas a Notion por llamada.
+  3. Simula chats concurrentes que envían mensajes por `handle_message`: latencia del turno
+     (desde el mensaje hasta la respuesta final en Telegram) y peticiones por turno.
+  4. Programa recordatorios con vencimientos cercanos y mide el retraso de su envío.
+Además informa la memoria residente del proceso del bot.
+
+Uso:
+    python bench/run_bench.py --pages 100,1000,10000
+    python bench/run_bench.py --pages 100000 --turns 50 --json-out bench_output.json
+    python bench/run_bench.py --compare bench_output.json   # falla si algo empeora más de --tolerance
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_services import CATEGORIES, DATABASE_ID, STATUSES, generate_tasks, percentile, serve  # noqa: E402
+
+BOT_TOKEN = "123456:bench"
+REMINDER_PREFIX = "bench-recordatorio-"
+# Mezcla de peticiones de los turnos simulados: (herramienta, peso)
+TURN_MIX = [("listar_hoy", 3), ("actualizar", 2), ("listar_filtro", 1), ("crear", 1), ("recordatorio", 1)]
+# Métricas comparables con --compare: en todas, un valor mayor es peor
+COMPARABLE_SUFFIXES = ("_ms", "_s", "_per_call", "_per_turn", "_mb")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline del bot de tareas.")
+    parser.add_argument("--pages", default="100,1000,10000", help="Tamaños de la base de datos de Notion, separados por comas.")
+    parser.add_argument("--iterations", type=int, default=30, help="Llamadas por herramienta en la fase de herramientas.")
+    parser.add_argument("--turns", type=int, default=100, help="Turnos totales de la fase de mensajes.")
+    parser.add_argument("--chats", type=int, default=10, help="Chats concurrentes en la fase de mensajes.")
+    parser.add_argument("--reminders", type=int, default=200, help="Recordatorios de la fase de recordatorios.")
+    parser.add_argument("--reminder-window", type=float, default=2.0, help="Segundos sobre los que se reparten los vencimientos.")
+    parser.add_argument("--notion-latency-ms", type=float, default=150)
+    parser.add_argument("--openai-latency-ms", type=float, default=300)
+    parser.add_argument("--telegram-latency-ms", type=float, default=40)
+    parser.add_argument("--notion-rate", type=float, default=3, help="Límite de Notion (req/s); también se usa como NOTION_RATE_LIMIT del bot.")
+    parser.add_argument("--openai-rate", type=float, default=0, help="Límite de OpenAI (req/s); 0 = sin límite.")
+    parser.add_argument("--telegram-rate", type=float, default=30, help="Límite de Telegram (req/s).")
+    parser.add_argument("--polling", action="store_true", help="Ejecuta los runs con polling en vez de streaming (RUN_STREAMING=false).")
+    parser.add_argument("--turn-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json-out", help="Guarda los resultados en este archivo JSON.")
+    parser.add_argument("--compare", help="Resultados JSON de referencia contra los que comparar.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Empeoramiento relativo tolerado por --compare.")
+    parser.add_argument("--verbose", action="store_true", help="Muestra los logs del bot.")
+    return parser.parse_args(argv)
+
+def rss_mb() -> float | None:
+    """Memoria residente actual del proceso (Linux); None si no se puede leer."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10  # bytes en macOS, KiB en Linux
+
+def summarize(values: list[float], scale: float = 1000) -> dict:
+    """p50/p99/máximo en milisegundos (por defecto) de una lista de segundos."""
+    if not values: return {"count": 0}
+    return {"count": len(values), "p50_ms": round(percentile(values, 50) * scale, 2),
+            "p99_ms": round(percentile(values, 99) * scale, 2), "max_ms": round(max(values) * scale, 2)}
+
+def start_fake_services(args, pages: int):
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe()
+    config = {
+        "pages": pages, "seed": args.seed,
+        "notion_latency": args.notion_latency_ms / 1000, "notion_rate": args.notion_rate or None,
+        "openai_latency": args.openai_latency_ms / 1000, "openai_rate": args.openai_rate or None,
+        "telegram_latency": args.telegram_latency_ms / 1000, "telegram_rate": args.telegram_rate or None,
+    }
+    process = ctx.Process(target=serve, args=(child_conn, config), daemon=True)
+    process.start()
+    return process, parent_conn.recv()
+
+class BenchRun:
+    """Una ejecución completa del benchmark para un tamaño de base de datos."""
+
+    def __init__(self, args, pages: int, base_url: str):
+        import httpx
+
+        self.args = args
+        self.pages = pages
+        self.base_url = base_url
+        self.rng = random.Random(args.seed)
+        self.titles = [task["title"] for task in generate_tasks(pages, args.seed)]
+        self.control = httpx.AsyncClient(base_url=f"{base_url}/_bench", timeout=args.turn_timeout + 30)
+        self.main = None
+        self.tenant = None
+        self.writer = None
+
+    # --- Utilidades ---
+
+    async def stats(self) -> dict:
+        return (await self.control.get("/stats")).json()
+
+    async def reset_stats(self):
+        await self.control.post("/reset")
+
+    async def drain_writes(self, timeout: float = 60):
+        """Espera a que se envíen a Notion las escrituras diferidas, para contarlas en la fase que las generó."""
+        deadline = time.monotonic() + timeout
+        while self.main.storage.pending_writes() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    def _typo(self, title: str) -> str:
+        """Variante de un título como la escribiría un usuario: minúsculas y a veces una letra de menos."""
+        query = title.lower()
+        if len(query) > 8 and self.rng.random() < 0.5:
+            i = self.rng.randrange(len(query))
+            query = query[:i] + query[i + 1:]
+        return query
+
+    def _pseudoword(self) -> str:
+        # Palabras inventadas: las tareas nuevas no se confunden con las existentes (no se omiten como duplicadas)
+        return "".join(self.rng.choice("bcdfglmnprstv") + self.rng.choice("aeiou") for _ in range(3))
+
+    def _tool_request(self, name: str, chat_id: int) -> tuple:
+        """Devuelve (función de main, argumentos) para una operación de la mezcla."""
+        m, rng = self.main, self.rng
+        if name == "buscar":
+            return m.find_task_by_title_enhanced, {"title_to_find": self._typo(rng.choice(self.titles))}
+        if name == "listar_hoy":
+            return m.list_tasks_notion, {"due_date": "hoy"}
+        if name == "listar_filtro":
+            return m.list_tasks_notion, {"category": rng.choice(CATEGORIES), "status": "Por hacer"}
+        if name == "actualizar":
+            return m.update_task_notion, {"title_to_find": self._typo(rng.choice(self.titles)), "new_status": rng.choice(STATUSES)}
+        if name == "crear":
+            return m.create_task_notion, {"title": " ".join(self._pseudoword() for _ in range(3)),
+                                          "category": rng.choice(CATEGORIES), "due_date": "mañana"}
+        if name == "recordatorio":
+            return m.set_reminder_notion, {"title_to_find": rng.choice(self.titles), "reminder_str": "1 hora antes", "chat_id": chat_id}
+        raise ValueError(name)
+
+    # --- Fases ---
+
+    async def bootstrap(self) -> dict:
+        """Importa el bot apuntando a los servicios falsos y sincroniza el espejo completo."""
+        os.environ.update({
+            "OPENAI_API_KEY": "sk-bench", "OPENAI_BASE_URL": f"{self.base_url}/openai/v1",
+            "NOTION_API_TOKEN": "secret_bench", "NOTION_DATABASE_ID": DATABASE_ID,
+            "TELEGRAM_TOKEN": BOT_TOKEN, "ASSISTANT_ID": "asst_bench",
+            "NOTION_RATE_LIMIT": str(self.args.notion_rate or 1000),
+            "RUN_STREAMING": "false" if self.args.polling else "true",
+        })
+        sys.path.insert(0, REPO_DIR)
+        import main
+
+        self.main = main
+        if not self.args.verbose:
+            # Los 429 y reintentos ya se cuentan en las estadísticas de los servicios falsos
+            logging.getLogger().setLevel(logging.ERROR)
+            logging.getLogger("main").setLevel(logging.ERROR)
+        # Un único tenant predeterminado (como sin TENANTS_FILE) que atiende a todos los chats simulados
+        notion = main.NotionGateway(main.NOTION_API_TOKEN, base_url=f"{self.base_url}/notion")
+        self.tenant = main.Tenant("default", notion, DATABASE_ID, is_default=True)
+        main.TENANTS.add(self.tenant)
+        result = {"rss_import_mb": rss_mb()}
+
+        # La preparación no se mide contra los límites: sin latencia ni límite de tasa
+        await self.control.post("/limits", json={"enabled": False})
+        bucket_rate = notion.bucket.rate
+        notion.bucket.rate = notion.bucket.capacity = 10_000
+        start = time.perf_counter()
+        main.init_db()
+        await asyncio.to_thread(main.warm_up_date_parser)
+        with main.use_tenant(self.tenant):
+            main.load_task_index()
+            await main.sync_tasks_mirror(full=True)
+        result["sync_s"] = round(time.perf_counter() - start, 3)
+        notion.bucket.rate = notion.bucket.capacity = bucket_rate
+        await self.control.post("/limits", json={"enabled": True})
+        self.writer = asyncio.create_task(main.WRITES.run())
+
+        result["rss_after_sync_mb"] = rss_mb()
+        result["db_file_mb"] = round(os.path.getsize(main.DB_FILE) / 2**20, 2)
+        return result
+
+    async def run_tools(self) -> dict:
+        """Cada herramienta por separado y en serie: latencia y llamadas a Notion por llamada."""
+        results = {}
+        for name in ["buscar", "listar_hoy", "listar_filtro", "actualizar", "crear", "recordatorio"]:
+            await self.reset_stats()
+            latencies = []
+            for _ in range(self.args.iterations):
+                func, kwargs = self._tool_request(name, chat_id=1)
+                start = time.perf_counter()
+                with self.main.use_tenant(self.tenant):
+                    await func(**kwargs)
+                latencies.append(time.perf_counter() - start)
+            await self.drain_writes()
+            notion = (await self.stats())["notion"]
+            results[name] = {**summarize(latencies), "notion_calls_per_call": round(notion["requests"] / len(latencies), 2),
+                             "notion_throttled": notion["throttled"]}
+        return results
+
+    async def run_turns(self) -> dict:
+        """Chats concurrentes que envían mensajes por `handle_message` y esperan la respuesta final."""
+        from telegram import Bot, Update
+        from telegram.request import HTTPXRequest
+
+        # Mismo pool que usa Application para el bot de los handlers
+        bot = Bot(BOT_TOKEN, base_url=f"{self.base_url}/telegram/bot", request=HTTPXRequest(connection_pool_size=256))
+        await bot.initialize()
+        # ChatQueue crea sus workers con context.application.create_task, como en Application
+        application = SimpleNamespace(create_task=lambda coroutine, name=None: asyncio.create_task(coroutine, name=name))
+        context = SimpleNamespace(bot=bot, application=application)
+        await self.reset_stats()
+
+        names, weights = zip(*TURN_MIX)
+        latencies, failures, timeouts = [], 0, 0
+        per_chat = [self.args.turns // self.args.chats + (i < self.args.turns % self.args.chats) for i in range(self.args.chats)]
+
+        async def chat_loop(chat_id: int, turns: int):
+            nonlocal failures, timeouts
+            for count in range(1, turns + 1):
+                name = self.rng.choices(names, weights)[0]
+                _, kwargs = self._tool_request(name, chat_id)
+                kwargs.pop("chat_id", None)  # Lo añade execute_tool_call
+                tool = {"listar_hoy": "list_tasks_notion", "listar_filtro": "list_tasks_notion", "actualizar": "update_task_notion",
+                        "crear": "create_task_notion", "recordatorio": "set_reminder_notion"}[name]
+                update = Update.de_json({"update_id": chat_id * 10_000 + count, "message": {
+                    "message_id": count, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+                    "text": json.dumps({"tool": tool, "args": kwargs}, ensure_ascii=False)}}, bot)
+                start = time.time()
+                await self.main.handle_message(update, context)
+                final = (await self.control.get("/wait_final", params={"chat_id": chat_id, "count": count, "timeout": self.args.turn_timeout})).json()
+                if final.get("timeout"):
+                    # Sin respuesta: los turnos siguientes de este chat ya no se podrían emparejar
+                    timeouts += 1
+                    return
+                latencies.append(final["ts"] - start)
+                failures += not final["ok"]
+
+        start = time.perf_counter()
+        await asyncio.gather(*[chat_loop(1000 + i, turns) for i, turns in enumerate(per_chat)])
+        elapsed = time.perf_counter() - start
+        await self.drain_writes()
+        stats = await self.stats()
+        await bot.shutdown()
+
+        turns = max(len(latencies), 1)
+        return {**summarize(latencies), "failed": failures, "timeouts": timeouts,
+                "turns_per_s": round(len(latencies) / elapsed, 2),
+                "notion_calls_per_turn": round(stats["notion"]["requests"] / turns, 2),
+                "openai_calls_per_turn": round(stats["openai"]["requests"] / turns, 2),
+                "telegram_calls_per_turn": round(stats["telegram"]["requests"] / turns, 2),
+                "notion_throttled": stats["notion"]["throttled"], "telegram_throttled": stats["telegram"]["throttled"],
+                "tool_outputs": stats["openai"]["tool_outputs"]}
+
+    async def run_reminders(self) -> dict:
+        """Recordatorios con vencimientos repartidos en una ventana corta: retraso del envío."""
+        from telegram import Bot
+
+        main = self.main
+        # Los recordatorios creados en las fases anteriores no se miden
+        main.REMINDERS.pop_due(float("inf"))
+        bot = Bot(BOT_TOKEN, base_url=f"{self.base_url}/telegram/bot")  # Como en main(): pool por defecto
+        await bot.initialize()
+        await self.reset_stats()
+        since = (await self.control.get("/sent")).json()["next"]
+
+        count, window = self.args.reminders, self.args.reminder_window
+        first_due = time.time() + 1.0
+        due_at = {}
+        for i in range(count):
+            title = f"{REMINDER_PREFIX}{i}"
+            remind_ts = first_due + window * i / max(count, 1)
+            reminder_id = main.storage.insert_reminder(2000 + i % self.args.chats, title, int(remind_ts))
+            main.REMINDERS.add(reminder_id, 2000 + i % self.args.chats, title, remind_ts)
+            due_at[title] = remind_ts
+
+        runner = asyncio.create_task(main.REMINDERS.run(bot))
+        deadline = time.time() + window + 1.0 + count / max(main.TELEGRAM_RATE_LIMIT, 1) + 30
+        # Los recordatorios de un mismo chat que vencen juntos llegan en un solo mensaje
+        lags = []
+        while due_at and time.time() < deadline:
+            response = await self.control.get("/sent", params={"since": since, "min": 1, "timeout": min(5.0, deadline - time.time())})
+            page = response.json()
+            since = page["next"]
+            for ts, _, text in page["messages"]:
+                for title in re.findall(rf"{REMINDER_PREFIX}\d+", text):
+                    if title in due_at:
+                        lags.append(ts - due_at.pop(title))
+        runner.cancel()
+        await main.storage.flush()
+        stats = await self.stats()
+        await bot.shutdown()
+
+        return {**summarize(lags), "missing": len(due_at), "telegram_throttled": stats["telegram"]["throttled"]}
+
+    async def run(self) -> dict:
+        result = {"pages": self.pages}
+        try:
+            result["bootstrap"] = await self.bootstrap()
+            result["tools"] = await self.run_tools()
+            result["turns"] = await self.run_turns()
+            result["reminders"] = await self.run_reminders()
+            result["memory"] = {"rss_final_mb": rss_mb(), "rss_peak_mb": round(peak_rss_mb(), 1),
+                                "indexed_tasks": len(self.tenant.index)}
+        finally:
+            await self.control.aclose()
+            if self.writer is not None:
+                self.writer.cancel()
+            if self.main is not None:
+                await self.main.TENANTS.aclose()
+                await self.main.storage.close()
+        return result
+
+def run_size(args, pages: int, queue):
+    """Proceso hijo: una ejecución con un `main` recién importado en un directorio temporal."""
+    process = None
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.chdir(workdir)
+    try:
+        process, port = start_fake_services(args, pages)
+        queue.put(asyncio.run(BenchRun(args, pages, f"http://127.0.0.1:{port}").run()))
+    except BaseException as e:
+        queue.put({"pages": pages, "error": repr(e)})
+        raise
+    finally:
+        if process is not None:
+            process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def flatten(result: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in result.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def fmt(summary: dict) -> str:
+    if not summary or not summary.get("count"): return "-"
+    return f"{summary['p50_ms']:.1f}/{summary['p99_ms']:.1f}"
+
+def print_report(results: list[dict]):
+    header = ["páginas", "sync s", "buscar ms", "listar hoy ms", "actualizar ms", "turno ms", "Notion/turno", "recordat. ms", "RSS pico MB"]
+    rows = []
+    for r in results:
+        if "error" in r:
+            rows.append([str(r["pages"]), f"ERROR: {r['error']}"])
+            continue
+        rows.append([
+            str(r["pages"]), f"{r['bootstrap']['sync_s']:.2f}",
+            fmt(r["tools"]["buscar"]), fmt(r["tools"]["listar_hoy"]), fmt(r["tools"]["actualizar"]),
+            fmt(r["turns"]), f"{r['turns']['notion_calls_per_turn']:.2f}", fmt(r["reminders"]),
+            f"{r['memory']['rss_peak_mb']:.0f}",
+        ])
+    widths = [max(len(row[i]) for row in [header] + rows if i < len(row)) for i in range(len(header))]
+    print("Latencias como p50/p99.")
+    for row in [header] + rows:
+        print("  ".join(cell.rjust(widths[i]) for i, cell in enumerate(row)))
+    for r in results:
+        if "error" in r: continue
+        turns, reminders = r["turns"], r["reminders"]
+        print(f"\n[{r['pages']} páginas] turnos: {turns['count']} ok, {turns['failed']} con error, {turns['timeouts']} sin respuesta, "
+              f"{turns['turns_per_s']} turnos/s; OpenAI/turno {turns['openai_calls_per_turn']}, Telegram/turno {turns['telegram_calls_per_turn']}; "
+              f"429 de Notion {turns['notion_throttled']}; herramientas {turns['tool_outputs']}")
+        print(f"[{r['pages']} páginas] recordatorios: {reminders.get('count', 0)} enviados, {reminders['missing']} sin enviar, "
+              f"máx. {reminders.get('max_ms', '-')} ms, 429 de Telegram {reminders['telegram_throttled']}")
+        print(f"[{r['pages']} páginas] herramientas (Notion por llamada): "
+              + ", ".join(f"{name} {tool['notion_calls_per_call']}" for name, tool in r["tools"].items()))
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> list[str]:
+    """Devuelve las métricas que empeoraron más de `tolerance` respecto a la referencia."""
+    with open(baseline_path) as f:
+        baseline = {r["pages"]: flatten(r) for r in json.load(f)["results"] if "error" not in r}
+    regressions = []
+    for r in results:
+        reference = baseline.get(r["pages"])
+        if reference is None or "error" in r: continue
+        for name, value in flatten(r).items():
+            old = reference.get(name)
+            if old is None or not name.endswith(COMPARABLE_SUFFIXES) or name.startswith("bootstrap.rss"): continue
+            # Margen absoluto para no marcar ruido en valores muy pequeños (p. ej. 0.1 ms -> 0.2 ms)
+            if value > old * (1 + tolerance) and value - old > 1:
+                regressions.append(f"{r['pages']} páginas: {name} {old} -> {value}")
+    return regressions
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for pages in [int(p) for p in args.pages.split(",")]:
+        print(f"Ejecutando benchmark con {pages} páginas...", flush=True)
+        queue = ctx.Queue()
+        process = ctx.Process(target=run_size, args=(args, pages, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+
+    print()
+    print_report(results)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        print("\nSin regresiones respecto a la referencia." if not regressions else "\nRegresiones:\n  " + "\n  ".join(regressions))
+        if regressions: return 1
+    return 1 if any("error" in r for r in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,43 @@
-import nest_asyncio
+import time
+STARTUP_T0 = time.perf_counter()  # Inicio del proceso, para medir el arranque (ver --startup-time)
 import os
+import sys
 import json
-import openai
-from notion_client import Client as NotionClient
+import signal
+import httpx
+from notion_client import AsyncClient as NotionAsyncClient, APIErrorCode
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-import dateparser
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 import asyncio
 import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-import time
 import pytz
 from telegram import Bot, Update
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-import sqlite3
+import threading
+import contextvars
 import re
+import zlib
+import uuid
+import hashlib
+import heapq
 from unidecode import unidecode
 import string
-from difflib import get_close_matches
-
-# Aplica nest_asyncio para permitir bucles de eventos anidados (necesario para apscheduler y PTB)
-nest_asyncio.apply()
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from difflib import SequenceMatcher
+from collections import Counter, OrderedDict, defaultdict
+from storage import Storage
+from metrics import METRICS, StartupTimer, span, turn_trace, start_metrics_server
+
+# openai y dateparser, los módulos más pesados, no se importan aquí: se cargan en su primer
+# uso o al precalentar en segundo plano, cuando el bot ya está recibiendo updates.
+STARTUP = StartupTimer(STARTUP_T0)
+STARTUP.mark("imports")
 
 # -----------------------------------------------------------------------------
 # 1. CONFIGURACIÓN Y CONSTANTES
@@ -41,10 +57,54 @@ NOTION_DATABASE_ID = os.getenv("NOTION_DATABASE_ID")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")
 ASSISTANT_ID = os.getenv("ASSISTANT_ID")
 TELEGRAM_CHAT_ID_BRIEFING = os.getenv("TELEGRAM_CHAT_ID") # Para el briefing proactivo
+TENANTS_FILE = os.getenv("TENANTS_FILE") # JSON con los tenants (chats -> credenciales y base de datos de Notion); sin él se usa un único tenant con las variables NOTION_*
+SCHEDULER_PARTITIONS = max(1, int(os.getenv("SCHEDULER_PARTITIONS", "4"))) # Particiones entre las que se reparten los recordatorios y los jobs de los tenants
 BRIEFING_TIME = os.getenv("BRIEFING_TIME", "08:00") # Hora para el briefing
+BRIEFING_PREPARE_MINUTES = int(os.getenv("BRIEFING_PREPARE_MINUTES", "5")) # Minutos antes de BRIEFING_TIME en que se sincroniza y prepara
+BRIEFING_UPCOMING_DAYS = int(os.getenv("BRIEFING_UPCOMING_DAYS", "3")) # Días que cubre la sección "próximos días" del briefing
+BRIEFING_DONE_STATUSES = tuple(s.strip() for s in os.getenv("BRIEFING_DONE_STATUSES", "Listo,Hecho,Completado,Completada").split(",") if s.strip()) # Estados que no cuentan como atrasadas
+BRIEFING_SECTION_LIMIT = 15 # Tareas como máximo por sección del briefing (el resto se resume)
+TASK_SYNC_INTERVAL = int(os.getenv("TASK_SYNC_INTERVAL", "60")) # Segundos entre sincronizaciones incrementales del espejo
+TASK_FULL_SYNC_HOURS = int(os.getenv("TASK_FULL_SYNC_HOURS", "6")) # Horas entre resincronizaciones completas (detecta tareas archivadas)
+NOTION_PAGE_SIZE = min(int(os.getenv("NOTION_PAGE_SIZE", "100")), 100) # Resultados por página en las consultas a Notion (máx. 100)
+NOTION_RATE_LIMIT = float(os.getenv("NOTION_RATE_LIMIT", "3")) # Peticiones por segundo permitidas hacia Notion
+NOTION_MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "4")) # Reintentos ante 429, 5xx y timeouts de Notion
+NOTION_WRITE_DELAY = float(os.getenv("NOTION_WRITE_DELAY", "1.0")) # Segundos que espera una escritura antes de enviarse (se fusionan las ediciones seguidas)
+NOTION_WRITE_RETRY_SECONDS = 5 # Primera espera tras un fallo al enviar una escritura; se duplica hasta NOTION_WRITE_MAX_BACKOFF
+NOTION_WRITE_MAX_BACKOFF = 600
+RUN_STREAMING = os.getenv("RUN_STREAMING", "true").lower() != "false" # Runs del asistente por streaming de eventos (si no, polling)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0")) # Segundos mínimos entre ediciones del mensaje parcial
+RUN_POLL_INITIAL_DELAY = 0.2 # Polling de respaldo: primera espera, que crece hasta RUN_POLL_MAX_DELAY
+RUN_POLL_MAX_DELAY = 2.0
+TELEGRAM_RATE_LIMIT = float(os.getenv("TELEGRAM_RATE_LIMIT", "25")) # Mensajes por segundo al enviar recordatorios (Telegram admite ~30)
+TELEGRAM_CHAT_RATE_LIMIT = float(os.getenv("TELEGRAM_CHAT_RATE_LIMIT", "1")) # Mensajes por segundo a un mismo chat (Telegram admite ~1)
+REMINDER_RETRY_SECONDS = 60 # Primera espera antes de reintentar un recordatorio cuyo envío falló; se duplica en cada intento
+REMINDER_MAX_BACKOFF = 900
+REMINDER_MAX_ATTEMPTS = 5 # Intentos de envío antes de dar un recordatorio por fallido
+REMINDERS_PER_MESSAGE = 20 # Recordatorios de un mismo chat que vencen juntos y se agrupan en un solo mensaje
+THREAD_CACHE_SIZE = int(os.getenv("THREAD_CACHE_SIZE", "1000")) # Chats cuyo thread se mantiene en memoria
+THREAD_IDLE_HOURS = float(os.getenv("THREAD_IDLE_HOURS", "24")) # Tras este tiempo sin mensajes, el chat empieza un thread nuevo
+MAX_CONCURRENT_RUNS = int(os.getenv("MAX_CONCURRENT_RUNS", "20")) # Runs del asistente en paralelo (entre todos los chats)
+MAX_PENDING_MESSAGES = int(os.getenv("MAX_PENDING_MESSAGES", "500")) # Mensajes aceptados sin terminar de procesar antes de frenar la entrada
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower() # "polling" (getUpdates) o "webhook" (Telegram envía los updates por HTTP)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL") # URL pública del webhook (Render define RENDER_EXTERNAL_URL)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") # Opcional: Telegram lo envía en cada update y se rechazan los que no lo traen
+PORT = int(os.getenv("PORT", "8080")) # Puerto del servidor del webhook
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000")) # Updates recibidos a la espera de entrar en la cola de chats
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) # Puerto del endpoint /metrics (Prometheus); 0 lo desactiva
+METRICS_TRACE = os.getenv("METRICS_TRACE", "false").lower() == "true" # Registra en el log la traza de tiempos de cada turno
+LOCAL_INTENTS = os.getenv("LOCAL_INTENTS", "true").lower() != "false" # Resuelve sin el asistente los pedidos simples (listar hoy/mañana, completar, recordatorios)
+LOCAL_INTENT_MIN_SIMILARITY = 0.85 # Similitud mínima entre lo escrito y el título para actuar sin preguntar al asistente
+SEMANTIC_SEARCH = os.getenv("SEMANTIC_SEARCH", "false").lower() == "true" # Búsqueda de tareas también por parecido (vectores de n-gramas); requiere numpy
+SEMANTIC_DIMENSIONS = int(os.getenv("SEMANTIC_DIMENSIONS", "128")) # Dimensiones de los vectores: más reduce las colisiones y ocupa más memoria
+SEMANTIC_TOP_K = 5 # Tareas más parecidas por vectores que compiten con la mejor por palabras
+SEMANTIC_MIN_SCORE = 0.3 # Coseno mínimo para que una tarea cuente como parecida
+SEMANTIC_WEIGHT = 2.0 # Peso del coseno frente a `palabras_en_común * 2 + similitud`
+SEMANTIC_WORD_CUTOFF = 0.8 # Parecido (difflib) para que dos palabras cuenten como la misma con una errata
+DATE_CACHE_SIZE = 512 # Expresiones de fecha normalizadas que se recuerdan durante el día
 
 # --- Verificación de variables de entorno ---
-if not all([OPENAI_API_KEY, NOTION_API_TOKEN, NOTION_DATABASE_ID, TELEGRAM_BOT_TOKEN, ASSISTANT_ID]):
+if not all([OPENAI_API_KEY, TELEGRAM_BOT_TOKEN, ASSISTANT_ID]) or not (TENANTS_FILE or (NOTION_API_TOKEN and NOTION_DATABASE_ID)):
     logger.critical("ERROR: Faltan una o más variables de entorno (API keys o Assistant ID). El bot no puede iniciar.")
     exit()
 
@@ -85,35 +145,42 @@ Tu objetivo es ser la mejor asistente que Mau podría tener, haciendo su vida m
 """
 
 # --- Inicialización de Clientes ---
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
-notion = NotionClient(auth=NOTION_API_TOKEN)
-
-# --- Almacenamiento en memoria para Threads de Conversación ---
-USER_THREADS = {}  # {chat_id: thread_id}
+# El cliente de OpenAI se crea en su primer uso (ver openai_client, en la sección 4).
+# Los clientes de Notion son por tenant (ver Tenant y TenantRegistry, en la sección 2)
 
 # --- Constantes de la Base de Datos ---
 DB_FILE = "reminders.db"
+storage = Storage(DB_FILE)
+
+# --- Propiedades de Notion que usa el bot (el resto no se pide en las consultas) ---
+TASK_PROPERTIES = ["Nombre de tarea", "Estado", "Fecha límite", "Etiquetas", "Descripción"]
+# Prefijo de los IDs de las tareas creadas en el espejo que aún no existen en Notion
+LOCAL_ID_PREFIX = "local-"
+
+# Umbral de similitud de difflib usado para puntuar títulos (equivale a get_close_matches(cutoff=0.6))
+SIMILARITY_CUTOFF = 0.6
+# Bit de cada carácter de un título normalizado en las cuentas de caracteres de TaskIndex; el resto comparte uno
+CHAR_BITS = {char: bit for bit, char in enumerate(" " + string.ascii_lowercase + string.digits)}
+OTHER_CHAR_BIT = len(CHAR_BITS)
+CHAR_LEVEL_WIDTH = OTHER_CHAR_BIT + 1
+# Con más tareas posibles que esto, TaskIndex las prueba en orden del espejo y para en la primera similar
+ORDERED_SCAN_MIN_POOL = 2000
 
 # -----------------------------------------------------------------------------
 # 2. FUNCIONES DE BASE DE DATOS Y UTILIDADES
 # -----------------------------------------------------------------------------
 
 def init_db():
-    """Inicializa la base de datos para recordatorios."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS reminders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        chat_id INTEGER NOT NULL,
-        task_title TEXT NOT NULL,
-        remind_time TIMESTAMP NOT NULL,
-        status TEXT DEFAULT 'pending'
-    )
-    """)
-    conn.commit()
-    conn.close()
-    logger.info("Base de datos de recordatorios inicializada.")
+    """Abre la base de datos local (recordatorios y espejo de tareas) y aplica sus migraciones."""
+    storage.open()
+    logger.info("Base de datos de recordatorios y espejo de tareas inicializada.")
+
+def webhook_secret_token(secret: str | None) -> str | None:
+    """El secreto tal cual si Telegram lo admite (1-256 de A-Z, a-z, 0-9, _ y -); si no, su SHA-256 en hexadecimal."""
+    if not secret or re.fullmatch(r"[A-Za-z0-9_-]{1,256}", secret):
+        return secret
+    # El generateValue de Render es base64 (puede traer +, / y =)
+    return hashlib.sha256(secret.encode()).hexdigest()
 
 def normalize_title(title: str) -> str:
     """Normaliza un título para búsqueda: minúsculas, sin tildes, sin puntuación."""
@@ -122,40 +189,1034 @@ def normalize_title(title: str) -> str:
     title = title.translate(str.maketrans('', '', string.punctuation))
     return " ".join(title.split())
 
-def find_task_by_title_enhanced(title_to_find: str) -> tuple[str | None, str | None]:
-    """Busca una tarea en Notion por relevancia. Devuelve (task_id, real_title)."""
+class TokenBucket:
+    """Limitador de tasa tipo token bucket compartido por todas las corrutinas."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = max(1.0, capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Detiene todas las peticiones durante `seconds` (p. ej. por un `Retry-After`)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class NotionGateway:
+    """
+    Acceso asíncrono a Notion. Todas las llamadas comparten una sesión HTTP con pool de
+    conexiones y pasan por un token bucket que respeta el límite de Notion (~3 req/s) y
+    los `Retry-After` de sus 429. Las lecturas idénticas que están en curso a la vez se
+    agrupan: las llamadas concurrentes esperan la misma petición en vez de repetirla.
+
+    Las lecturas y `pages.update` (que fija valores absolutos) se reintentan ante 5xx y
+    fallos de red. `pages.create` no: repetirlo tras un timeout o un 5xx puede duplicar la
+    página si Notion ya la había creado, así que solo se reintenta cuando consta que no
+    llegó a procesarse (un 429 o un fallo al conectar).
+    """
+
+    READ_METHODS = {"databases.query", "databases.retrieve", "pages.retrieve"}
+    IDEMPOTENT_METHODS = READ_METHODS | {"pages.update"}
+    # 409 conflict_error: escrituras concurrentes sobre la misma página; Notion pide reintentar
+    RETRYABLE_CODES = {APIErrorCode.RateLimited, APIErrorCode.InternalServerError, APIErrorCode.ServiceUnavailable,
+                       APIErrorCode.ConflictError}
+
+    def __init__(self, auth: str, rate: float = NOTION_RATE_LIMIT, max_retries: int = NOTION_MAX_RETRIES, base_url: str = None):
+        self._http = httpx.AsyncClient(limits=httpx.Limits(max_connections=10, max_keepalive_connections=10))
+        # `base_url` permite apuntar a otro servidor (p. ej. el Notion falso de bench/)
+        options = {"base_url": base_url} if base_url else {}
+        self.client = NotionAsyncClient(auth=auth, client=self._http, **options)
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self._inflight = {}  # {(método, argumentos): Future}
+
+    async def request(self, method: str, **kwargs):
+        """Ejecuta `method` (p. ej. "pages.update") del cliente de Notion con los argumentos dados."""
+        with span("notion", method=method):
+            if method not in self.READ_METHODS:
+                return await self._send(method, kwargs)
+
+            key = (method, json.dumps(kwargs, sort_keys=True, default=str))
+            future = self._inflight.get(key)
+            if future is None:
+                future = asyncio.ensure_future(self._send(method, kwargs))
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            else:
+                METRICS.inc("olivia_notion_coalesced_total", method=method)
+            return await asyncio.shield(future)
+
+    async def _send(self, method: str, kwargs: dict):
+        endpoint_name, action = method.split(".")
+        func = getattr(getattr(self.client, endpoint_name), action)
+        idempotent = method in self.IDEMPOTENT_METHODS
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            METRICS.inc("olivia_notion_requests_total", method=method)
+            try:
+                return await func(**kwargs)
+            except HTTPResponseError as e:
+                # APIResponseError trae un código de Notion; un HTTPResponseError sin código es un 5xx del proxy
+                code = getattr(e, "code", None)
+                retryable = code in self.RETRYABLE_CODES if code else e.status >= 500
+                if not idempotent:
+                    retryable = code == APIErrorCode.RateLimited or e.status == 429
+                if not retryable or attempt == self.max_retries: raise
+                delay = float(e.headers.get("Retry-After", 2 ** attempt))
+                if code == APIErrorCode.RateLimited:
+                    self.bucket.pause(delay)
+                    METRICS.inc("olivia_notion_rate_limited_total", method=method)
+                METRICS.inc("olivia_notion_retries_total", method=method, reason=str(e.status))
+                logger.warning(f"Notion respondió {e.status} en {method}; reintento {attempt + 1} en {delay:.1f}s.")
+            except (RequestTimeoutError, httpx.TransportError) as e:
+                if attempt == self.max_retries or not (idempotent or self._never_sent(e)): raise
+                delay = 2 ** attempt
+                METRICS.inc("olivia_notion_retries_total", method=method, reason="network")
+                logger.warning(f"Fallo de red con Notion en {method} ({e}); reintento {attempt + 1} en {delay:.1f}s.")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _never_sent(error: Exception) -> bool:
+        """Si el fallo de red ocurrió antes de que la petición llegara a Notion (no se pudo conectar)."""
+        # notion_client convierte los timeouts de httpx en RequestTimeoutError dentro del except
+        cause = error.__context__ if isinstance(error, RequestTimeoutError) else error
+        return isinstance(cause, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+    async def aclose(self):
+        await self._http.aclose()
+
+class SemanticIndex:
+    """
+    Índice vectorial (n-gramas con hashing y NumPy, sin modelos ni red) de títulos y descripciones,
+    para encontrar una tarea sin las palabras exactas ("facturacion" ~ "facturas").
+    """
+
+    def __init__(self, np, dimensions: int = SEMANTIC_DIMENSIONS):
+        self._np = np
+        self.dimensions = dimensions
+        self._vectors = np.zeros((1024, dimensions), dtype=np.float32)
+        self._rows = {}  # {task_id: fila de la matriz}
+        self._ids = []  # [task_id o None] por fila
+        self._free = []  # filas de tareas eliminadas, para reutilizar
+        self._word_vectors = {}  # {palabra: vector de sus n-gramas}, las palabras se repiten mucho entre tareas
+        self._postings = defaultdict(set)  # {palabra del título o raíz de 5 letras: {fila}}
+        self._posting_arrays = {}  # {palabra o raíz: filas en un array}, se rehace al cambiar
+        self._row_keys = {}  # {fila: palabras y raíces de su título}
+
+    @classmethod
+    def create(cls):
+        """Crea el índice si NumPy está instalado; si no, la búsqueda sigue solo por palabras."""
+        try:
+            import numpy
+        except ImportError:
+            logger.warning("SEMANTIC_SEARCH está activado pero numpy no está instalado; se busca solo por palabras.")
+            return None
+        return cls(numpy)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _word_vector(self, word: str):
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            if len(self._word_vectors) > 20_000:
+                self._word_vectors.clear()
+            vector = self._np.zeros(self.dimensions, dtype=self._np.float32)
+            # Palabra, prefijo de 5 letras (una raíz aproximada: "factura" y "facturación") y trigramas
+            padded = f"<{word}>"
+            for gram in [word, f"{word[:5]}*"] + [padded[i:i + 3] for i in range(len(padded) - 2)]:
+                # hash() cambia entre procesos, pero los vectores nunca salen de memoria
+                h = hash(gram)
+                vector[h % self.dimensions] += 1.0 if h & 0x100000 else -1.0
+            self._word_vectors[word] = vector
+        return vector
+
+    @staticmethod
+    def _keys(norm_title: str) -> set:
+        """Palabras de 3+ letras del título y raíces de 5 letras, las mismas que acepta TaskIndex._shares_word."""
+        keys = set()
+        for word in norm_title.split():
+            if len(word) < 3: continue
+            keys.add(word)
+            if len(word) >= 5: keys.add(f"{word[:5]}*")
+        return keys
+
+    def vectorize(self, norm_title: str, norm_description: str = ""):
+        vector = self._np.zeros(self.dimensions, dtype=self._np.float32)
+        for text, weight in ((norm_title, 1.0), (norm_description, 0.3)):
+            for word in text.split():
+                if len(word) < 3: continue  # Artículos y preposiciones solo meten ruido
+                vector += self._word_vector(word) * weight
+        norm = float(vector @ vector) ** 0.5
+        if norm: vector /= norm
+        return vector
+
+    def add(self, task_id: str, norm_title: str, description: str | None = None):
+        row = self._rows.get(task_id)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                row = len(self._ids)
+                self._ids.append(None)
+                if row == len(self._vectors):
+                    grown = self._np.zeros((2 * len(self._vectors), self.dimensions), dtype=self._np.float32)
+                    grown[:row] = self._vectors
+                    self._vectors = grown
+            self._rows[task_id] = row
+            self._ids[row] = task_id
+        self._vectors[row] = self.vectorize(norm_title, normalize_title((description or "")[:500]))
+        self._unpost(row)
+        self._row_keys[row] = self._keys(norm_title)
+        for key in self._row_keys[row]:
+            self._postings[key].add(row)
+            self._posting_arrays.pop(key, None)
+
+    def _unpost(self, row: int):
+        for key in self._row_keys.pop(row, ()):
+            self._postings[key].discard(row)
+            if not self._postings[key]: del self._postings[key]
+            self._posting_arrays.pop(key, None)
+
+    def remove(self, task_id: str):
+        row = self._rows.pop(task_id, None)
+        if row is not None:
+            self._vectors[row] = 0
+            self._ids[row] = None
+            self._free.append(row)
+            self._unpost(row)
+
+    def clear(self):
+        self._vectors[:] = 0
+        self._rows.clear()
+        self._ids.clear()
+        self._free.clear()
+        for mapping in (self._postings, self._posting_arrays, self._row_keys):
+            mapping.clear()
+
+    def similarity(self, task_id: str, query_vector) -> float:
+        row = self._rows.get(task_id)
+        return float(self._vectors[row] @ query_vector) if row is not None else 0.0
+
+    def search(self, query_vector, k: int, norm_title: str) -> list[tuple[str, float]]:
+        """Las `k` tareas con mayor coseno entre las que comparten palabra o raíz con `norm_title`: [(task_id, coseno)]."""
+        np = self._np
+        arrays = []
+        for key in self._keys(norm_title) & self._postings.keys():
+            array = self._posting_arrays.get(key)
+            if array is None:
+                array = self._posting_arrays[key] = np.fromiter(self._postings[key], dtype=np.intp)
+            arrays.append(array)
+        if not arrays: return []
+        if len(arrays) == 1:
+            rows = arrays[0]
+        else:
+            mask = np.zeros(len(self._ids), dtype=bool)
+            for array in arrays:
+                mask[array] = True
+            rows = np.flatnonzero(mask)
+        # Con más de media matriz es más rápido multiplicarla entera que copiar las filas
+        scores = (self._vectors[:len(self._ids)] @ query_vector)[rows] if 2 * len(rows) > len(self._ids) else self._vectors[rows] @ query_vector
+        k = min(k, len(scores))
+        top = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+        top = top[np.argsort(-scores[top])]
+        return [(self._ids[rows[i]], float(scores[i])) for i in top]
+
+class TaskIndex:
+    """
+    Índice en memoria sobre los títulos del espejo de tareas para búsquedas difusas rápidas.
+    Devuelve lo mismo que la puntuación lineal `palabras_en_común * 2 + similitud` (bench/check_index.py lo comprueba).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._order = {}  # {task_id: orden en el espejo}, decide los empates igual que el recorrido lineal
+        self._titles = {}  # {task_id: real_title}
+        self._norm_titles = {}  # {task_id: norm_title}
+        self._char_counts = {}  # {task_id: caracteres del título en bits por niveles, ver _char_levels}
+        self._lengths = defaultdict(set)  # {longitud del título: {task_id}}
+        self._words = defaultdict(set)  # {palabra: {task_id}}
+        self._next_order = 0
+        self._semantic = SemanticIndex.create() if SEMANTIC_SEARCH else None
+
+    @staticmethod
+    def _char_levels(norm_title: str) -> int:
+        """
+        Cuenta de cada carácter en bits por niveles (el bit `bit + nivel * CHAR_LEVEL_WIDTH`, si aparece más de `nivel` veces):
+        `(a & b).bit_count()` es la cota de caracteres en común de quick_ratio.
+        """
+        levels = 0
+        for bit, count in Counter(CHAR_BITS.get(char, OTHER_CHAR_BIT) for char in norm_title).items():
+            for level in range(count):
+                levels |= 1 << (bit + level * CHAR_LEVEL_WIDTH)
+        return levels
+
+    @staticmethod
+    def _is_similar(norm_title_to_find: str, norm_title: str) -> bool:
+        # Mismas comprobaciones (y en el mismo orden) que difflib.get_close_matches,
+        # empezando por la cota de longitudes que no necesita construir el matcher.
+        total_length = len(norm_title) + len(norm_title_to_find)
+        if not total_length or 2 * min(len(norm_title), len(norm_title_to_find)) / total_length < SIMILARITY_CUTOFF:
+            return False
+        matcher = SequenceMatcher(None, norm_title, norm_title_to_find)
+        return matcher.quick_ratio() >= SIMILARITY_CUTOFF and matcher.ratio() >= SIMILARITY_CUTOFF
+
+    @staticmethod
+    def _shares_word(query_words: set, norm_title: str) -> bool:
+        """Si alguna palabra buscada (de 3+ letras) está en el título, con su misma raíz de 5 letras o casi igual."""
+        title_words = norm_title.split()
+        for word in query_words:
+            if len(word) < 3: continue
+            for title_word in title_words:
+                if word == title_word or (len(word) >= 5 and word[:5] == title_word[:5]):
+                    return True
+                if SequenceMatcher(None, word, title_word).ratio() >= SEMANTIC_WORD_CUTOFF:
+                    return True
+        return False
+
+    def __len__(self):
+        return len(self._titles)
+
+    def add(self, task_id: str, real_title: str, norm_title: str, description: str | None = None):
+        """Añade o actualiza (p. ej. al renombrar) una tarea en el índice."""
+        with self._lock:
+            if self._semantic is not None:
+                if real_title:
+                    self._semantic.add(task_id, norm_title, description)
+                else:
+                    self._semantic.remove(task_id)
+            if task_id in self._titles:
+                if self._norm_titles[task_id] == norm_title and real_title:
+                    self._titles[task_id] = real_title
+                    return
+                self._unindex(task_id)
+            if not real_title: return
+            if task_id not in self._order:
+                self._order[task_id] = self._next_order
+                self._next_order += 1
+            self._titles[task_id] = real_title
+            self._norm_titles[task_id] = norm_title
+            self._char_counts[task_id] = self._char_levels(norm_title)
+            self._lengths[len(norm_title)].add(task_id)
+            for word in set(norm_title.split()):
+                self._words[word].add(task_id)
+
+    def remove(self, task_id: str):
+        """Elimina una tarea del índice (p. ej. al archivarla)."""
+        with self._lock:
+            if task_id in self._titles:
+                self._unindex(task_id)
+            self._order.pop(task_id, None)
+            if self._semantic is not None:
+                self._semantic.remove(task_id)
+
+    def _unindex(self, task_id: str):
+        norm_title = self._norm_titles.pop(task_id)
+        del self._titles[task_id], self._char_counts[task_id]
+        self._lengths[len(norm_title)].discard(task_id)
+        if not self._lengths[len(norm_title)]: del self._lengths[len(norm_title)]
+        for word in set(norm_title.split()):
+            self._words[word].discard(task_id)
+            if not self._words[word]: del self._words[word]
+
+    def clear(self):
+        with self._lock:
+            for mapping in (self._order, self._titles, self._norm_titles, self._char_counts, self._lengths, self._words):
+                mapping.clear()
+            self._next_order = 0
+            if self._semantic is not None:
+                self._semantic.clear()
+
+    def search(self, norm_title_to_find: str) -> tuple[str | None, str | None]:
+        """Devuelve (task_id, real_title) de la tarea con mejor puntuación, o (None, None)."""
+        with self._lock:
+            # Solo las tareas con el máximo de palabras en común pueden ganar; entre ellas
+            # gana la primera (en orden del espejo) que además sea similar
+            postings = sorted((self._words[word] for word in set(norm_title_to_find.split()) if word in self._words), key=len)
+            common = postings[0].intersection(*postings[1:]) if len(postings) > 1 else None
+            if common:
+                # Alguna tarea tiene todas las palabras: solo compiten esas (se resuelve con una intersección)
+                candidates, best_keyword_score = common, len(postings)
+            else:
+                candidates, best_keyword_score = self._best_keyword_matches(postings)
+
+            # Sin palabras en común, solo puntúa la similitud y compiten todas las tareas
+            similar = self._first_similar(norm_title_to_find, candidates if best_keyword_score else None)
+            if similar:
+                return self._rerank(norm_title_to_find, similar, best_keyword_score * 2 + 1)
+            if best_keyword_score:
+                if len(candidates) > ORDERED_SCAN_MIN_POOL:
+                    # Muchas empatadas (palabras frecuentes): la primera suele aparecer pronto en el espejo
+                    first = next(task_id for task_id in self._order if task_id in candidates)
+                else:
+                    first = min(candidates, key=self._order.__getitem__)
+                return self._rerank(norm_title_to_find, first, best_keyword_score * 2)
+            return self._rerank(norm_title_to_find, None, 0)
+
+    @staticmethod
+    def _best_keyword_matches(postings: list[set]) -> tuple[set, int]:
+        """Tareas con el máximo de palabras en común y ese máximo, a partir de las listas de cada palabra (de menor a mayor)."""
+        # Una tarea con k palabras en común aparece en alguna de las (n - k + 1) listas más
+        # cortas, así que se prueba k = n, n-1, ... contando solo sobre esa unión: la lista de
+        # una palabra muy frecuente solo se recorre si ninguna tarea tiene más de una en común.
+        if len(postings) == 1:
+            return postings[0], 1
+        candidates, seen, best_keyword_score = set(), set(), 0
+        for k in range(len(postings), 0, -1):
+            position = len(postings) - k
+            if k == 1 and best_keyword_score <= 1:
+                # Las de la lista más larga que no están en las demás tienen exactamente 1 palabra
+                candidates |= postings[position] - seen
+                best_keyword_score = 1
+                break
+            pending = postings[position] - seen
+            if pending:
+                # Palabras en común (además de esta) de cada tarea, contadas con intersecciones de conjuntos
+                extra = Counter()
+                for posting in postings[position + 1:]:
+                    extra.update(pending & posting)
+                score = 1 + max(extra.values(), default=0)
+                if score >= best_keyword_score:
+                    found = {task_id for task_id, count in extra.items() if count == score - 1} if score > 1 else pending
+                    candidates = candidates | found if score == best_keyword_score else found
+                    best_keyword_score = score
+            seen |= postings[position]
+            if best_keyword_score >= k: break
+        return candidates, best_keyword_score
+
+    def _first_similar(self, norm_title_to_find: str, candidates: set | None) -> str | None:
+        """Primera tarea de `candidates` (todas si es None), en orden del espejo, que difflib.get_close_matches da por similar."""
+        # Las coincidencias no superan el título más corto ni, por carácter, las veces en ambos:
+        # esas cotas descartan longitudes enteras y casi todas las tareas sin ejecutar difflib
+        query_length = len(norm_title_to_find)
+        query_levels = self._char_levels(norm_title_to_find)
+        cutoff, char_counts = SIMILARITY_CUTOFF, self._char_counts
+        # Mínimo de caracteres en común para alcanzar el umbral en cada longitud compatible, con la misma cuenta que difflib
+        needed_by_length, pool_size = {}, 0
+        for length, bucket in self._lengths.items():
+            total = length + query_length
+            if 2.0 * min(length, query_length) / total < cutoff: continue
+            needed_by_length[length] = next(matches for matches in range(min(length, query_length) + 1) if 2.0 * matches / total >= cutoff)
+            pool_size += len(bucket)
+        if candidates is not None:
+            pool_size = min(pool_size, len(candidates))
+
+        matcher = SequenceMatcher(None, "", norm_title_to_find)
+        if pool_size > ORDERED_SCAN_MIN_POOL:
+            # Muchas tareas posibles: se recorren en orden del espejo y se para en la primera similar
+            norm_titles = self._norm_titles
+            for task_id in self._order:
+                if candidates is not None and task_id not in candidates: continue
+                norm_title = norm_titles.get(task_id)
+                needed = needed_by_length.get(len(norm_title)) if norm_title is not None else None
+                if needed is None or (char_counts[task_id] & query_levels).bit_count() < needed: continue
+                matcher.set_seq1(norm_title)
+                if matcher.ratio() >= cutoff:
+                    return task_id
+            return None
+
+        survivors = []
+        for length, needed in needed_by_length.items():
+            bucket = self._lengths[length]
+            pool = bucket if candidates is None else bucket & candidates
+            survivors.extend([task_id for task_id in pool if (char_counts[task_id] & query_levels).bit_count() >= needed])
+        survivors.sort(key=self._order.__getitem__)
+        for task_id in survivors:
+            matcher.set_seq1(self._norm_titles[task_id])
+            if matcher.ratio() >= cutoff:
+                return task_id
+        return None
+
+    def _rerank(self, norm_title_to_find: str, task_id: str | None, score: int) -> tuple[str | None, str | None]:
+        """Con el índice semántico, la mejor tarea por palabras (con puntuación `score`) compite con las más parecidas por vectores."""
+        # El coseno solo no basta: con muchas tareas siempre hay alguna parecida por n-gramas sueltos
+        query_vector = self._semantic.vectorize(norm_title_to_find) if self._semantic is not None and len(self._semantic) else None
+        # Sin palabras de 3+ letras el vector es nulo y no hace falta recorrer la matriz
+        if query_vector is not None and query_vector.any():
+            best_score = score + SEMANTIC_WEIGHT * self._semantic.similarity(task_id, query_vector) if task_id else 0
+            query_words = set(norm_title_to_find.split())
+            for candidate, cosine in self._semantic.search(query_vector, SEMANTIC_TOP_K, norm_title_to_find):
+                if cosine < SEMANTIC_MIN_SCORE: break
+                if candidate == task_id: continue
+                norm_title = self._norm_titles[candidate]
+                similar = self._is_similar(norm_title_to_find, norm_title)
+                if not (similar or self._shares_word(query_words, norm_title)): continue
+                candidate_score = len(query_words & set(norm_title.split())) * 2 + similar + SEMANTIC_WEIGHT * cosine
+                if candidate_score > best_score:
+                    task_id, best_score = candidate, candidate_score
+        return (task_id, self._titles[task_id]) if task_id else (None, None)
+
+# --- Tenants: cada uno con sus credenciales, base de datos, límite de tasa y caché de tareas ---
+
+class Tenant:
+    """
+    Un usuario (o equipo) con su propia base de datos de Notion. Cada tenant tiene su
+    cliente de Notion, y con él su propio token bucket, además de su índice de títulos,
+    su briefing y su estado de sincronización: un workspace lento o una base de datos
+    enorme no consume el presupuesto de los demás.
+    """
+
+    def __init__(self, tenant_id: str, notion: NotionGateway, database_id: str, chat_ids=(), briefing_chat_ids=(),
+                 briefing_time: str = BRIEFING_TIME, is_default: bool = False):
+        self.id = tenant_id
+        self.notion = notion
+        self.database_id = database_id
+        self.chat_ids = [int(chat_id) for chat_id in chat_ids]
+        self.briefing_chat_ids = [int(chat_id) for chat_id in briefing_chat_ids]
+        self.briefing_time = briefing_time
+        self.is_default = is_default  # Atiende a los chats que no aparecen en ningún tenant
+        self.partition = zlib.crc32(tenant_id.encode()) % SCHEDULER_PARTITIONS
+        self.index = TaskIndex()
+        # Evita que dos sincronizaciones del espejo de este tenant corran a la vez
+        self.sync_lock = asyncio.Lock()
+        # Se activa cuando el espejo tiene datos; mientras tanto las lecturas van directo a Notion
+        self.mirror_ready = threading.Event()
+        self.property_ids = None  # Se resuelven una vez con databases.retrieve
+        self.status_options = set()  # Estados válidos de la propiedad "Estado" (vacío si no se conocen)
+        self.pending_pages = set()  # Páginas con escrituras pendientes de enviar a Notion
+        self.created_pages = {}  # {ID local: ID en Notion} de las tareas creadas en segundo plano
+        self.briefing = DailyBriefing(tenant_id)
+
+    def __repr__(self):
+        return f"Tenant({self.id!r})"
+
+class TenantRegistry:
+    """
+    Tenants configurados y el chat -> tenant de cada chat. Sin TENANTS_FILE hay un único
+    tenant 'default' con NOTION_API_TOKEN y NOTION_DATABASE_ID que atiende a todos los chats.
+
+    Formato de TENANTS_FILE:
+        {"tenants": [{"id": "mau", "notion_token_env": "NOTION_TOKEN_MAU", "database_id": "...",
+                      "chats": [123], "briefing_chats": [123], "briefing_time": "08:00",
+                      "rate_limit": 3, "default": false}]}
+    (`notion_token` admite el token directamente en lugar de `notion_token_env`).
+    """
+
+    def __init__(self):
+        self._tenants = {}  # {tenant_id: Tenant}
+        self._by_chat = {}  # {chat_id: Tenant}
+        self._default = None
+
+    def __iter__(self):
+        return iter(list(self._tenants.values()))
+
+    def __len__(self):
+        return len(self._tenants)
+
+    def add(self, tenant: Tenant):
+        if tenant.id in self._tenants:
+            raise ValueError(f"El tenant '{tenant.id}' está repetido.")
+        for chat_id in tenant.chat_ids:
+            if chat_id in self._by_chat:
+                raise ValueError(f"El chat {chat_id} está asignado a los tenants '{self._by_chat[chat_id].id}' y '{tenant.id}'.")
+            self._by_chat[chat_id] = tenant
+        if tenant.is_default:
+            if self._default:
+                raise ValueError(f"Solo un tenant puede ser el predeterminado ('{self._default.id}' y '{tenant.id}').")
+            self._default = tenant
+        self._tenants[tenant.id] = tenant
+
+    def load(self, path: str = TENANTS_FILE):
+        """Crea los tenants desde `path` o, si no hay archivo, el tenant único de las variables de entorno."""
+        if not path:
+            briefing_chats = [TELEGRAM_CHAT_ID_BRIEFING] if TELEGRAM_CHAT_ID_BRIEFING else []
+            self.add(Tenant("default", NotionGateway(NOTION_API_TOKEN), NOTION_DATABASE_ID,
+                            briefing_chat_ids=briefing_chats, is_default=True))
+        else:
+            with open(path, encoding="utf-8") as f:
+                entries = json.load(f)["tenants"]
+            for entry in entries:
+                token = entry.get("notion_token") or os.getenv(entry.get("notion_token_env", ""))
+                if not (token and entry.get("database_id")):
+                    raise ValueError(f"Al tenant '{entry.get('id')}' le falta el token de Notion o el database_id.")
+                self.add(Tenant(
+                    entry["id"], NotionGateway(token, rate=float(entry.get("rate_limit", NOTION_RATE_LIMIT))), entry["database_id"],
+                    chat_ids=entry.get("chats", []), briefing_chat_ids=entry.get("briefing_chats", []),
+                    briefing_time=entry.get("briefing_time", BRIEFING_TIME), is_default=entry.get("default", False),
+                ))
+        logger.info(f"{len(self)} tenants cargados en {SCHEDULER_PARTITIONS} particiones.")
+
+    def get(self, tenant_id: str) -> Tenant | None:
+        return self._tenants.get(tenant_id)
+
+    def for_chat(self, chat_id: int) -> Tenant | None:
+        """Tenant al que pertenece el chat (o el predeterminado); None si el chat no está configurado."""
+        return self._by_chat.get(chat_id, self._default)
+
+    async def aclose(self):
+        for tenant in self:
+            await tenant.notion.aclose()
+
+TENANTS = TenantRegistry()
+
+# El tenant del turno, job o comando en curso. Viaja en un contextvar, así que las
+# herramientas en paralelo (asyncio.gather) y los hilos de asyncio.to_thread lo heredan.
+CURRENT_TENANT = contextvars.ContextVar("current_tenant", default=None)
+
+def current_tenant() -> Tenant:
+    tenant = CURRENT_TENANT.get()
+    if tenant is None:
+        raise RuntimeError("No hay un tenant activo en este contexto.")
+    return tenant
+
+@contextmanager
+def use_tenant(tenant: Tenant):
+    """Hace de `tenant` el tenant activo dentro del bloque."""
+    token = CURRENT_TENANT.set(tenant)
     try:
-        norm_title_to_find = normalize_title(title_to_find)
-        if not norm_title_to_find: return None, None
+        yield tenant
+    finally:
+        CURRENT_TENANT.reset(token)
 
-        response = notion.databases.query(database_id=NOTION_DATABASE_ID)
-        
-        best_match = {"id": None, "title": None, "score": 0}
-        search_words = set(norm_title_to_find.split())
+class TurnContext:
+    """
+    Lo que ya se resolvió durante un turno del asistente, compartido por todas sus
+    herramientas: búsquedas de tareas por título, páginas de Notion leídas y salidas de
+    herramientas de solo lectura. Así, p. ej., `update` + `set_reminder` sobre la misma
+    tarea hacen una sola búsqueda y como mucho una lectura de Notion.
+    """
+
+    def __init__(self):
+        self.lookups = {}  # {título normalizado: Future con (task_id, real_title)}
+        self.pages = {}  # {page_id: página de Notion leída en este turno}
+        self.results = {}  # {(herramienta, argumentos JSON): salida}
+
+    def invalidate(self, page_id: str, archived: bool = False):
+        """Olvida lo que una escritura del turno deja desactualizado."""
+        self.pages.pop(page_id, None)
+        self.results.clear()
+        # Una búsqueda sin resultado puede encontrar ahora la tarea recién creada o renombrada
+        for norm_title, future in list(self.lookups.items()):
+            if not future.done(): continue
+            task_id = None if future.cancelled() or future.exception() else future.result()[0]
+            if task_id is None or (archived and task_id == page_id):
+                del self.lookups[norm_title]
+
+# El contexto del turno en curso (None fuera de un turno: jobs, comandos, bench de herramientas).
+CURRENT_TURN = contextvars.ContextVar("current_turn", default=None)
+
+@contextmanager
+def use_turn():
+    """Abre un contexto de turno nuevo dentro del bloque."""
+    token = CURRENT_TURN.set(TurnContext())
+    try:
+        yield
+    finally:
+        CURRENT_TURN.reset(token)
+
+def load_task_index():
+    """(Re)construye el índice en memoria del tenant activo a partir del espejo local de tareas."""
+    tenant = current_tenant()
+    rows = storage.load_task_titles(tenant.id)
+    tenant.index.clear()
+    for task_id, real_title, norm_title, description in rows:
+        tenant.index.add(task_id, real_title, norm_title, description)
+    if rows:
+        tenant.mirror_ready.set()
+    logger.info(f"Índice de tareas del tenant '{tenant.id}' cargado con {len(tenant.index)} títulos.")
+
+async def get_task_property_ids() -> list[str] | None:
+    """Devuelve los IDs de las propiedades que usa el bot, para pedir solo esas a Notion."""
+    tenant = current_tenant()
+    if tenant.property_ids is None:
+        try:
+            database = await tenant.notion.request("databases.retrieve", database_id=tenant.database_id)
+            properties = database.get("properties", {})
+            tenant.property_ids = [prop["id"] for name, prop in properties.items() if name in TASK_PROPERTIES]
+            status_options = ((properties.get("Estado") or {}).get("status") or {}).get("options", [])
+            tenant.status_options = {option["name"] for option in status_options}
+        except Exception as e:
+            logger.warning(f"No se pudieron resolver las propiedades de la base de datos del tenant '{tenant.id}', se pedirán todas: {e}")
+            return None
+    return tenant.property_ids
 
+async def iter_database_pages(query_filter: dict = None, sorts: list = None, page_size: int = NOTION_PAGE_SIZE):
+    """
+    Recorre las páginas de la base de datos de Notion del tenant activo siguiendo `next_cursor`.
+    Es un generador asíncrono: cada página de resultados se pide solo cuando el llamador la
+    necesita, así que dejar de iterar (p. ej. tras una coincidencia exacta) evita
+    el resto de las llamadas. Solo se piden las propiedades de `TASK_PROPERTIES`.
+    """
+    tenant = current_tenant()
+    query = {"database_id": tenant.database_id, "page_size": page_size}
+    if query_filter:
+        query["filter"] = query_filter
+    if sorts:
+        query["sorts"] = sorts
+    property_ids = await get_task_property_ids()
+    if property_ids:
+        query["filter_properties"] = property_ids
+
+    while True:
+        response = await tenant.notion.request("databases.query", **query)
         for page in response.get("results", []):
-            title_prop = page.get("properties", {}).get("Nombre de tarea", {}).get("title", [])
-            if not (title_prop and title_prop[0].get("plain_text")): continue
+            yield page
+        if not response.get("has_more"): return
+        query["start_cursor"] = response["next_cursor"]
 
-            real_title = title_prop[0]["plain_text"]
-            norm_title = normalize_title(real_title)
-            
-            title_words = set(norm_title.split())
-            common_words = search_words.intersection(title_words)
-            keyword_score = len(common_words)
-            
-            similarity_score = 1 if get_close_matches(norm_title_to_find, [norm_title], n=1, cutoff=0.6) else 0
-            
-            total_score = (keyword_score * 2) + similarity_score
+def page_to_task(page: dict) -> dict:
+    """Extrae de forma segura las propiedades que usa el bot de una página de Notion."""
+    properties = page.get("properties", {})
+
+    title_list = (properties.get("Nombre de tarea") or {}).get("title", [])
+    title = title_list[0].get("plain_text", "") if title_list else ""
+
+    status_prop = properties.get("Estado")
+    status = (status_prop.get("status") or {}).get("name") if status_prop else None
 
-            if total_score > best_match["score"]:
-                best_match = {"id": page["id"], "title": real_title, "score": total_score}
+    due_date_prop = properties.get("Fecha límite")
+    due_date = (due_date_prop.get("date") or {}).get("start") if due_date_prop else None
+
+    categories_prop = properties.get("Etiquetas")
+    categories = [c.get("name") for c in categories_prop.get("multi_select", [])] if categories_prop else []
+
+    description_list = (properties.get("Descripción") or {}).get("rich_text", [])
+    description = "".join(d.get("plain_text", "") for d in description_list)
+
+    return {
+        "id": page["id"],
+        "title": title,
+        "status": status,
+        "due_date": due_date,
+        "categories": categories,
+        "description": description,
+        "last_edited_time": page.get("last_edited_time", ""),
+    }
+
+def pages_to_tasks(pages: list[dict]) -> tuple[list[dict], list[str]]:
+    """Convierte páginas de Notion en (tareas del espejo, IDs de las archivadas)."""
+    tasks, deleted_ids = [], []
+    for page in pages:
+        if page.get("archived") or page.get("in_trash"):
+            deleted_ids.append(page["id"])
+            continue
+        task = page_to_task(page)
+        task["norm_title"] = normalize_title(task["title"])
+        tasks.append(task)
+    return tasks, deleted_ids
+
+def apply_tasks_in_memory(tenant: Tenant, tasks: list[dict], deleted_ids: list[str]):
+    """Lleva al índice y al briefing del tenant un cambio ya guardado en el espejo."""
+    for task_id in deleted_ids:
+        tenant.index.remove(task_id)
+    for task in tasks:
+        tenant.index.add(task["id"], task["title"], task["norm_title"], task.get("description"))
+    tenant.briefing.apply(tasks, deleted_ids)
+
+async def upsert_tasks_mirror(pages: list[dict]):
+    """
+    Inserta o actualiza páginas de Notion en el espejo local. Las archivadas se eliminan.
+    Las que tienen escrituras pendientes se omiten: el espejo ya tiene su versión más nueva.
+    """
+    tenant = current_tenant()
+    tasks, deleted_ids = pages_to_tasks([page for page in pages if page["id"] not in tenant.pending_pages])
+    if not (tasks or deleted_ids): return
+    await storage.upsert_tasks(tenant.id, tasks, deleted_ids)
+    apply_tasks_in_memory(tenant, tasks, deleted_ids)
 
-        return best_match["id"], best_match["title"]
+async def sync_tasks_mirror(full: bool = False) -> int:
+    """
+    Sincroniza el espejo local del tenant activo con Notion. En modo incremental solo pide las páginas
+    editadas desde la última sincronización (filtro por `last_edited_time`); en modo
+    completo recorre toda la base de datos y elimina del espejo las tareas que ya no existen.
+    Devuelve el número de páginas recibidas.
+    """
+    tenant = current_tenant()
+    watermark_key = f"{tenant.id}:last_edited_time"
+    async with tenant.sync_lock:
+        watermark = storage.get_sync_state(watermark_key) if not full else None
+
+        # Notion redondea `last_edited_time` al minuto, por eso se usa `on_or_after`
+        # y se acepta volver a recibir las páginas del último minuto.
+        query_filter = None
+        if watermark:
+            query_filter = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": watermark}}
+        pages = [page async for page in iter_database_pages(query_filter, sorts=[{"timestamp": "last_edited_time", "direction": "ascending"}])]
+
+        await upsert_tasks_mirror(pages)
+
+        if full:
+            # Las tareas con escrituras pendientes (p. ej. creadas y aún no enviadas) se conservan
+            await storage.retain_tasks(tenant.id, [page["id"] for page in pages] + list(tenant.pending_pages))
+        new_watermark = max((page.get("last_edited_time", "") for page in pages), default=watermark)
+        if new_watermark:
+            await storage.set_sync_state(watermark_key, new_watermark)
+        if full:
+            load_task_index()
+            tenant.briefing.invalidate()
+            tenant.mirror_ready.set()
+
+        logger.info(f"Espejo de tareas del tenant '{tenant.id}' sincronizado ({'completo' if full else 'incremental'}): {len(pages)} páginas recibidas.")
+        return len(pages)
+
+async def find_task_in_notion(norm_title_to_find: str) -> tuple[str | None, str | None]:
+    """
+    Búsqueda por relevancia recorriendo Notion directamente (cuando el espejo aún no
+    tiene datos). Se detiene en cuanto una tarea alcanza la puntuación máxima posible.
+    """
+    best_match = {"id": None, "title": None, "score": 0}
+    search_words = set(norm_title_to_find.split())
+    perfect_score = (len(search_words) * 2) + 1
+
+    turn = CURRENT_TURN.get()
+    async for page in iter_database_pages():
+        if turn is not None:
+            turn.pages[page["id"]] = page
+        title_prop = page.get("properties", {}).get("Nombre de tarea", {}).get("title", [])
+        if not (title_prop and title_prop[0].get("plain_text")): continue
+
+        real_title = title_prop[0]["plain_text"]
+        norm_title = normalize_title(real_title)
+
+        keyword_score = len(search_words.intersection(norm_title.split()))
+        similarity_score = 1 if TaskIndex._is_similar(norm_title_to_find, norm_title) else 0
+        total_score = (keyword_score * 2) + similarity_score
+
+        if total_score > best_match["score"]:
+            best_match = {"id": page["id"], "title": real_title, "score": total_score}
+            if total_score == perfect_score: break
+
+    return best_match["id"], best_match["title"]
+
+async def find_task(norm_title_to_find: str) -> tuple[str | None, str | None]:
+    tenant = current_tenant()
+    with span("lookup"):
+        if not tenant.mirror_ready.is_set():
+            return await find_task_in_notion(norm_title_to_find)
+        return tenant.index.search(norm_title_to_find)
+
+async def find_task_by_title_enhanced(title_to_find: str) -> tuple[str | None, str | None]:
+    """
+    Busca una tarea por relevancia en el índice del espejo local. Devuelve (task_id, real_title).
+    Dentro de un turno, el mismo título se resuelve una sola vez, aunque lo busquen varias
+    herramientas a la vez.
+    """
+    try:
+        norm_title_to_find = normalize_title(title_to_find)
+        if not norm_title_to_find: return None, None
+        turn = CURRENT_TURN.get()
+        if turn is None:
+            return await find_task(norm_title_to_find)
+        future = turn.lookups.get(norm_title_to_find)
+        if future is None:
+            METRICS.inc("olivia_turn_cache_total", kind="lookup", outcome="miss")
+            future = turn.lookups[norm_title_to_find] = asyncio.ensure_future(find_task(norm_title_to_find))
+            # Una búsqueda fallida no se recuerda: la siguiente herramienta vuelve a intentarlo
+            future.add_done_callback(lambda f: (f.cancelled() or f.exception() is not None) and turn.lookups.pop(norm_title_to_find, None))
+        else:
+            METRICS.inc("olivia_turn_cache_total", kind="lookup", outcome="hit")
+        return await asyncio.shield(future)
     except Exception as e:
         logger.error(f"Error en find_task_by_title_enhanced: {e}")
         return None, None
 
+async def get_page(page_id: str) -> dict:
+    """Lee una página de Notion, reutilizando la que ya se leyó (o recorrió) en el turno."""
+    turn = CURRENT_TURN.get()
+    if turn is not None and page_id in turn.pages:
+        METRICS.inc("olivia_turn_cache_total", kind="page", outcome="hit")
+        return turn.pages[page_id]
+    page = await current_tenant().notion.request("pages.retrieve", page_id=page_id)
+    if turn is not None:
+        METRICS.inc("olivia_turn_cache_total", kind="page", outcome="miss")
+        turn.pages[page_id] = page
+    return page
+
+# --- Escrituras diferidas a Notion ---
+
+def task_properties(fields: dict) -> dict:
+    """Propiedades de Notion para los campos de tarea dados (title, status, due_date, categories, description)."""
+    props = {}
+    if "title" in fields:
+        props["Nombre de tarea"] = {"title": [{"text": {"content": fields["title"]}}]}
+    if "status" in fields:
+        props["Estado"] = {"status": {"name": fields["status"]}}
+    if fields.get("due_date"):
+        # Notion requiere un objeto 'date' con 'start'; si es ISO 8601 con 'T', lo trata como fecha y hora
+        props["Fecha límite"] = {"date": {"start": fields["due_date"]}}
+    if "categories" in fields:
+        props["Etiquetas"] = {"multi_select": [{"name": name} for name in fields["categories"]]}
+    if fields.get("description"):
+        props["Descripción"] = {"rich_text": [{"text": {"content": fields["description"]}}]}
+    return props
+
+class NotionWriteQueue:
+    """Envía a Notion en segundo plano las escrituras guardadas en `pending_writes`, fusionando las de una misma página."""
+
+    def __init__(self, delay: float = NOTION_WRITE_DELAY):
+        self.delay = delay
+        self._wakeup = asyncio.Event()
+        self._inflight = {}  # {(tenant_id, page_id): Task} escrituras enviándose ahora mismo
+
+    def load(self):
+        """Marca en sus tenants las páginas con escrituras pendientes de una ejecución anterior."""
+        rows = storage.pending_writes()
+        for tenant_id, page_id, *_ in rows:
+            tenant = TENANTS.get(tenant_id)
+            if tenant:
+                tenant.pending_pages.add(page_id)
+            else:
+                logger.warning(f"Escritura pendiente de la página {page_id} para el tenant '{tenant_id}', que ya no está configurado.")
+        logger.info(f"{len(rows)} escrituras a Notion pendientes cargadas.")
+
+    async def submit(self, tenant: Tenant, page_id: str, action: str, fields: dict, tasks: list[dict] = (), deleted_ids: list[str] = ()):
+        """Guarda la escritura y su efecto en el espejo; Notion se actualiza después, en segundo plano."""
+        created = tenant.created_pages.get(page_id)
+        if created:
+            # La tarea se resolvió con su ID local justo cuando se creaba en Notion: va a la página real
+            tasks = [{**task, "id": created} if task["id"] == page_id else task for task in tasks]
+            deleted_ids = [created if task_id == page_id else task_id for task_id in deleted_ids]
+            page_id = created
+        await storage.record_write(tenant.id, page_id, action, fields, tasks, deleted_ids)
+        turn = CURRENT_TURN.get()
+        if turn is not None:
+            turn.invalidate(page_id, archived=action == "archive")
+        tenant.pending_pages.add(page_id)
+        apply_tasks_in_memory(tenant, list(tasks), list(deleted_ids))
+        METRICS.inc("olivia_notion_writes_total", action=action, outcome="queued")
+        self._wakeup.set()
+
+    async def run(self):
+        """Bucle principal: envía las escrituras que ya tocan y duerme hasta la siguiente."""
+        while True:
+            self._wakeup.clear()
+            now, next_attempt = time.time(), None
+            for row in storage.pending_writes():
+                tenant_id, page_id, next_attempt_at = row[0], row[1], row[6]
+                if (tenant_id, page_id) in self._inflight or TENANTS.get(tenant_id) is None: continue
+                if next_attempt_at <= now:
+                    self._inflight[(tenant_id, page_id)] = asyncio.create_task(self._send(*row))
+                else:
+                    next_attempt = min(next_attempt or next_attempt_at, next_attempt_at)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), next_attempt - now if next_attempt else None)
+            except asyncio.TimeoutError:
+                pass
+            # Se deja un margen para que las ediciones que llegan seguidas se fusionen antes de enviarse
+            await asyncio.sleep(self.delay)
+
+    async def _send(self, tenant_id: str, page_id: str, action: str, fields: dict, version: int, attempts: int, _next_attempt_at: float):
+        tenant = TENANTS.get(tenant_id)
+        try:
+            with use_tenant(tenant):
+                await self._apply(tenant, page_id, action, fields, version)
+            METRICS.inc("olivia_notion_writes_total", action=action, outcome="sent")
+        except HTTPResponseError as e:
+            # Los 429, 409 y 5xx son transitorios; otro 4xx no se arreglará reintentando
+            if e.status >= 500 or e.status in (409, 429):
+                await self._retry(tenant, page_id, action, attempts, e)
+            else:
+                METRICS.inc("olivia_notion_writes_total", action=action, outcome="dropped")
+                logger.error(f"Notion rechazó la escritura '{action}' de la página {page_id} (tenant '{tenant_id}'): {e}. Se descarta.")
+                await self._discard(tenant, page_id)
+        except Exception as e:
+            await self._retry(tenant, page_id, action, attempts, e)
+        finally:
+            self._inflight.pop((tenant_id, page_id), None)
+            self._wakeup.set()
+
+    async def _apply(self, tenant: Tenant, page_id: str, action: str, fields: dict, version: int):
+        new_page_id, tasks, deleted_ids = None, [], []
+        if action == "create":
+            # Crear no es idempotente: si un envío anterior sin confirmar llegó a crearla, se adopta esa página
+            existing = await self._find_unconfirmed_create(tenant, page_id)
+            if existing:
+                page = await tenant.notion.request("pages.update", page_id=existing["id"], properties=task_properties(fields))
+            else:
+                await storage.mark_create_sent(tenant.id, page_id, fields.get("title", ""), time.time())
+                page = await tenant.notion.request("pages.create", parent={"database_id": tenant.database_id}, properties=task_properties(fields))
+            new_page_id = page["id"]
+            if len(tenant.created_pages) > 10_000:
+                del tenant.created_pages[next(iter(tenant.created_pages))]
+            tenant.created_pages[page_id] = new_page_id
+            tasks, deleted_ids = pages_to_tasks([page])
+            deleted_ids.append(page_id)
+        elif action == "archive":
+            # Una tarea creada y archivada antes de llegar a Notion no necesita ninguna petición,
+            # salvo que un envío sin confirmar sí llegara a crearla
+            target = page_id
+            if page_id.startswith(LOCAL_ID_PREFIX):
+                existing = await self._find_unconfirmed_create(tenant, page_id)
+                target = existing["id"] if existing else None
+            if target:
+                await tenant.notion.request("pages.update", page_id=target, archived=True)
+            deleted_ids = [page_id]
+        else:
+            page = await tenant.notion.request("pages.update", page_id=page_id, properties=task_properties(fields))
+            tasks, deleted_ids = pages_to_tasks([page])
+
+        if await storage.complete_write(tenant.id, page_id, version, new_page_id, tasks, deleted_ids):
+            tenant.pending_pages.discard(page_id)
+            apply_tasks_in_memory(tenant, tasks, deleted_ids)
+        elif new_page_id:
+            # Se editó mientras se creaba: la tarea local pasa a usar el ID de Notion y la edición sigue pendiente
+            tenant.pending_pages.discard(page_id)
+            tenant.pending_pages.add(new_page_id)
+            task = storage.get_task(tenant.id, new_page_id)
+            apply_tasks_in_memory(tenant, [task] if task else [], [page_id])
+
+    async def _find_unconfirmed_create(self, tenant: Tenant, page_id: str) -> dict | None:
+        """La página que pudo crear un envío anterior sin confirmar de `page_id`, si existe."""
+        marker = storage.unconfirmed_create(tenant.id, page_id)
+        if not marker:
+            return None
+        # Notion redondea `created_time` al minuto. Dos creaciones con el mismo título en esa
+        # ventana podrían acabar en una sola página, lo que es preferible a duplicar la tarea.
+        since = datetime.fromtimestamp(marker["since"] - 60, pytz.utc).isoformat()
+        query_filter = {"and": [
+            {"timestamp": "created_time", "created_time": {"on_or_after": since}},
+            {"or": [{"property": "Nombre de tarea", "title": {"equals": title}} for title in marker["titles"]]},
+        ]}
+        async for page in iter_database_pages(query_filter, sorts=[{"timestamp": "created_time", "direction": "ascending"}], page_size=1):
+            METRICS.inc("olivia_notion_writes_total", action="create", outcome="adopted")
+            logger.info(f"La creación sin confirmar de {page_id} (tenant '{tenant.id}') ya existía en Notion como {page['id']}; se reutiliza.")
+            return page
+        return None
+
+    async def _retry(self, tenant: Tenant, page_id: str, action: str, attempts: int, error: Exception):
+        attempts += 1
+        delay = min(NOTION_WRITE_RETRY_SECONDS * 2 ** (attempts - 1), NOTION_WRITE_MAX_BACKOFF)
+        METRICS.inc("olivia_notion_writes_total", action=action, outcome="retry")
+        logger.warning(f"No se pudo enviar la escritura '{action}' de la página {page_id} (tenant '{tenant.id}'): {error}. Reintento {attempts} en {delay:.0f}s.")
+        await storage.reschedule_write(tenant.id, page_id, attempts, time.time() + delay)
+
+    async def _discard(self, tenant: Tenant, page_id: str):
+        """Descarta una escritura rechazada y devuelve el espejo al estado real de la página."""
+        await storage.drop_write(tenant.id, page_id)
+        tenant.pending_pages.discard(page_id)
+        with use_tenant(tenant):
+            if page_id.startswith(LOCAL_ID_PREFIX):
+                await storage.upsert_tasks(tenant.id, [], [page_id])
+                apply_tasks_in_memory(tenant, [], [page_id])
+                return
+            try:
+                page = await tenant.notion.request("pages.retrieve", page_id=page_id)
+            except HTTPResponseError as e:
+                if e.status != 404:
+                    logger.warning(f"No se pudo releer la página {page_id}; se corregirá en la próxima sincronización completa: {e}")
+                    return
+                page = {"id": page_id, "archived": True}
+            await upsert_tasks_mirror([page])
+
+WRITES = NotionWriteQueue()
+
 def set_reminder_db(chat_id: int, task_title: str, due_date_str: str, reminder_str: str) -> str:
     """Parsea la petición de recordatorio y la guarda en la BD."""
     match = re.search(r"(\d+)\s*(minuto|hora|d[ií]a)s?", reminder_str, re.IGNORECASE)
@@ -168,8 +1229,7 @@ def set_reminder_db(chat_id: int, task_title: str, due_date_str: str, reminder_s
 
     try:
         # La fecha que viene de Notion debería estar en formato ISO 8601.
-        # dateparser la convertirá en un objeto datetime con zona horaria.
-        due_datetime = dateparser.parse(due_date_str)
+        due_datetime = parse_due_datetime(due_date_str)
         if not due_datetime:
             raise ValueError("No se pudo interpretar la fecha de vencimiento desde Notion.")
 
@@ -190,13 +1250,9 @@ def set_reminder_db(chat_id: int, task_title: str, due_date_str: str, reminder_s
         logger.error(f"Error parseando fecha para recordatorio: {e}", exc_info=True)
         return "La fecha de la tarea no es válida o tiene un formato incorrecto para crear un recordatorio."
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    # Guardamos la hora del recordatorio en UTC para que el scheduler funcione correctamente
-    cursor.execute("INSERT INTO reminders (chat_id, task_title, remind_time) VALUES (?, ?, ?)",
-                   (chat_id, task_title, remind_time.astimezone(pytz.utc)))
-    conn.commit()
-    conn.close()
+    # Se guarda como epoch (UTC); el INSERT se confirma en el siguiente lote de escrituras diferidas
+    reminder_id = storage.insert_reminder(chat_id, task_title, int(remind_time.timestamp()))
+    REMINDERS.add(reminder_id, chat_id, task_title, remind_time.timestamp())
     
     return f"OK. Te recordaré sobre '{task_title}' el {local_remind_time.strftime('%d de %b a las %H:%M')}."
 
@@ -204,44 +1260,135 @@ def set_reminder_db(chat_id: int, task_title: str, due_date_str: str, reminder_s
 # 3. FUNCIONES DE "HERRAMIENTAS" PARA EL ASISTENTE DE OPENAI
 # -----------------------------------------------------------------------------
 
+# --- Normalización de fechas ---
+LOCAL_TZ = pytz.timezone('America/Santiago')
+
+# Configuración para que dateparser entienda español y prefiera fechas futuras
+DATEPARSER_SETTINGS = {
+    'PREFER_DATES_FROM': 'future',
+    'DATE_ORDER': 'DMY',
+    'TIMEZONE': 'America/Santiago',
+    'RETURN_AS_TIMEZONE_AWARE': True
+}
+DATE_PARSER = None  # dateparser.DateDataParser, se construye una sola vez (ver get_date_parser)
+
+WEEKDAYS_ES = {"lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3, "viernes": 4, "sabado": 5, "domingo": 6}
+RELATIVE_DAYS_ES = {"hoy": 0, "manana": 1, "pasado manana": 2}
+# Expresiones frecuentes que se resuelven sin dateparser (sobre el texto sin tildes ni mayúsculas)
+FAST_DATE_RE = re.compile(
+    r"^(?:(?P<day>hoy|pasado manana|manana)"
+    r"|(?:el |este |el proximo |proximo )?(?P<weekday>lunes|martes|miercoles|jueves|viernes|sabado|domingo)"
+    r"|en (?P<amount>\d+|un|una) (?P<unit>dias?|semanas?))"
+    r"(?: a las (?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?(?: ?(?P<ampm>am|pm))?)?$"
+)
+# Indica que el usuario dio una hora ("a las 10", "10:30", "9am", "18h") o una relativa a ahora ("en 30 minutos")
+TIME_SPECIFIER_RE = re.compile(r"a las|\d:\d|\d\s*(?:am|pm|h|hrs?)\b|\b(?:horas?|minutos?|segundos?|ahora)\b")
+# Expresiones relativas a la hora actual ("en 2 horas"): su resultado cambia durante el día y no se cachea
+RELATIVE_TIME_RE = re.compile(r"\b(?:segundos?|minutos?|horas?|ahora)\b")
+
+def get_date_parser():
+    """Devuelve el parser de dateparser para español, construyéndolo la primera vez."""
+    global DATE_PARSER
+    if DATE_PARSER is None:
+        import dateparser
+        DATE_PARSER = dateparser.DateDataParser(languages=["es"], settings=DATEPARSER_SETTINGS)
+    return DATE_PARSER
+
+def warm_up_date_parser():
+    """Construye el parser y carga sus datos de idioma para que la primera petición real no pague ese coste."""
+    get_date_parser().get_date_data("25 de diciembre")
+
+def parse_fast_date(expression: str, today: date) -> str | None:
+    """Resuelve sin dateparser las fechas ISO y las expresiones relativas más comunes."""
+    try:
+        if re.fullmatch(r"\d{4}-\d{2}-\d{2}", expression):
+            return date.fromisoformat(expression).isoformat()
+        if re.match(r"\d{4}-\d{2}-\d{2}T", expression):
+            dt = datetime.fromisoformat(expression)
+            return (dt if dt.tzinfo else LOCAL_TZ.localize(dt)).isoformat()
+    except ValueError:
+        return None
+
+    match = FAST_DATE_RE.match(" ".join(unidecode(expression.lower()).strip(" .,!?").split()))
+    if not match:
+        return None
+    if match["day"]:
+        target = today + timedelta(days=RELATIVE_DAYS_ES[match["day"]])
+    elif match["weekday"]:
+        days_ahead = (WEEKDAYS_ES[match["weekday"]] - today.weekday()) % 7
+        # "viernes" dicho un viernes es el de la semana siguiente (como dateparser); "este viernes", hoy
+        if days_ahead == 0 and not match.group(0).startswith("este "):
+            days_ahead = 7
+        target = today + timedelta(days=days_ahead)
+    else:
+        amount = 1 if match["amount"] in ("un", "una") else int(match["amount"])
+        target = today + timedelta(days=amount * (7 if match["unit"].startswith("semana") else 1))
+
+    if match["hour"] is None:
+        return target.isoformat()
+    hour, minute = int(match["hour"]), int(match["minute"] or 0)
+    if match["ampm"] == "pm" and hour < 12:
+        hour += 12
+    elif match["ampm"] == "am" and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return LOCAL_TZ.localize(datetime(target.year, target.month, target.day, hour, minute)).isoformat()
+
+def parse_date_expression(date_str: str, today: date) -> str | None:
+    fast_result = parse_fast_date(date_str, today)
+    if fast_result:
+        return fast_result
+
+    dt = get_date_parser().get_date_data(date_str).date_obj
+    if not dt:
+        return None
+
+    # Si el usuario no especificó una hora, devolver solo la fecha.
+    if not TIME_SPECIFIER_RE.search(date_str.lower()):
+        return dt.strftime("%Y-%m-%d")
+    # Devolver en formato ISO 8601, que Notion entiende para fecha y hora.
+    return dt.isoformat()
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_date_expression_cached(date_str: str, today: date) -> str | None:
+    return parse_date_expression(date_str, today)
+
+_date_cache_day = None  # Día local de las entradas del caché; al cambiar se vacía
+
 def normalize_date(date_str: str) -> str | None:
     """
     Normaliza una cadena de texto a una fecha (YYYY-MM-DD) o
     fecha y hora (formato ISO 8601) si se especifica una hora.
     """
+    global _date_cache_day
     if not date_str:
         return None
+    date_str = date_str.strip()
+    today = datetime.now(LOCAL_TZ).date()
+
+    if RELATIVE_TIME_RE.search(date_str.lower()):
+        return parse_date_expression(date_str, today)
+    # El resultado de "mañana" cambia a medianoche (hora de Santiago): ahí se vacía el caché
+    if today != _date_cache_day:
+        _parse_date_expression_cached.cache_clear()
+        _date_cache_day = today
+    return _parse_date_expression_cached(date_str, today)
+
+def parse_due_datetime(due_date_str: str) -> datetime | None:
+    """Interpreta la fecha límite que devuelve Notion (ISO 8601); dateparser solo si no es ISO."""
+    try:
+        return datetime.fromisoformat(due_date_str)
+    except ValueError:
+        import dateparser
+        return dateparser.parse(due_date_str)
 
-    # Configuración para que dateparser entienda español y prefiera fechas futuras
-    settings = {
-        'PREFER_DATES_FROM': 'future',
-        'DATE_ORDER': 'DMY',
-        'TIMEZONE': 'America/Santiago',
-        'RETURN_AS_TIMEZONE_AWARE': True
-    }
-    
-    dt = dateparser.parse(date_str, languages=["es"], settings=settings)
-    
-    if not dt:
-        return None
-
-    # Heurística para ver si el usuario especificó una hora.
-    time_indicators = ['a las', ':', 'am', 'pm', 'h', 'hora']
-    has_time_specifier = any(indicator in date_str.lower() for indicator in time_indicators)
-
-    # Si no se especifica hora y el resultado es medianoche, devolver solo la fecha.
-    if not has_time_specifier and dt.hour == 0 and dt.minute == 0 and dt.second == 0:
-        return dt.strftime("%Y-%m-%d")
-    else:
-        # Devolver en formato ISO 8601, que Notion entiende para fecha y hora.
-        return dt.isoformat()
-
-def create_task_notion(title: str, category: str = None, due_date: str = None, description: str = None):
+async def create_task_notion(title: str, category: str = None, due_date: str = None, description: str = None):
     """Crea una tarea en Notion, evitando duplicados."""
     logger.info(f"Tool Call: create_task_notion('{title}')")
     
     # 1. Verificar si ya existe una tarea similar para evitar duplicados
-    task_id, existing_title = find_task_by_title_enhanced(title)
+    task_id, existing_title = await find_task_by_title_enhanced(title)
     if task_id:
         logger.warning(f"Se intentó crear una tarea duplicada. Título proporcionado: '{title}', Título existente: '{existing_title}'")
         return json.dumps({
@@ -249,118 +1396,119 @@ def create_task_notion(title: str, category: str = None, due_date: str = None, d
             "message": f"Parece que ya existe una tarea similar llamada '{existing_title}'. No se creó una nueva para evitar duplicados."
         })
 
-    # 2. Si no hay duplicados, proceder a crear la tarea
-    props = {
-        "Nombre de tarea": {"title": [{"text": {"content": title}}]},
-        "Estado": {"status": {"name": "Por hacer"}}
-    }
-    if category:
-        props["Etiquetas"] = {"multi_select": [{"name": category}]}
-    if due_date: 
+    # 2. Si no hay duplicados, se crea en el espejo con un ID local y se envía a Notion en segundo plano
+    fields = {"title": title, "status": "Por hacer", "categories": [category] if category else []}
+    if due_date:
         norm_date = normalize_date(due_date)
         if norm_date:
-            # Notion requiere un objeto 'date' con 'start' y opcionalmente 'end'
-            date_payload = {"start": norm_date}
-            # Si la fecha normalizada es ISO 8601 (contiene 'T'), Notion la tratará como fecha y hora.
-            props["Fecha límite"] = {"date": date_payload}
+            fields["due_date"] = norm_date
     if description:
-        props["Descripción"] = {"rich_text": [{"text": {"content": description}}]}
-        
+        fields["description"] = description
+
     try:
-        notion.pages.create(parent={"database_id": NOTION_DATABASE_ID}, properties=props)
+        task_id = f"{LOCAL_ID_PREFIX}{uuid.uuid4().hex}"
+        task = {"id": task_id, "due_date": None, "description": "", **fields, "norm_title": normalize_title(title),
+                "last_edited_time": datetime.now(pytz.utc).isoformat()}
+        await WRITES.submit(current_tenant(), task_id, "create", fields, tasks=[task])
         return json.dumps({"status": "success", "message": f"Tarea '{title}' creada con éxito."})
     except Exception as e:
         logger.error(f"Error creando tarea en Notion: {e}", exc_info=True)
         return json.dumps({"status": "error", "message": f"Hubo un error al crear la tarea: {e}"})
 
-def list_tasks_notion(category: str = None, status: str = None, due_date: str = None):
-    """Obtiene una lista de tareas de Notion, manejando datos ausentes de forma segura."""
+async def list_tasks_notion(category: str = None, status: str = None, due_date: str = None):
+    """Obtiene una lista de tareas desde el espejo local, manejando datos ausentes de forma segura."""
     logger.info("Tool Call: list_tasks_notion")
-    filters = []
-    if category:
-        filters.append({"property": "Etiquetas", "multi_select": {"contains": category}})
-    if status:
-        filters.append({"property": "Estado", "status": {"equals": status}})
-    if due_date:
-        norm_date = normalize_date(due_date)
-        if norm_date:
-            filters.append({"property": "Fecha límite", "date": {"equals": norm_date}})
-            
-    query = {"database_id": NOTION_DATABASE_ID}
-    if filters:
-        query["filter"] = {"and": filters}
+    norm_date = normalize_date(due_date) if due_date else None
         
     try:
-        response = notion.databases.query(**query)
-        tasks = []
-        for p in response.get("results", []):
-            properties = p.get("properties", {})
-            
-            # Extracción segura del título
-            title_list = properties.get("Nombre de tarea", {}).get("title", [])
-            title = title_list[0].get("plain_text", "(Sin título)") if title_list else "(Sin título)"
-            
-            # Extracción segura del estado
-            status_prop = properties.get("Estado")
-            task_status = (status_prop.get("status") or {}).get("name", "N/A") if status_prop else "N/A"
-            
-            # Extracción segura de la fecha límite (causa del error anterior)
-            due_date_prop = properties.get("Fecha límite")
-            due_date_val = "N/A"
-            if due_date_prop and due_date_prop.get("date"):
-                due_date_val = due_date_prop.get("date").get("start") or "N/A"
-
-            tasks.append({
-                "title": title,
-                "status": task_status,
-                "due_date": due_date_val
-            })
+        tenant = current_tenant()
+        if tenant.mirror_ready.is_set():
+            rows = storage.find_tasks(tenant.id, category=category, status=status, due_date=norm_date)
+        else:
+            # Sin espejo todavía: se consulta Notion recorriendo todas las páginas de resultados
+            notion_filters = []
+            if category:
+                notion_filters.append({"property": "Etiquetas", "multi_select": {"contains": category}})
+            if status:
+                notion_filters.append({"property": "Estado", "status": {"equals": status}})
+            if norm_date:
+                notion_filters.append({"property": "Fecha límite", "date": {"equals": norm_date}})
+            tasks = [page_to_task(page) async for page in iter_database_pages({"and": notion_filters} if notion_filters else None)]
+            rows = [(task["title"], task["status"], task["due_date"]) for task in tasks]
+        tasks = [{
+            "title": title or "(Sin título)",
+            "status": task_status or "N/A",
+            "due_date": due_date_val or "N/A"
+        } for title, task_status, due_date_val in rows]
             
         return json.dumps({"status": "success", "data": tasks or "No se encontraron tareas con esos criterios."})
     except Exception as e:
-        logger.error(f"Error listando tareas de Notion: {e}", exc_info=True)
+        logger.error(f"Error listando tareas: {e}", exc_info=True)
         return json.dumps({"status": "error", "message": f"Hubo un error al listar las tareas: {e}"})
 
-def update_task_notion(title_to_find: str, new_title: str = None, new_status: str = None, new_due_date: str = None, new_category: str = None):
+async def update_task_notion(title_to_find: str, new_title: str = None, new_status: str = None, new_due_date: str = None, new_category: str = None):
     logger.info(f"Tool Call: update_task_notion('{title_to_find}')")
-    task_id, real_title = find_task_by_title_enhanced(title_to_find)
+    task_id, real_title = await find_task_by_title_enhanced(title_to_find)
     if not task_id: return json.dumps({"status": "error", "message": f"No encontré una tarea que coincida con '{title_to_find}'."})
-    props = {}
-    if new_title: props["Nombre de tarea"] = {"title": [{"text": {"content": new_title}}]}
-    if new_status: props["Estado"] = {"status": {"name": new_status}}
+    return await update_task_by_id(task_id, real_title, new_title, new_status, new_due_date, new_category)
+
+async def update_task_by_id(task_id: str, real_title: str, new_title: str = None, new_status: str = None, new_due_date: str = None, new_category: str = None):
+    """Actualiza la tarea `task_id` ya identificada (sin volver a buscarla por título)."""
+    tenant = current_tenant()
+    fields = {}
+    if new_title: fields["title"] = new_title
+    if new_status:
+        # Notion rechazaría el estado en segundo plano, cuando ya se confirmó el cambio: se valida aquí
+        if tenant.status_options and new_status not in tenant.status_options:
+            return json.dumps({"status": "error", "message": f"'{new_status}' no es un estado válido. Estados posibles: {', '.join(sorted(tenant.status_options))}."})
+        fields["status"] = new_status
     if new_due_date:
         norm_date = normalize_date(new_due_date)
-        if norm_date: props["Fecha límite"] = {"date": {"start": norm_date}}
-    if new_category: props["Etiquetas"] = {"multi_select": [{"name": new_category}]}
-    if not props: return json.dumps({"status": "error", "message": "No se proporcionaron nuevos datos para actualizar."})
+        if norm_date: fields["due_date"] = norm_date
+    if new_category: fields["categories"] = [new_category]
+    if not fields: return json.dumps({"status": "error", "message": "No se proporcionaron nuevos datos para actualizar."})
     try:
-        notion.pages.update(page_id=task_id, properties=props)
+        # Cambio optimista en el espejo; Notion se actualiza en segundo plano
+        task = storage.get_task(tenant.id, task_id)
+        tasks = [{**task, **fields, "norm_title": normalize_title(fields.get("title", task["title"]))}] if task else []
+        await WRITES.submit(tenant, task_id, "update", fields, tasks=tasks)
         return json.dumps({"status": "success", "message": f"Tarea '{real_title}' actualizada correctamente."})
     except Exception as e:
         logger.error(f"Error actualizando tarea en Notion: {e}", exc_info=True)
         return json.dumps({"status": "error", "message": f"Error al actualizar la tarea: {e}"})
 
-def delete_task_notion(title_to_find: str):
+async def delete_task_notion(title_to_find: str):
     logger.info(f"Tool Call: delete_task_notion('{title_to_find}')")
-    task_id, real_title = find_task_by_title_enhanced(title_to_find)
+    task_id, real_title = await find_task_by_title_enhanced(title_to_find)
     if not task_id: return json.dumps({"status": "error", "message": f"No encontré una tarea que coincida con '{title_to_find}' para eliminar."})
     try:
-        notion.pages.update(page_id=task_id, archived=True)
+        await WRITES.submit(current_tenant(), task_id, "archive", {}, deleted_ids=[task_id])
         return json.dumps({"status": "success", "message": f"Tarea '{real_title}' archivada correctamente."})
     except Exception as e:
         logger.error(f"Error archivando tarea en Notion: {e}", exc_info=True)
         return json.dumps({"status": "error", "message": f"Error al archivar la tarea: {e}"})
 
-def set_reminder_notion(title_to_find: str, reminder_str: str, chat_id: int):
+async def set_reminder_notion(title_to_find: str, reminder_str: str, chat_id: int):
     logger.info(f"Tool Call: set_reminder_notion('{title_to_find}')")
-    task_id, real_title = find_task_by_title_enhanced(title_to_find)
+    task_id, real_title = await find_task_by_title_enhanced(title_to_find)
     if not task_id: return json.dumps({"status": "error", "message": f"No encontré la tarea '{title_to_find}'."})
+    return await set_reminder_by_id(task_id, real_title, reminder_str, chat_id)
+
+async def set_reminder_by_id(task_id: str, real_title: str, reminder_str: str, chat_id: int):
+    """Programa el recordatorio de la tarea `task_id` ya identificada (sin volver a buscarla por título)."""
     try:
-        page = notion.pages.retrieve(page_id=task_id)
-        due_date_prop = page.get("properties", {}).get("Fecha límite", {}).get("date")
-        if not (due_date_prop and due_date_prop.get("start")):
+        tenant = current_tenant()
+        if task_id in tenant.pending_pages:
+            # Con cambios aún sin enviar, la versión vigente es la del espejo (y puede no existir en Notion)
+            task = storage.get_task(tenant.id, task_id) or {}
+            due_date_start = task.get("due_date")
+        else:
+            page = await get_page(task_id)
+            due_date_prop = page.get("properties", {}).get("Fecha límite", {}).get("date")
+            due_date_start = due_date_prop.get("start") if due_date_prop else None
+        if not due_date_start:
             return json.dumps({"status": "error", "message": f"La tarea '{real_title}' no tiene fecha límite."})
-        result_message = set_reminder_db(chat_id, real_title, due_date_prop["start"], reminder_str)
+        result_message = set_reminder_db(chat_id, real_title, due_date_start, reminder_str)
         return json.dumps({"status": "success", "message": result_message})
     except Exception as e:
         logger.error(f"Error en set_reminder_notion: {e}", exc_info=True)
@@ -370,82 +1518,451 @@ def set_reminder_notion(title_to_find: str, reminder_str: str, chat_id: int):
 # 4. LÓGICA PRINCIPAL DEL ASISTENTE Y TELEGRAM
 # -----------------------------------------------------------------------------
 
-async def get_or_create_thread(chat_id):
-    if chat_id not in USER_THREADS:
+_OPENAI_CLIENT = None
+
+def openai_client():
+    """Cliente de OpenAI; el SDK se importa y el cliente se construye en el primer uso."""
+    global _OPENAI_CLIENT
+    if _OPENAI_CLIENT is None:
+        import openai
+        _OPENAI_CLIENT = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return _OPENAI_CLIENT
+
+@contextmanager
+def openai_call(call: str):
+    """Span de una llamada a la API de OpenAI, que además se cuenta en `olivia_openai_requests_total`."""
+    METRICS.inc("olivia_openai_requests_total", call=call)
+    with span("openai", call=call) as current:
+        yield current
+
+class ThreadCache:
+    """
+    Relación chat -> thread de OpenAI. Se guarda en la base de datos local para sobrevivir
+    a reinicios, con una caché LRU limitada a THREAD_CACHE_SIZE chats delante. Un chat
+    inactivo más de THREAD_IDLE_HOURS empieza un thread nuevo, y si llegan varios mensajes
+    a la vez de un chat sin thread, todos esperan la misma creación (single-flight).
+    """
+
+    def __init__(self, max_size: int = THREAD_CACHE_SIZE, idle_ttl: float = THREAD_IDLE_HOURS * 3600):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._cache = OrderedDict()  # {chat_id: (thread_id, last_used_at)}
+        self._creating = {}  # {chat_id: Future con el thread_id en creación}
+
+    def clear(self):
+        self._cache.clear()
+
+    def _lookup(self, chat_id: int) -> tuple[str, int] | None:
+        entry = self._cache.get(chat_id)
+        if entry is not None:
+            self._cache.move_to_end(chat_id)
+            return entry
+        entry = storage.get_chat_thread(chat_id)
+        if entry is not None:
+            self._remember(chat_id, entry)
+        return entry
+
+    def _remember(self, chat_id: int, entry: tuple[str, int]):
+        self._cache[chat_id] = entry
+        self._cache.move_to_end(chat_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def get_or_create(self, chat_id: int) -> str:
+        now = int(time.time())
+        entry = self._lookup(chat_id)
+        if entry is not None and now - entry[1] < self.idle_ttl:
+            self._remember(chat_id, (entry[0], now))
+            storage.save_chat_thread(chat_id, entry[0], now)
+            return entry[0]
+
+        future = self._creating.get(chat_id)
+        if future is None:
+            future = asyncio.ensure_future(self._create(chat_id))
+            self._creating[chat_id] = future
+            future.add_done_callback(lambda _: self._creating.pop(chat_id, None))
+        return await asyncio.shield(future)
+
+    def get_active(self, chat_id: int) -> str | None:
+        """Thread vigente del chat, sin crear uno nuevo ni renovar su inactividad."""
+        entry = self._lookup(chat_id)
+        if entry is not None and time.time() - entry[1] < self.idle_ttl:
+            return entry[0]
+        return None
+
+    async def _create(self, chat_id: int) -> str:
         logger.info(f"Creando nuevo thread para el chat_id: {chat_id}")
-        try:
-            thread = await asyncio.to_thread(client.beta.threads.create)
-            USER_THREADS[chat_id] = thread.id
-            return thread.id
-        except Exception as e:
-            logger.error(f"Error creando thread: {e}")
-            return None
-    return USER_THREADS[chat_id]
+        with openai_call("threads.create"):
+            thread = await openai_client().beta.threads.create()
+        now = int(time.time())
+        self._remember(chat_id, (thread.id, now))
+        storage.save_chat_thread(chat_id, thread.id, now)
+        return thread.id
+
+# --- Threads de conversación por chat (persistidos en la base de datos local) ---
+USER_THREADS = ThreadCache()
+
+async def get_or_create_thread(chat_id):
+    try:
+        with span("thread"):
+            return await USER_THREADS.get_or_create(chat_id)
+    except Exception as e:
+        logger.error(f"Error creando thread: {e}")
+        return None
+
+TOOL_FUNCTIONS = {"create_task_notion": create_task_notion, "list_tasks_notion": list_tasks_notion,
+                  "update_task_notion": update_task_notion, "delete_task_notion": delete_task_notion,
+                  "set_reminder_notion": set_reminder_notion}
+# Herramientas sin efectos: una llamada repetida con los mismos argumentos en un turno reutiliza la salida
+READ_ONLY_TOOLS = {"list_tasks_notion"}
 
 async def execute_tool_call(tool_call, chat_id: int):
     """Ejecuta una función de herramienta y devuelve el resultado."""
     func_name = tool_call.function.name
+    func = TOOL_FUNCTIONS.get(func_name)
+    if func is None:
+        return {"tool_call_id": tool_call.id, "output": json.dumps({"status": "error", "message": f"Herramienta '{func_name}' desconocida."})}
+
+    turn = CURRENT_TURN.get()
+    key = (func_name, tool_call.function.arguments)
+    if turn is not None and func_name in READ_ONLY_TOOLS and key in turn.results:
+        METRICS.inc("olivia_turn_cache_total", kind="tool", outcome="hit")
+        return {"tool_call_id": tool_call.id, "output": turn.results[key]}
+
     arguments = json.loads(tool_call.function.arguments)
-    tool_functions = {"create_task_notion": create_task_notion, "list_tasks_notion": list_tasks_notion, 
-                      "update_task_notion": update_task_notion, "delete_task_notion": delete_task_notion, 
-                      "set_reminder_notion": set_reminder_notion}
-    
-    if func_name in tool_functions:
-        if func_name == 'set_reminder_notion': arguments['chat_id'] = chat_id
-        output = await asyncio.to_thread(tool_functions[func_name], **arguments)
-        return {"tool_call_id": tool_call.id, "output": output}
-    return {"tool_call_id": tool_call.id, "output": json.dumps({"status": "error", "message": f"Herramienta '{func_name}' desconocida."})}
+    if func_name == 'set_reminder_notion': arguments['chat_id'] = chat_id
+    with span("tool", tool=func_name):
+        output = await func(**arguments)
+    if turn is not None and func_name in READ_ONLY_TOOLS:
+        turn.results[key] = output
+    return {"tool_call_id": tool_call.id, "output": output}
+
+class TelegramReplyStream:
+    """
+    Muestra en Telegram la respuesta del asistente a medida que llega: el primer
+    fragmento se envía como mensaje y los siguientes lo editan, como mucho una vez
+    cada STREAM_EDIT_INTERVAL segundos. El texto final se formatea en Markdown.
+    """
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id, user_message = update.message.chat_id, update.message.text
-    await context.bot.send_chat_action(chat_id=chat_id, action='typing')
+    def __init__(self, message):
+        self.message = message
+        self.text = ""
+        self._sent = None
+        self._sent_text = ""
+        self._last_edit = 0.0
+
+    async def append(self, delta: str):
+        self.text += delta
+        if time.monotonic() - self._last_edit >= STREAM_EDIT_INTERVAL:
+            await self._show(self.text)
+
+    async def _show(self, text: str, parse_mode: str = None):
+        if not text.strip() or (text == self._sent_text and parse_mode is None): return
+        self._last_edit = time.monotonic()
+        if self._sent is None:
+            with span("telegram", call="send"):
+                self._sent = await self.message.reply_text(text, parse_mode=parse_mode)
+        else:
+            with span("telegram", call="edit"):
+                await self._sent.edit_text(text, parse_mode=parse_mode)
+        self._sent_text = text
+
+    async def finish(self, text: str = None):
+        """Publica el texto final (el acumulado o `text`), en Markdown si Telegram lo acepta."""
+        final_text = text or self.text
+        try:
+            await self._show(final_text, parse_mode=ParseMode.MARKDOWN)
+        except BadRequest as e:
+            # Markdown mal balanceado o texto sin cambios: se deja el texto plano
+            logger.warning(f"No se pudo aplicar Markdown a la respuesta: {e}")
+            await self._show(final_text)
 
-    thread_id = await get_or_create_thread(chat_id)
-    if not thread_id:
-        await update.message.reply_text("Lo siento, no pude iniciar una conversación. Inténtalo más tarde.")
-        return
+async def run_assistant_streaming(thread_id: str, chat_id: int, reply: TelegramReplyStream):
+    """
+    Ejecuta el run consumiendo su stream de eventos: las herramientas se ejecutan en
+    cuanto llega `requires_action` y el texto se va mostrando con `reply`.
+    Devuelve el run en su estado final.
+    """
+    run = None
+    import openai
 
+    stream_manager = openai_client().beta.threads.runs.stream(thread_id=thread_id, assistant_id=ASSISTANT_ID)
+    stream_call = "runs.stream"
     try:
-        await asyncio.to_thread(client.beta.threads.messages.create, thread_id=thread_id, role="user", content=user_message)
-        run = await asyncio.to_thread(client.beta.threads.runs.create, thread_id=thread_id, assistant_id=ASSISTANT_ID)
-
-        # Bucle principal para gestionar el ciclo de vida del "run"
         while True:
-            await asyncio.sleep(1.5) # Dar tiempo para que el estado cambie
-            run = await asyncio.to_thread(client.beta.threads.runs.retrieve, thread_id=thread_id, run_id=run.id)
+            with openai_call(stream_call):
+                async with stream_manager as stream:
+                    async for event in stream:
+                        if event.event == "thread.message.delta":
+                            for part in event.data.delta.content or []:
+                                if part.type == "text" and part.text and part.text.value:
+                                    await reply.append(part.text.value)
+                        elif event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                            run = event.data
+                            if run.status == "requires_action": break
+
+            if run is None or run.status != "requires_action":
+                return run
+
+            tool_calls = run.required_action.submit_tool_outputs.tool_calls
+            tool_outputs = await asyncio.gather(*[execute_tool_call(tc, chat_id) for tc in tool_calls])
+            stream_manager = openai_client().beta.threads.runs.submit_tool_outputs_stream(
+                thread_id=thread_id, run_id=run.id, tool_outputs=tool_outputs
+            )
+            stream_call = "runs.submit_tool_outputs_stream"
+    except openai.APIError as e:
+        # Stream no disponible o cortado: se continúa con polling sobre el mismo run (o uno nuevo
+        # si aún no se había creado) y el texto final se leerá de los mensajes del thread.
+        logger.warning(f"Streaming no disponible para el chat {chat_id}, usando polling: {e}")
+        reply.text = ""
+        if run is not None:
+            with openai_call("runs.retrieve"):
+                run = await openai_client().beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+        return await run_assistant_polling(thread_id, chat_id, run)
+
+async def run_assistant_polling(thread_id: str, chat_id: int, run=None):
+    """
+    Alternativa sin streaming: consulta el estado del run con espera adaptativa
+    (empieza en RUN_POLL_INITIAL_DELAY y crece hasta RUN_POLL_MAX_DELAY, volviendo
+    a empezar tras enviar los resultados de las herramientas). Devuelve el run final.
+    """
+    if run is None:
+        with openai_call("runs.create"):
+            run = await openai_client().beta.threads.runs.create(thread_id=thread_id, assistant_id=ASSISTANT_ID)
+    delay = RUN_POLL_INITIAL_DELAY
+    while True:
+        if run.status in ["queued", "in_progress"]:
+            with span("poll_wait"):
+                await asyncio.sleep(delay)
+            delay = min(delay * 1.5, RUN_POLL_MAX_DELAY)
+            with openai_call("runs.retrieve"):
+                run = await openai_client().beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+            continue
+
+        if run.status == "requires_action":
+            tool_calls = run.required_action.submit_tool_outputs.tool_calls
+            tool_outputs = await asyncio.gather(*[execute_tool_call(tc, chat_id) for tc in tool_calls])
+            with openai_call("runs.submit_tool_outputs"):
+                run = await openai_client().beta.threads.runs.submit_tool_outputs(thread_id=thread_id, run_id=run.id, tool_outputs=tool_outputs)
+            delay = RUN_POLL_INITIAL_DELAY
+            continue
+
+        return run
+
+# --- Atajos locales: pedidos frecuentes que se resuelven sin un run del asistente ---
+# Operan sobre el texto normalizado (normalize_title: minúsculas, sin tildes ni puntuación).
+# Ante cualquier duda (patrón distinto, tarea ambigua, error de la herramienta) el mensaje
+# sigue al asistente como siempre.
+
+LIST_INTENT_RE = re.compile(
+    r"^(?:que (?:tengo|hay)(?: que hacer)?|(?:(?:muestrame|lista|listar|dame|ver) )?(?:mis |las )?tareas)"
+    r"(?: (?:para|de))? (hoy|manana|pasado manana)$"
+)
+COMPLETE_INTENT_RE = re.compile(
+    r"^(?:(?:marca|marcar|pon|poner|deja|dejar) (?:la tarea )?(?P<title>.+?) (?:como )?"
+    r"(?:hecha|hecho|lista|listo|completada|completado|terminada|terminado)"
+    r"|(?:completa|completar|termine|terminar) (?:la tarea )?(?P<title2>.+))$"
+)
+REMINDER_INTENT_RE = re.compile(
+    r"^(?:recuerdame|recordarme|avisame|ponme un recordatorio(?: de| para| sobre)?) (?:de |sobre )?(?:la tarea )?"
+    r"(?P<title>.+?) (?P<delta>\d+ (?:minutos?|horas?|dias?)) antes$"
+)
+
+def find_confident_task(title_to_find: str) -> tuple[str | None, str | None]:
+    """
+    Como find_task_by_title_enhanced, pero solo sobre el índice local y exigiendo que el
+    título encontrado contenga todas las palabras buscadas o se le parezca mucho.
+    """
+    tenant = current_tenant()
+    norm_title_to_find = normalize_title(title_to_find)
+    if not (norm_title_to_find and tenant.mirror_ready.is_set()): return None, None
+    task_id, real_title = tenant.index.search(norm_title_to_find)
+    if not task_id: return None, None
+    norm_title = normalize_title(real_title)
+    if set(norm_title_to_find.split()) <= set(norm_title.split()):
+        return task_id, real_title
+    if SequenceMatcher(None, norm_title_to_find, norm_title).ratio() >= LOCAL_INTENT_MIN_SIMILARITY:
+        return task_id, real_title
+    return None, None
+
+def done_status() -> str | None:
+    """Estado que significa "terminada" en la base de datos del tenant (uno de BRIEFING_DONE_STATUSES)."""
+    options = current_tenant().status_options
+    return next((status for status in BRIEFING_DONE_STATUSES if status in options), None)
+
+async def route_local_intent(text: str, chat_id: int) -> tuple[str, str] | None:
+    """Devuelve (intención, respuesta) si el mensaje es un pedido simple que se resolvió localmente; None si no."""
+    norm_text = normalize_title(text)
+
+    match = LIST_INTENT_RE.match(norm_text)
+    if match:
+        day = match.group(1)
+        result = json.loads(await list_tasks_notion(due_date=day))
+        if result["status"] != "success": return None
+        label = {"hoy": "hoy", "manana": "mañana", "pasado manana": "pasado mañana"}[day]
+        if not isinstance(result["data"], list):
+            return "list", f"✨ No tienes tareas para {label}."
+        lines = "".join(f"- *{task['title']}* (Estado: {task['status']})\n" for task in result["data"])
+        return "list", f"📋 *Tareas para {label}:*\n{lines}"
+
+    match = COMPLETE_INTENT_RE.match(norm_text)
+    if match:
+        status = done_status()
+        task_id, real_title = find_confident_task(match.group("title") or match.group("title2"))
+        if not (status and task_id): return None
+        result = json.loads(await update_task_by_id(task_id, real_title, new_status=status))
+        if result["status"] != "success": return None
+        return "complete", f"✅ Listo, marqué *{real_title}* como {status}."
+
+    match = REMINDER_INTENT_RE.match(norm_text)
+    if match:
+        task_id, real_title = find_confident_task(match.group("title"))
+        if not task_id: return None
+        result = json.loads(await set_reminder_by_id(task_id, real_title, f"{match.group('delta')} antes", chat_id))
+        # Sin fecha límite, por ejemplo, el asistente sabe ofrecer ponerle una
+        if result["status"] != "success": return None
+        return "reminder", f"🔔 {result['message']}"
+
+    return None
+
+async def answer_locally(message, chat_id: int) -> bool:
+    """Intenta resolver el mensaje con un atajo local; devuelve True si ya se respondió."""
+    try:
+        with span("local_intent"):
+            routed = await route_local_intent(message.text, chat_id)
+    except Exception as e:
+        logger.error(f"Error en el atajo local del chat {chat_id}; se usa el asistente: {e}", exc_info=True)
+        return False
+    if routed is None: return False
+
+    intent, reply_text = routed
+    METRICS.inc("olivia_local_intents_total", intent=intent)
+    await TelegramReplyStream(message).finish(reply_text)
+
+    # El thread del asistente también registra el intercambio, para que un mensaje
+    # posterior ("y ponle un recordatorio") tenga el contexto
+    thread_id = USER_THREADS.get_active(chat_id)
+    if thread_id:
+        try:
+            with openai_call("messages.create"):
+                await openai_client().beta.threads.messages.create(thread_id=thread_id, role="user", content=message.text)
+            with openai_call("messages.create"):
+                await openai_client().beta.threads.messages.create(thread_id=thread_id, role="assistant", content=reply_text)
+        except Exception as e:
+            logger.warning(f"No se pudo copiar el atajo local al thread del chat {chat_id}: {e}")
+    return True
+
+async def run_turn(messages: list, context: ContextTypes.DEFAULT_TYPE):
+    """Procesa un turno completo: uno o más mensajes seguidos del mismo chat en un único run."""
+    message = messages[-1]
+    chat_id = message.chat_id
+    user_message = "\n".join(m.text for m in messages)
+    outcome = "error"
+    tenant = TENANTS.for_chat(chat_id)
+    if tenant is None:
+        logger.warning(f"Mensaje del chat {chat_id}, que no pertenece a ningún tenant.")
+        await message.reply_text("Este chat no está configurado para usar el asistente.")
+        METRICS.inc("olivia_turns_total", outcome="no_tenant")
+        return
+    with use_tenant(tenant), use_turn(), turn_trace(chat_id, log=METRICS_TRACE):
+        if LOCAL_INTENTS and len(messages) == 1 and await answer_locally(message, chat_id):
+            METRICS.inc("olivia_turns_total", outcome="local")
+            return
 
-            if run.status == "completed":
-                messages = await asyncio.to_thread(client.beta.threads.messages.list, thread_id=thread_id, limit=1)
-                response_text = messages.data[0].content[0].text.value
-                await update.message.reply_text(response_text, parse_mode=ParseMode.MARKDOWN)
-                break  # Salir del bucle
+        with span("telegram", call="chat_action"):
+            await context.bot.send_chat_action(chat_id=chat_id, action='typing')
 
-            if run.status in ["queued", "in_progress"]:
-                continue  # Continuar esperando
+        thread_id = await get_or_create_thread(chat_id)
+        if not thread_id:
+            await message.reply_text("Lo siento, no pude iniciar una conversación. Inténtalo más tarde.")
+            METRICS.inc("olivia_turns_total", outcome="no_thread")
+            return
 
-            if run.status == "requires_action":
-                tool_calls = run.required_action.submit_tool_outputs.tool_calls
-                tool_outputs = await asyncio.gather(*[execute_tool_call(tc, chat_id) for tc in tool_calls])
-                
-                # Enviar los resultados y volver al inicio del bucle para esperar el siguiente estado
-                run = await asyncio.to_thread(
-                    client.beta.threads.runs.submit_tool_outputs,
-                    thread_id=thread_id,
-                    run_id=run.id,
-                    tool_outputs=tool_outputs
-                )
-                continue # Volver a esperar
-
-            # Si el estado es fallido, cancelado o expirado, informar y salir.
-            if run.status in ["failed", "cancelled", "expired"]:
+        try:
+            with openai_call("messages.create"):
+                await openai_client().beta.threads.messages.create(thread_id=thread_id, role="user", content=user_message)
+
+            reply = TelegramReplyStream(message)
+            if RUN_STREAMING:
+                run = await run_assistant_streaming(thread_id, chat_id, reply)
+            else:
+                run = await run_assistant_polling(thread_id, chat_id)
+
+            if run is not None and run.status == "completed":
+                if reply.text:
+                    await reply.finish()
+                else:
+                    with openai_call("messages.list"):
+                        thread_messages = await openai_client().beta.threads.messages.list(thread_id=thread_id, limit=1)
+                    await reply.finish(thread_messages.data[0].content[0].text.value)
+                outcome = "completed"
+            elif run is None:
+                raise RuntimeError("El stream del run terminó sin un estado final.")
+            else:
+                # Si el estado es fallido, cancelado o expirado, informar y salir.
                 logger.error(f"Run {run.id} terminó con estado: {run.status}. Razón: {run.last_error}")
                 error_message = run.last_error.message if run.last_error else "sin detalles"
-                await update.message.reply_text(f"Lo siento, la operación falló ({error_message}).")
-                break # Salir del bucle
-            
-    except Exception as e:
-        logger.error(f"Error en handle_message para chat {chat_id}: {e}", exc_info=True)
-        await update.message.reply_text("Hubo un problema inesperado al procesar tu mensaje. Inténtalo de nuevo.")
+                outcome = run.status
+                await message.reply_text(f"Lo siento, la operación falló ({error_message}).")
+                
+        except Exception as e:
+            logger.error(f"Error procesando el turno del chat {chat_id}: {e}", exc_info=True)
+            await message.reply_text("Hubo un problema inesperado al procesar tu mensaje. Inténtalo de nuevo.")
+        finally:
+            METRICS.inc("olivia_turns_total", outcome=outcome)
+
+class ChatQueue:
+    """
+    Cola de trabajo por chat. OpenAI no admite dos runs a la vez en un thread, así que
+    cada chat procesa un turno cada vez; los mensajes que llegan mientras su run está en
+    curso se agrupan y se envían juntos en el siguiente. Chats distintos avanzan en
+    paralelo, con un máximo global de MAX_CONCURRENT_RUNS turnos simultáneos.
+
+    Como mucho se aceptan `max_pending` mensajes sin terminar de procesar: al llegar a ese
+    límite `submit` espera a que se libere sitio, lo que frena a quien entrega los updates
+    (la cola de updates de PTB y, en modo webhook, la respuesta HTTP a Telegram).
+
+    Los workers se crean con `application.create_task`: al apagar, `application.stop()`
+    procesa los updates ya recibidos y espera a que terminen sus turnos.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_RUNS, max_pending: int = MAX_PENDING_MESSAGES):
+        self._pending = {}  # {chat_id: [Message]} mensajes a la espera del próximo turno
+        self._workers = {}  # {chat_id: Task} que está vaciando la cola del chat
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._capacity = asyncio.Semaphore(max_pending)
+
+    async def submit(self, message, context: ContextTypes.DEFAULT_TYPE):
+        if self._capacity.locked():
+            METRICS.inc("olivia_backpressure_waits_total")
+            logger.warning(f"Cola de mensajes llena; esperando para aceptar el mensaje del chat {message.chat_id}.")
+        await self._capacity.acquire()
+        chat_id = message.chat_id
+        self._pending.setdefault(chat_id, []).append(message)
+        if chat_id not in self._workers:
+            # Con application.create_task, application.stop() espera a que terminen los turnos en curso
+            self._workers[chat_id] = context.application.create_task(self._drain(chat_id, context), name=f"chat-{chat_id}")
+
+    async def _drain(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            while self._pending.get(chat_id):
+                async with self._semaphore:
+                    messages = self._pending.pop(chat_id)
+                    if len(messages) > 1:
+                        logger.info(f"Agrupando {len(messages)} mensajes del chat {chat_id} en un solo run.")
+                    try:
+                        await run_turn(messages, context)
+                    finally:
+                        for _ in messages:
+                            self._capacity.release()
+        finally:
+            self._workers.pop(chat_id, None)
+
+CHAT_QUEUE = ChatQueue()
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Encola el mensaje en la cola de su chat y devuelve el control a Telegram de inmediato (salvo que la cola esté llena)."""
+    await CHAT_QUEUE.submit(update.message, context)
 
 # -----------------------------------------------------------------------------
 # 5. COMANDOS, SCHEDULING Y EJECUCIÓN DEL BOT
@@ -455,57 +1972,436 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /start. Saluda al usuario."""
     await update.message.reply_text("¡Hola, Mau! Soy Olivia, tu asistente personal. ¿En qué puedo ayudarte hoy?")
 
-async def check_reminders(bot: Bot):
-    """Revisa y envía recordatorios pendientes desde la BD."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    # Comparar con la hora actual en UTC, ya que así se guardan en la BD
-    now_utc = datetime.now(pytz.utc)
-    
+async def sync_tasks_job(tenant: Tenant, full: bool = False):
+    """Función llamada por el scheduler para mantener al día el espejo de tareas de un tenant."""
     try:
-        cursor.execute("SELECT id, chat_id, task_title FROM reminders WHERE remind_time <= ? AND status = 'pending'", (now_utc,))
-        reminders = cursor.fetchall()
-        for r_id, chat_id, task_title in reminders:
-            message = f"🔔 **Recordatorio** 🔔\n\nNo te olvides de tu tarea: **{task_title}**"
-            await bot.send_message(chat_id=chat_id, text=message, parse_mode=ParseMode.MARKDOWN)
-            cursor.execute("UPDATE reminders SET status = 'sent' WHERE id = ?", (r_id,))
-            conn.commit()
-            logger.info(f"Recordatorio enviado para '{task_title}' al chat {chat_id}")
+        with use_tenant(tenant):
+            await sync_tasks_mirror(full)
     except Exception as e:
-        logger.error(f"Error en check_reminders: {e}", exc_info=True)
+        logger.error(f"Error sincronizando el espejo de tareas del tenant '{tenant.id}': {e}", exc_info=True)
+
+class ReminderScheduler:
+    """
+    Recordatorios pendientes en un min-heap ordenado por hora de envío. Se carga desde
+    SQLite al arrancar y `set_reminder_db` añade los nuevos; un único bucle duerme
+    exactamente hasta el próximo vencimiento (o hasta que llega uno más temprano), así
+    que no hay consultas periódicas a la base de datos.
+    """
+
+    def __init__(self):
+        self._heap = []  # [(remind_ts, reminder_id, chat_id, task_title, attempts)]
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def load(self, rows: list[tuple]):
+        """Carga en el heap recordatorios pendientes (r_id, chat_id, task_title, remind_at, attempts) de la BD."""
+        self._heap = [(remind_at, r_id, chat_id, task_title, attempts) for r_id, chat_id, task_title, remind_at, attempts in rows]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def add(self, reminder_id: int, chat_id: int, task_title: str, remind_ts: float, attempts: int = 0):
+        is_earliest = not self._heap or remind_ts < self._heap[0][0]
+        heapq.heappush(self._heap, (remind_ts, reminder_id, chat_id, task_title, attempts))
+        if is_earliest:
+            self._wakeup.set()
+
+    def pop_due(self, now_ts: float) -> list[tuple]:
+        due = []
+        while self._heap and self._heap[0][0] <= now_ts:
+            due.append(heapq.heappop(self._heap))
+        return due
+
+    async def run(self, bot: Bot):
+        """Bucle principal: espera al siguiente vencimiento y envía lo que toque."""
+        while True:
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await check_reminders(bot, self)
+            except Exception as e:
+                logger.error(f"Error en el bucle de recordatorios: {e}", exc_info=True)
+
+class ShardedReminders:
+    """
+    Recordatorios repartidos en SCHEDULER_PARTITIONS heaps, cada uno con su propio bucle.
+    Los de un chat van a la partición de su tenant, así que una ráfaga de vencimientos (o
+    envíos lentos) de un tenant solo retrasa a los tenants de su misma partición.
+    """
+
+    def __init__(self, partitions: int = SCHEDULER_PARTITIONS):
+        self.partitions = [ReminderScheduler() for _ in range(partitions)]
+
+    def __len__(self):
+        return sum(len(partition) for partition in self.partitions)
+
+    def partition_for(self, chat_id: int) -> ReminderScheduler:
+        tenant = TENANTS.for_chat(chat_id)
+        index = tenant.partition if tenant else zlib.crc32(str(chat_id).encode())
+        return self.partitions[index % len(self.partitions)]
+
+    async def load(self):
+        """Reparte entre las particiones los recordatorios pendientes guardados en la BD."""
+        interrupted = await storage.expire_reminder_claims()
+        if interrupted:
+            METRICS.inc("olivia_reminders_total", interrupted, outcome="interrupted")
+            logger.warning(f"{interrupted} recordatorios quedaron a medio enviar en la ejecución anterior; no se reenvían.")
+        rows_by_partition = defaultdict(list)
+        for row in storage.pending_reminders():
+            rows_by_partition[id(self.partition_for(row[1]))].append(row)
+        for partition in self.partitions:
+            partition.load(rows_by_partition[id(partition)])
+        logger.info(f"{len(self)} recordatorios pendientes cargados en {len(self.partitions)} particiones.")
+
+    def add(self, reminder_id: int, chat_id: int, task_title: str, remind_ts: float, attempts: int = 0):
+        self.partition_for(chat_id).add(reminder_id, chat_id, task_title, remind_ts, attempts)
+
+    def pop_due(self, now_ts: float) -> list[tuple]:
+        return [reminder for partition in self.partitions for reminder in partition.pop_due(now_ts)]
+
+    async def run(self, bot: Bot):
+        await asyncio.gather(*[partition.run(bot) for partition in self.partitions])
+
+class ChatRateLimiter:
+    """Espaciado mínimo entre mensajes a un mismo chat (Telegram admite ~1 mensaje/s por chat)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = {}  # {chat_id: instante (monotonic) desde el que el chat puede recibir otro mensaje}
+
+    async def acquire(self, chat_id: int):
+        now = time.monotonic()
+        ready_at = self._next.get(chat_id, now)
+        # Se reserva el turno antes de esperar: las llamadas concurrentes quedan en fila
+        self._next[chat_id] = max(now, ready_at) + self.interval
+        if len(self._next) > 10_000:
+            self._next = {chat: at for chat, at in self._next.items() if at > now}
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+REMINDERS = ShardedReminders()
+TELEGRAM_LIMITER = TokenBucket(TELEGRAM_RATE_LIMIT)
+CHAT_LIMITER = ChatRateLimiter(TELEGRAM_CHAT_RATE_LIMIT)
+
+def reminder_text(task_titles: list[str]) -> str:
+    if len(task_titles) == 1:
+        return f"🔔 **Recordatorio** 🔔\n\nNo te olvides de tu tarea: **{task_titles[0]}**"
+    return "🔔 **Recordatorios** 🔔\n\nNo te olvides de tus tareas:\n" + "\n".join(f"- **{title}**" for title in task_titles)
+
+async def send_reminder_message(bot: Bot, chat_id: int, task_titles: list[str]):
+    text = reminder_text(task_titles)
+    try:
+        await bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.MARKDOWN)
+    except BadRequest as e:
+        # Un título con caracteres de Markdown sin cerrar: se envía como texto plano
+        if "parse" not in str(e).lower(): raise
+        await bot.send_message(chat_id=chat_id, text=text)
+
+async def deliver_chat_reminders(bot: Bot, scheduler: ReminderScheduler, chat_id: int, reminders: list[tuple], outcomes: list[tuple]):
+    """
+    Envía los recordatorios vencidos de un chat (agrupados) y anota en `outcomes` el resultado
+    de cada uno. Si se cancela (al apagar el bot), los que no llegaron a enviarse vuelven a
+    'pending'; solo los del mensaje que estaba enviándose quedan en 'sending'.
+    """
+    for start in range(0, len(reminders), REMINDERS_PER_MESSAGE):
+        chunk = reminders[start:start + REMINDERS_PER_MESSAGE]
+        retry_delay, sending = None, False
+        try:
+            await CHAT_LIMITER.acquire(chat_id)
+            await TELEGRAM_LIMITER.acquire()
+            sending = True
+            await send_reminder_message(bot, chat_id, [reminder[3] for reminder in chunk])
+        except asyncio.CancelledError:
+            unsent = reminders[start + len(chunk):] if sending else reminders[start:]
+            outcomes.extend((r_id, "pending", attempts) for _, r_id, _, _, attempts in unsent)
+            raise
+        except RetryAfter as e:
+            # Límite de Telegram: se frenan todos los envíos el tiempo que pide
+            seconds = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+            TELEGRAM_LIMITER.pause(seconds)
+            retry_delay = seconds
+            logger.warning(f"Telegram pidió esperar {seconds:.0f}s al enviar recordatorios al chat {chat_id}.")
+        except (Forbidden, BadRequest) as e:
+            # El usuario bloqueó el bot o el chat no existe: reintentar no sirve
+            METRICS.inc("olivia_reminders_total", len(chunk), outcome="failed")
+            logger.error(f"No se pueden enviar recordatorios al chat {chat_id}: {e}")
+            outcomes.extend((r_id, "failed", attempts + 1) for _, r_id, _, _, attempts in chunk)
+            continue
+        except Exception as e:
+            logger.warning(f"Error enviando recordatorios al chat {chat_id}: {e}")
+        else:
+            now = time.time()
+            for remind_ts, r_id, _, task_title, attempts in chunk:
+                # Retraso respecto a la hora programada (la del reintento, si el primer envío falló)
+                METRICS.observe("olivia_reminder_lag_seconds", now - remind_ts)
+                outcomes.append((r_id, "sent", attempts + 1))
+            METRICS.inc("olivia_reminders_total", len(chunk), outcome="sent")
+            logger.info(f"{len(chunk)} recordatorios enviados al chat {chat_id}.")
+            continue
+
+        # Fallo transitorio: vuelve a 'pending' y al heap con espera exponencial
+        for remind_ts, r_id, _, task_title, attempts in chunk:
+            attempts += 1
+            if attempts >= REMINDER_MAX_ATTEMPTS:
+                METRICS.inc("olivia_reminders_total", outcome="failed")
+                logger.error(f"El recordatorio {r_id} del chat {chat_id} se da por fallido tras {attempts} intentos.")
+                outcomes.append((r_id, "failed", attempts))
+                continue
+            METRICS.inc("olivia_reminders_total", outcome="retry")
+            outcomes.append((r_id, "pending", attempts))
+            delay = retry_delay or min(REMINDER_RETRY_SECONDS * 2 ** (attempts - 1), REMINDER_MAX_BACKOFF)
+            scheduler.add(r_id, chat_id, task_title, time.time() + delay, attempts)
+
+async def check_reminders(bot: Bot, scheduler: ReminderScheduler):
+    """
+    Envía los recordatorios vencidos de una partición. Primero los reclama en la BD (estado
+    'sending') en una transacción; después los envía en paralelo entre chats, respetando
+    los límites global y por chat de Telegram, y agrupando los de un mismo chat en un solo
+    mensaje. Los resultados se registran juntos en el siguiente lote de escrituras, también
+    si el envío se cancela a medias.
+    """
+    due = scheduler.pop_due(time.time())
+    if not due: return
+
+    claim = asyncio.ensure_future(storage.claim_reminders([reminder[1] for reminder in due]))
+    try:
+        claimed = set(await asyncio.shield(claim))
+    except asyncio.CancelledError:
+        # Cancelado mientras se reclamaban: la transacción termina igual y lo reclamado vuelve a 'pending'
+        claimed = set(await claim)
+        storage.record_reminder_outcomes([(r_id, "pending", attempts) for _, r_id, _, _, attempts in due if r_id in claimed])
+        raise
+    by_chat = defaultdict(list)
+    for reminder in due:
+        if reminder[1] in claimed:
+            by_chat[reminder[2]].append(reminder)
+
+    outcomes = []
+    try:
+        await asyncio.gather(*[deliver_chat_reminders(bot, scheduler, chat_id, reminders, outcomes) for chat_id, reminders in by_chat.items()])
     finally:
-        conn.close()
+        storage.record_reminder_outcomes(outcomes)
+
+class DailyBriefing:
+    """
+    Briefing diario precalculado a partir del espejo local. Guarda las tareas de hoy, las
+    atrasadas sin terminar y las de los próximos BRIEFING_UPCOMING_DAYS días; cada cambio
+    en el espejo se aplica aquí tarea a tarea y el texto solo se vuelve a formatear cuando
+    algo cambió. Se reconstruye al cambiar el día (hora de Santiago) o tras una
+    sincronización completa. Hay uno por tenant: todos los chats de un tenant comparten
+    su base de datos de Notion y por tanto el mismo briefing.
+    """
+
+    def __init__(self, tenant_id: str, upcoming_days: int = BRIEFING_UPCOMING_DAYS, done_statuses: tuple = BRIEFING_DONE_STATUSES):
+        self.tenant_id = tenant_id
+        self.upcoming_days = upcoming_days
+        self.done_statuses = done_statuses
+        self._day = None  # Día local para el que se calcularon las secciones
+        self._tasks = {}  # {task_id: (title, status, due_date)}
+        self._text = None  # Mensaje ya formateado; None si hay que volver a generarlo
+        self._version = 0
+
+    def _horizon(self) -> str:
+        return (self._day + timedelta(days=self.upcoming_days + 1)).isoformat()
+
+    def _is_relevant(self, status: str | None, due_date: str | None) -> bool:
+        # Mismo criterio que storage.find_briefing_tasks
+        if not due_date or due_date >= self._horizon(): return False
+        return due_date >= self._day.isoformat() or status not in self.done_statuses
+
+    async def refresh(self):
+        """Recalcula las secciones desde el espejo local (en un hilo, sin bloquear el bucle)."""
+        today = datetime.now(LOCAL_TZ).date()
+        until = (today + timedelta(days=self.upcoming_days + 1)).isoformat()
+        while True:
+            version = self._version
+            rows = await asyncio.to_thread(storage.find_briefing_tasks, self.tenant_id, today.isoformat(), until, self.done_statuses)
+            # Si llegaron cambios durante la lectura, se vuelve a leer para no perderlos
+            if version == self._version: break
+        self._tasks = {task_id: (title, status, due_date) for task_id, title, status, due_date in rows}
+        self._day = today
+        self._text = None
+        logger.info(f"Briefing del tenant '{self.tenant_id}' preparado para el {today.isoformat()}: {len(self._tasks)} tareas.")
+
+    def apply(self, tasks: list[dict], deleted_ids: list[str]):
+        """Actualiza el briefing con tareas creadas, editadas o archivadas en el espejo."""
+        self._version += 1
+        if self._day is None: return
+        for task_id in deleted_ids:
+            self._tasks.pop(task_id, None)
+        for task in tasks:
+            if self._is_relevant(task["status"], task["due_date"]):
+                self._tasks[task["id"]] = (task["title"], task["status"], task["due_date"])
+            else:
+                self._tasks.pop(task["id"], None)
+        self._text = None
+
+    def invalidate(self):
+        self._version += 1
+        self._day = None
+
+    async def get(self) -> str:
+        """Devuelve el mensaje del briefing; solo consulta el espejo si cambió el día o se invalidó."""
+        if self._day != datetime.now(LOCAL_TZ).date():
+            await self.refresh()
+        if self._text is None:
+            self._text = self._render()
+        return self._text
+
+    @staticmethod
+    def _section(title: str, lines: list[str]) -> str:
+        text = f"{title}\n" + "".join(f"{line}\n" for line in lines[:BRIEFING_SECTION_LIMIT])
+        if len(lines) > BRIEFING_SECTION_LIMIT:
+            text += f"_...y {len(lines) - BRIEFING_SECTION_LIMIT} más._\n"
+        return text
+
+    def _render(self) -> str:
+        today = self._day.isoformat()
+        today_lines, overdue_lines, upcoming_lines = [], [], []
+        for title, status, due_date in sorted(self._tasks.values(), key=lambda t: (t[2], t[0] or "")):
+            day = due_date[:10]
+            label = f"{day[8:10]}/{day[5:7]}"
+            if day == today:
+                today_lines.append(f"- *{title or '(Sin título)'}* (Estado: {status or 'N/A'})")
+            elif day < today:
+                overdue_lines.append(f"- *{title or '(Sin título)'}* (venció el {label})")
+            else:
+                upcoming_lines.append(f"- *{title or '(Sin título)'}* ({label})")
+
+        message = "☕ *¡Buenos días! Tu briefing diario de Notion está listo.*\n\n"
+        if today_lines:
+            message += self._section("*Tareas para hoy:*", today_lines)
+        else:
+            message += "✨ No tienes tareas programadas para hoy. ¡Que tengas un día productivo!\n"
+        if overdue_lines:
+            # Las más recientes primero: las muy antiguas suelen estar abandonadas
+            message += "\n" + self._section("⏰ *Atrasadas:*", overdue_lines[::-1])
+        if upcoming_lines:
+            message += "\n" + self._section(f"📅 *Próximos {self.upcoming_days} días:*", upcoming_lines)
+        return message
+
+async def prepare_briefing(tenant: Tenant):
+    """Job previo al briefing: trae los últimos cambios de Notion y deja el briefing del tenant calculado."""
+    await sync_tasks_job(tenant)
+    await tenant.briefing.refresh()
 
 async def generate_and_send_briefing(bot: Bot, chat_id: int):
-    """Genera y envía el briefing diario de tareas para hoy."""
-    logger.info(f"Generando briefing diario para el chat_id: {chat_id}")
-    tasks_json = list_tasks_notion(due_date="hoy")
-    tasks_data = json.loads(tasks_json).get("data", [])
-    message = "☕ *¡Buenos días! Tu briefing diario de Notion está listo.*\n\n"
-    if isinstance(tasks_data, list) and tasks_data:
-        message += "*Tareas para hoy:*\n"
-        for task in tasks_data:
-            message += f"- *{task['title']}* (Estado: {task['status']})\n"
-    else:
-        message += "✨ No tienes tareas programadas para hoy. ¡Que tengas un día productivo!\n"
+    """Envía el briefing diario (ya precalculado) del tenant activo al chat."""
+    logger.info(f"Enviando briefing diario al chat_id: {chat_id}")
+    message = await current_tenant().briefing.get()
     await bot.send_message(chat_id=chat_id, text=message, parse_mode=ParseMode.MARKDOWN)
 
-async def scheduled_briefing(bot: Bot):
-    """Función llamada por el scheduler para el briefing."""
-    if TELEGRAM_CHAT_ID_BRIEFING:
-        await generate_and_send_briefing(bot, int(TELEGRAM_CHAT_ID_BRIEFING))
+async def scheduled_briefing(bot: Bot, tenant: Tenant):
+    """Función llamada por el scheduler para el briefing de un tenant."""
+    with use_tenant(tenant):
+        for chat_id in tenant.briefing_chat_ids:
+            try:
+                await generate_and_send_briefing(bot, chat_id)
+            except Exception as e:
+                logger.error(f"Error enviando el briefing del tenant '{tenant.id}' al chat {chat_id}: {e}", exc_info=True)
 
 async def briefing_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /briefing. Envía el briefing a demanda."""
-    await update.message.reply_text("Generando tu briefing, un momento...")
-    await generate_and_send_briefing(context.bot, update.message.chat_id)
+    tenant = TENANTS.for_chat(update.message.chat_id)
+    if tenant is None:
+        await update.message.reply_text("Este chat no está configurado para usar el asistente.")
+        return
+    with use_tenant(tenant):
+        await generate_and_send_briefing(context.bot, update.message.chat_id)
+
+def schedule_tenant_jobs(scheduler: AsyncIOScheduler, bot: Bot, tenant: Tenant):
+    """
+    Programa la sincronización y el briefing de un tenant. Cada tenant tiene sus propios
+    jobs; los periódicos arrancan desfasados según su partición para que las
+    sincronizaciones de todos los tenants no coincidan en el mismo instante.
+    """
+    offset = tenant.partition / SCHEDULER_PARTITIONS
+    now = datetime.now(pytz.utc)
+    scheduler.add_job(sync_tasks_job, 'interval', seconds=TASK_SYNC_INTERVAL, args=[tenant], max_instances=1, coalesce=True,
+                      next_run_time=now + timedelta(seconds=TASK_SYNC_INTERVAL * (1 + offset)))
+    scheduler.add_job(sync_tasks_job, 'interval', hours=TASK_FULL_SYNC_HOURS, args=[tenant], kwargs={"full": True}, max_instances=1, coalesce=True,
+                      next_run_time=now + timedelta(hours=TASK_FULL_SYNC_HOURS * (1 + offset)))
+    if tenant.briefing_time and tenant.briefing_chat_ids:
+        try:
+            hour, minute = map(int, tenant.briefing_time.split(':'))
+            prepare_at = (hour * 60 + minute - BRIEFING_PREPARE_MINUTES) % (24 * 60)
+            scheduler.add_job(prepare_briefing, 'cron', hour=prepare_at // 60, minute=prepare_at % 60, timezone=LOCAL_TZ, args=[tenant], max_instances=1, coalesce=True)
+            scheduler.add_job(scheduled_briefing, 'cron', hour=hour, minute=minute, timezone=LOCAL_TZ, args=[bot, tenant])
+            logger.info(f"Briefing diario del tenant '{tenant.id}' programado a las {tenant.briefing_time} (local) para los chats {tenant.briefing_chat_ids}.")
+        except ValueError:
+            logger.error(f"Formato de briefing_time ('{tenant.briefing_time}') del tenant '{tenant.id}' incorrecto. Usar HH:MM.")
+
+async def start_tenant(tenant: Tenant):
+    """Sincroniza el espejo completo del tenant y prepara su briefing."""
+    with use_tenant(tenant):
+        await sync_tasks_job(tenant, full=True)
+        await tenant.briefing.refresh()
+
+async def warm_up():
+    """
+    Trabajo de arranque que no necesita bloquear la recepción de updates: carga openai y
+    dateparser, y sincroniza el espejo completo de todos los tenants a la vez (cada uno
+    con su límite de Notion). Mientras tanto las búsquedas usan el espejo guardado en la
+    base de datos o, si un tenant aún no tiene datos, van directo a Notion.
+    """
+    await asyncio.gather(asyncio.to_thread(openai_client), asyncio.to_thread(warm_up_date_parser))
+    STARTUP.mark("openai y dateparser")
+    await asyncio.gather(*[start_tenant(tenant) for tenant in TENANTS])
+    STARTUP.mark("sincronización inicial")
+
+async def start_updater(application: Application):
+    """Empieza a recibir updates de Telegram según BOT_MODE."""
+    if BOT_MODE == "webhook":
+        # Telegram envía cada update por POST; PTB lo encola y responde 200 al instante
+        await application.updater.start_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=urlsplit(WEBHOOK_URL).path.lstrip("/"),
+            webhook_url=WEBHOOK_URL,
+            secret_token=webhook_secret_token(WEBHOOK_SECRET),
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+async def main(startup_only: bool = False):
+    """
+    Función principal que configura y ejecuta el bot. Con `startup_only` solo mide el arranque,
+    sin pedir updates, enviar recordatorios ni escrituras, ni abrir el puerto de métricas.
+    """
+    if BOT_MODE not in ("polling", "webhook"):
+        raise ValueError(f"BOT_MODE debe ser 'polling' o 'webhook', no '{BOT_MODE}'.")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise ValueError("BOT_MODE=webhook necesita WEBHOOK_URL con la URL pública del servicio.")
 
-async def main():
-    """Función principal que configura y ejecuta el bot."""
     init_db()
-    
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    TENANTS.load()
+    await REMINDERS.load()
+    WRITES.load()
+    # El índice de cada tenant se carga del espejo guardado; la sincronización va en warm_up
+    for tenant in TENANTS:
+        with use_tenant(tenant):
+            load_task_index()
+    STARTUP.mark("estado local")
+
+    # PTB despacha los updates de uno en uno, pero handle_message solo los encola en
+    # CHAT_QUEUE, cuyos workers ejecutan los turnos en paralelo. Si CHAT_QUEUE está llena el
+    # despacho se detiene, se llena esta cola acotada y el webhook tarda en responder
+    # (Telegram espera), en vez de acumular updates sin límite en memoria.
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .build()
+    )
+    bot = application.bot
 
     # --- Handlers ---
     application.add_handler(CommandHandler("start", start))
@@ -514,24 +2410,61 @@ async def main():
 
     # --- Scheduler ---
     scheduler = AsyncIOScheduler(timezone='UTC') # El scheduler en UTC para comparar con fechas UTC de la BD
-    scheduler.add_job(check_reminders, 'interval', minutes=1, args=[bot])
-    if BRIEFING_TIME and TELEGRAM_CHAT_ID_BRIEFING:
+    for tenant in TENANTS:
+        schedule_tenant_jobs(scheduler, bot, tenant)
+
+    # Se detiene con SIGINT/SIGTERM (Render envía SIGTERM al redesplegar)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
         try:
-            hour, minute = map(int, BRIEFING_TIME.split(':'))
-            # Programar en la zona horaria local
-            local_tz = pytz.timezone('America/Santiago')
-            scheduler.add_job(scheduled_briefing, 'cron', hour=hour, minute=minute, timezone=local_tz, args=[bot])
-            logger.info(f"Briefing diario programado a las {BRIEFING_TIME} (local) para el chat {TELEGRAM_CHAT_ID_BRIEFING}.")
-        except ValueError:
-            logger.error(f"Formato de BRIEFING_TIME ('{BRIEFING_TIME}') incorrecto. Usar HH:MM.")
-    scheduler.start()
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl+C llega como KeyboardInterrupt
 
-    logger.info("Bot y planificador iniciados. ¡Listo para recibir mensajes!")
+    background = []
+    metrics_server = None
     try:
-        await application.run_polling(allowed_updates=Update.ALL_TYPES)
+        # Ciclo de vida a mano: run_polling/run_webhook crean y cierran su propio bucle de eventos
+        await application.initialize()
+        await application.start()
+        scheduler.start(paused=startup_only)
+        # Los updates son del bot en producción: si solo se mide el arranque, los perdería
+        if not startup_only:
+            await start_updater(application)
+            background.append(asyncio.create_task(REMINDERS.run(bot)))
+            background.append(asyncio.create_task(WRITES.run()))
+            metrics_server = await start_metrics_server(METRICS_PORT) if METRICS_PORT else None
+        STARTUP.mark("recibiendo updates")
+        logger.info(f"Bot y planificador iniciados en {STARTUP.elapsed():.2f}s. ¡Listo para recibir mensajes!")
+
+        warm_up_task = asyncio.create_task(warm_up())
+        background.append(warm_up_task)
+        if startup_only:
+            await warm_up_task
+            print(STARTUP.report())
+        else:
+            await stop.wait()
     finally:
-        scheduler.shutdown()
+        for task in background:
+            task.cancel()
+        # Se espera a que terminen de cancelarse: los recordatorios a medio enviar anotan su
+        # resultado antes de que storage.close() confirme las escrituras pendientes
+        await asyncio.gather(*background, return_exceptions=True)
+        # Lo que no llegó a enviarse queda en pending_writes y se envía al arrancar de nuevo
+        if metrics_server:
+            metrics_server.close()
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await TENANTS.aclose()
+        await storage.close()
         logger.info("Bot y planificador detenidos.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # `python main.py --startup-time` arranca, precalienta, muestra cuánto tardó cada fase y termina
+    asyncio.run(main(startup_only="--startup-time" in sys.argv[1:]))
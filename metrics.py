@@ -0,0 +1,213 @@
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Límites (en segundos) de los buckets de los histogramas
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# -----------------------------------------------------------------------------
+# REGISTRO DE MÉTRICAS
+# -----------------------------------------------------------------------------
+
+def _format_labels(labels: tuple) -> str:
+    if not labels: return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+class Histogram:
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+class Metrics:
+    """
+    Contadores e histogramas en memoria, identificados por nombre y etiquetas, que se
+    exportan en el formato de texto de Prometheus. Todo corre en el bucle de eventos,
+    así que no se necesitan locks.
+    """
+
+    def __init__(self):
+        self._counters = defaultdict(float)  # {(nombre, etiquetas): valor}
+        self._histograms = {}  # {(nombre, etiquetas): Histogram}
+        self._help = {}  # {nombre: descripción}
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        self._counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def render(self) -> str:
+        """Devuelve todas las métricas en el formato de exposición de texto de Prometheus."""
+        lines = []
+        by_name = defaultdict(list)
+        for (name, labels), value in self._counters.items():
+            by_name[name].append((labels, value))
+        for name in sorted(by_name):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{_format_labels(labels)} {value:g}" for labels, value in sorted(by_name[name]))
+
+        by_name = defaultdict(list)
+        for (name, labels), histogram in self._histograms.items():
+            by_name[name].append((labels, histogram))
+        for name in sorted(by_name):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in sorted(by_name[name], key=lambda item: item[0]):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+METRICS.describe("olivia_stage_seconds", "Duración de cada etapa de un turno (thread, OpenAI, herramientas, Notion, Telegram...).")
+METRICS.describe("olivia_turn_seconds", "Duración total de un turno del asistente.")
+METRICS.describe("olivia_startup_seconds", "Duración de cada fase del arranque del proceso.")
+
+# -----------------------------------------------------------------------------
+# SPANS Y TRAZAS POR TURNO
+# -----------------------------------------------------------------------------
+# El span activo y la traza del turno viajan en contextvars: las tareas que crea
+# asyncio.gather (p. ej. herramientas en paralelo) heredan ambos.
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+class Span:
+    __slots__ = ("stage", "labels", "start", "duration", "children")
+
+    def __init__(self, stage: str, labels: dict):
+        self.stage = stage
+        self.labels = labels
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.children = defaultdict(float)  # {etapa: segundos} de los spans anidados directamente
+
+@contextmanager
+def span(stage: str, **labels):
+    """
+    Mide una etapa: la duración va al histograma `olivia_stage_seconds`, se suma al
+    span padre (así una herramienta sabe cuánto de su tiempo fue Notion) y, si hay un
+    turno en curso, queda en su traza.
+    """
+    parent = _current_span.get()
+    current = Span(stage, labels)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - current.start
+        _current_span.reset(token)
+        METRICS.observe("olivia_stage_seconds", current.duration, stage=stage, **labels)
+        if parent is not None:
+            parent.children[stage] += current.duration
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.append(current)
+
+@contextmanager
+def turn_trace(chat_id: int, log: bool = False):
+    """Agrupa los spans de un turno; con `log` escribe la traza completa del turno como una línea JSON."""
+    spans = []
+    token = _current_trace.set(spans)
+    start = time.perf_counter()
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+        total = time.perf_counter() - start
+        METRICS.observe("olivia_turn_seconds", total)
+        if log:
+            entries = []
+            for s in sorted(spans, key=lambda s: s.start):
+                entry = {"stage": s.stage, **s.labels, "at_ms": round((s.start - start) * 1000, 1), "ms": round(s.duration * 1000, 1)}
+                for child, seconds in s.children.items():
+                    entry[f"{child}_ms"] = round(seconds * 1000, 1)
+                if s.children:
+                    entry["self_ms"] = round((s.duration - sum(s.children.values())) * 1000, 1)
+                entries.append(entry)
+            logger.info(f"Traza del turno del chat {chat_id}: " + json.dumps({"total_ms": round(total * 1000, 1), "spans": entries}, ensure_ascii=False))
+
+# -----------------------------------------------------------------------------
+# TIEMPOS DE ARRANQUE
+# -----------------------------------------------------------------------------
+
+class StartupTimer:
+    """Marca el final de cada fase del arranque; `t0` es el inicio del proceso (antes de los imports)."""
+
+    def __init__(self, t0: float):
+        self.t0 = t0
+        self.phases = []  # [(fase, segundos desde t0)]
+
+    def mark(self, phase: str):
+        elapsed = time.perf_counter() - self.t0
+        self.phases.append((phase, elapsed))
+        METRICS.inc("olivia_startup_seconds", elapsed - (self.phases[-2][1] if len(self.phases) > 1 else 0), phase=phase)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def report(self) -> str:
+        lines, previous = ["Tiempos de arranque:"], 0.0
+        for phase, elapsed in self.phases:
+            lines.append(f"  {phase:<28} +{(elapsed - previous) * 1000:8.1f} ms   (total {elapsed * 1000:8.1f} ms)")
+            previous = elapsed
+        return "\n".join(lines)
+
+# -----------------------------------------------------------------------------
+# ENDPOINT HTTP
+# -----------------------------------------------------------------------------
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode(errors="replace").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", METRICS.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(port: int, host: str = "0.0.0.0") -> asyncio.AbstractServer:
+    """Sirve `GET /metrics` en formato Prometheus. Devuelve el servidor para cerrarlo al apagar el bot."""
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info(f"Métricas disponibles en http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,495 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Ventana en la que se acumulan escrituras diferidas antes de confirmarlas en una sola transacción
+WRITE_BEHIND_DELAY = 0.05
+
+# -----------------------------------------------------------------------------
+# MIGRACIONES
+# -----------------------------------------------------------------------------
+# Cada migración lleva el esquema de la versión N-1 a la N (PRAGMA user_version).
+# Nunca se editan las ya publicadas: los cambios nuevos van en una migración nueva.
+
+def _migration_1(conn: sqlite3.Connection):
+    """Esquema original: recordatorios con fecha en texto, espejo de tareas y estado de sincronización."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reminders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        task_title TEXT NOT NULL,
+        remind_time TIMESTAMP NOT NULL,
+        status TEXT DEFAULT 'pending'
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS tasks (
+        id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        norm_title TEXT NOT NULL,
+        status TEXT,
+        due_date TEXT,
+        categories TEXT,
+        description TEXT,
+        last_edited_time TEXT NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """)
+
+def _migration_2(conn: sqlite3.Connection):
+    """Hora de los recordatorios como epoch entero (UTC) e índices para las consultas frecuentes."""
+    conn.execute("""
+    CREATE TABLE reminders_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        task_title TEXT NOT NULL,
+        remind_at INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending'
+    )
+    """)
+    # Las filas antiguas guardaban el datetime en UTC convertido a texto por sqlite3
+    def to_epoch(remind_time) -> int:
+        remind_datetime = datetime.fromisoformat(str(remind_time))
+        if remind_datetime.tzinfo is None:
+            remind_datetime = remind_datetime.replace(tzinfo=timezone.utc)
+        return int(remind_datetime.timestamp())
+
+    rows = conn.execute("SELECT id, chat_id, task_title, remind_time, status FROM reminders").fetchall()
+    conn.executemany(
+        "INSERT INTO reminders_v2 (id, chat_id, task_title, remind_at, status) VALUES (?, ?, ?, ?, ?)",
+        [(r_id, chat_id, task_title, to_epoch(remind_time), status or "pending")
+         for r_id, chat_id, task_title, remind_time, status in rows]
+    )
+    conn.execute("DROP TABLE reminders")
+    conn.execute("ALTER TABLE reminders_v2 RENAME TO reminders")
+    conn.execute("CREATE INDEX idx_reminders_status_remind_at ON reminders (status, remind_at)")
+    conn.execute("CREATE INDEX idx_tasks_status ON tasks (status)")
+    conn.execute("CREATE INDEX idx_tasks_due_date ON tasks (due_date)")
+
+def _migration_3(conn: sqlite3.Connection):
+    """Relación chat -> thread de OpenAI, para conservar las conversaciones entre reinicios."""
+    conn.execute("""
+    CREATE TABLE chat_threads (
+        chat_id INTEGER PRIMARY KEY,
+        thread_id TEXT NOT NULL,
+        last_used_at INTEGER NOT NULL
+    )
+    """)
+
+def _migration_4(conn: sqlite3.Connection):
+    """Varios tenants: las tareas y el estado de sincronización pasan a ser por tenant ('default' el existente)."""
+    conn.execute("""
+    CREATE TABLE tasks_v2 (
+        tenant_id TEXT NOT NULL,
+        id TEXT NOT NULL,
+        title TEXT NOT NULL,
+        norm_title TEXT NOT NULL,
+        status TEXT,
+        due_date TEXT,
+        categories TEXT,
+        description TEXT,
+        last_edited_time TEXT NOT NULL,
+        PRIMARY KEY (tenant_id, id)
+    )
+    """)
+    conn.execute("""
+    INSERT INTO tasks_v2 (tenant_id, id, title, norm_title, status, due_date, categories, description, last_edited_time)
+    SELECT 'default', id, title, norm_title, status, due_date, categories, description, last_edited_time FROM tasks
+    """)
+    conn.execute("DROP TABLE tasks")
+    conn.execute("ALTER TABLE tasks_v2 RENAME TO tasks")
+    conn.execute("CREATE INDEX idx_tasks_tenant_status ON tasks (tenant_id, status)")
+    conn.execute("CREATE INDEX idx_tasks_tenant_due_date ON tasks (tenant_id, due_date)")
+    conn.execute("UPDATE sync_state SET key = 'default:' || key")
+
+def _migration_5(conn: sqlite3.Connection):
+    """Escrituras a Notion pendientes de enviar (una fila por página, con las ediciones ya fusionadas)."""
+    conn.execute("""
+    CREATE TABLE pending_writes (
+        tenant_id TEXT NOT NULL,
+        page_id TEXT NOT NULL,
+        action TEXT NOT NULL,
+        fields TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 1,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (tenant_id, page_id)
+    )
+    """)
+
+def _migration_6(conn: sqlite3.Connection):
+    """Intentos de envío de cada recordatorio y momento en que se reclamó para enviarlo (estado 'sending')."""
+    conn.execute("ALTER TABLE reminders ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    conn.execute("ALTER TABLE reminders ADD COLUMN claimed_at INTEGER")
+
+def _migration_7(conn: sqlite3.Connection):
+    """Creaciones enviadas a Notion sin confirmar (títulos y momento del primer envío), para no duplicarlas al reintentar."""
+    conn.execute("ALTER TABLE pending_writes ADD COLUMN unconfirmed_create TEXT")
+
+MIGRATIONS = [_migration_1, _migration_2, _migration_3, _migration_4, _migration_5, _migration_6, _migration_7]
+
+# -----------------------------------------------------------------------------
+# MOTOR DE ALMACENAMIENTO
+# -----------------------------------------------------------------------------
+
+class Storage:
+    """
+    Almacenamiento local en SQLite (modo WAL) con conexiones de larga duración.
+
+    - Las escrituras usan una única conexión que vive en un hilo propio, así que nunca
+      bloquean el event loop: se esperan con `await storage.write(...)`.
+    - Las lecturas usan una segunda conexión; en WAL no esperan a las escrituras en curso
+      y son lo bastante rápidas (índices) para hacerse directamente desde el event loop.
+    - Las inserciones y cambios de estado que no necesitan confirmación inmediata se
+      encolan con `enqueue` y se confirman juntas en una transacción cada WRITE_BEHIND_DELAY.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._writer = None
+        self._reader = None
+        self._read_lock = threading.Lock()
+        self._pending = []  # [(sql, params)] escrituras diferidas aún no confirmadas
+        self._flush_handle = None
+        self._next_reminder_id = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _open_writer(self):
+        self._writer = self._connect()
+        version = self._writer.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            with self._transaction():
+                migration(self._writer)
+                self._writer.execute(f"PRAGMA user_version = {number}")
+            logger.info(f"Migración {number} de la base de datos aplicada.")
+
+    def open(self):
+        """Abre las conexiones y aplica las migraciones pendientes."""
+        self._executor.submit(self._open_writer).result()
+        self._reader = self._connect()
+        self._next_reminder_id = self.query("SELECT COALESCE(MAX(id), 0) FROM reminders")[0][0] + 1
+
+    @contextmanager
+    def _transaction(self):
+        self._writer.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._writer.execute("ROLLBACK")
+            raise
+        self._writer.execute("COMMIT")
+
+    # --- Escrituras ---------------------------------------------------------
+
+    def _run_in_transaction(self, func, *args):
+        with self._transaction():
+            return func(self._writer, *args)
+
+    async def write(self, func, *args):
+        """Ejecuta `func(conn, *args)` en una transacción del hilo escritor y devuelve su resultado."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run_in_transaction, func, *args)
+
+    def enqueue(self, sql: str, params: tuple = ()):
+        """Encola una escritura diferida; se confirmará junto con las demás en el próximo lote."""
+        self._pending.append((sql, params))
+        if self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return  # Sin event loop: se confirmará en el próximo `flush()`
+            self._flush_handle = loop.call_later(WRITE_BEHIND_DELAY, lambda: asyncio.ensure_future(self._scheduled_flush()))
+
+    async def _scheduled_flush(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error confirmando escrituras diferidas en la base de datos: {e}", exc_info=True)
+
+    def _apply_batch(self, conn: sqlite3.Connection, batch: list):
+        # Agrupa sentencias consecutivas iguales para usar executemany
+        start = 0
+        for i in range(1, len(batch) + 1):
+            if i == len(batch) or batch[i][0] != batch[start][0]:
+                conn.executemany(batch[start][0], [params for _, params in batch[start:i]])
+                start = i
+
+    async def flush(self):
+        """Confirma en una sola transacción todas las escrituras diferidas pendientes."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            await self.write(self._apply_batch, batch)
+
+    # --- Lecturas -----------------------------------------------------------
+
+    def query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._read_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    async def close(self):
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._writer.close)
+        self._executor.shutdown()
+        self._reader.close()
+
+    # -------------------------------------------------------------------------
+    # ESPEJO DE TAREAS
+    # -------------------------------------------------------------------------
+
+    # Todas las operaciones del espejo reciben el `tenant_id` dueño de las tareas.
+
+    @staticmethod
+    def _upsert_tasks(conn: sqlite3.Connection, tenant_id: str, tasks: list[dict], deleted_ids: list[str]):
+        conn.executemany("DELETE FROM tasks WHERE tenant_id = ? AND id = ?", [(tenant_id, task_id) for task_id in deleted_ids])
+        conn.executemany("""
+            INSERT INTO tasks (tenant_id, id, title, norm_title, status, due_date, categories, description, last_edited_time)
+            VALUES (:tenant_id, :id, :title, :norm_title, :status, :due_date, :categories, :description, :last_edited_time)
+            ON CONFLICT(tenant_id, id) DO UPDATE SET
+                title = excluded.title, norm_title = excluded.norm_title, status = excluded.status,
+                due_date = excluded.due_date, categories = excluded.categories,
+                description = excluded.description, last_edited_time = excluded.last_edited_time
+            """, [{**task, "tenant_id": tenant_id, "categories": json.dumps(task["categories"])} for task in tasks])
+
+    async def upsert_tasks(self, tenant_id: str, tasks: list[dict], deleted_ids: list[str] = ()):
+        """Inserta o actualiza tareas (con `norm_title` ya calculado) y elimina las de `deleted_ids`."""
+        await self.write(self._upsert_tasks, tenant_id, tasks, list(deleted_ids))
+
+    @staticmethod
+    def _retain_tasks(conn: sqlite3.Connection, tenant_id: str, task_ids: list[str]):
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen_tasks (id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM seen_tasks")
+        conn.executemany("INSERT OR IGNORE INTO seen_tasks (id) VALUES (?)", [(task_id,) for task_id in task_ids])
+        conn.execute("DELETE FROM tasks WHERE tenant_id = ? AND id NOT IN (SELECT id FROM seen_tasks)", (tenant_id,))
+
+    async def retain_tasks(self, tenant_id: str, task_ids: list[str]):
+        """Elimina del espejo del tenant las tareas que no estén en `task_ids` (resincronización completa)."""
+        await self.write(self._retain_tasks, tenant_id, task_ids)
+
+    def find_tasks(self, tenant_id: str, category: str = None, status: str = None, due_date: str = None) -> list[tuple]:
+        """Devuelve (title, status, due_date) de las tareas que cumplen todos los filtros dados."""
+        conditions, params = ["tenant_id = ?"], [tenant_id]
+        if category:
+            conditions.append("EXISTS (SELECT 1 FROM json_each(tasks.categories) WHERE json_each.value = ?)")
+            params.append(category)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if due_date:
+            # Igual que el filtro `date.equals` de Notion: una fecha sin hora coincide con todo ese día.
+            # Se expresa como rango para que pueda usar el índice sobre due_date.
+            if "T" in due_date:
+                conditions.append("due_date = ?")
+                params.append(due_date)
+            else:
+                conditions.append("due_date >= ? AND due_date < ?")
+                params.extend([due_date, due_date + "\uffff"])
+        sql = "SELECT title, status, due_date FROM tasks WHERE " + " AND ".join(conditions)
+        return self.query(sql + " ORDER BY rowid", tuple(params))
+
+    def find_briefing_tasks(self, tenant_id: str, today: str, until: str, done_statuses: tuple = ()) -> list[tuple]:
+        """
+        (id, title, status, due_date) de las tareas con fecha anterior a `until`: las de hoy y
+        los próximos días, y las atrasadas que no están en un estado de `done_statuses`.
+        """
+        placeholders = ",".join("?" * len(done_statuses))
+        done_condition = f"status IS NULL OR status NOT IN ({placeholders})" if done_statuses else "1"
+        return self.query(
+            "SELECT id, title, status, due_date FROM tasks "
+            f"WHERE tenant_id = ? AND due_date < ? AND (due_date >= ? OR {done_condition}) ORDER BY due_date",
+            (tenant_id, until, today, *done_statuses)
+        )
+
+    def get_task(self, tenant_id: str, task_id: str) -> dict | None:
+        """Devuelve la tarea del espejo como diccionario (mismas claves que `upsert_tasks`), o None."""
+        rows = self.query(
+            "SELECT id, title, norm_title, status, due_date, categories, description, last_edited_time "
+            "FROM tasks WHERE tenant_id = ? AND id = ?", (tenant_id, task_id)
+        )
+        if not rows: return None
+        keys = ("id", "title", "norm_title", "status", "due_date", "categories", "description", "last_edited_time")
+        task = dict(zip(keys, rows[0]))
+        task["categories"] = json.loads(task["categories"] or "[]")
+        return task
+
+    def load_task_titles(self, tenant_id: str) -> list[tuple]:
+        return self.query("SELECT id, title, norm_title, description FROM tasks WHERE tenant_id = ? ORDER BY rowid", (tenant_id,))
+
+    def get_sync_state(self, key: str) -> str | None:
+        row = self.query("SELECT value FROM sync_state WHERE key = ?", (key,))
+        return row[0][0] if row else None
+
+    async def set_sync_state(self, key: str, value: str):
+        await self.write(lambda conn: conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value)))
+
+    # -------------------------------------------------------------------------
+    # ESCRITURAS PENDIENTES A NOTION
+    # -------------------------------------------------------------------------
+    # Cada fila es el estado que aún hay que enviar de una página: `action` es 'create',
+    # 'update' o 'archive' y `fields` los campos de la tarea (title, status, due_date...).
+    # `version` crece con cada edición fusionada, así quien termina de enviar una versión
+    # sabe si llegaron cambios mientras tanto. `unconfirmed_create` anota las creaciones que
+    # se enviaron sin saber si Notion llegó a hacerlas ({"since": epoch, "titles": [...]}).
+
+    @staticmethod
+    def _merge_write(conn: sqlite3.Connection, tenant_id: str, page_id: str, action: str, fields: dict):
+        row = conn.execute("SELECT action, fields FROM pending_writes WHERE tenant_id = ? AND page_id = ?", (tenant_id, page_id)).fetchone()
+        if row is None:
+            conn.execute("INSERT INTO pending_writes (tenant_id, page_id, action, fields) VALUES (?, ?, ?, ?)",
+                         (tenant_id, page_id, action, json.dumps(fields)))
+            return
+        old_action, old_fields = row[0], json.loads(row[1])
+        # Una edición se suma a la creación o edición pendiente; archivar gana a todo lo anterior
+        new_action = "archive" if "archive" in (action, old_action) else old_action
+        conn.execute(
+            "UPDATE pending_writes SET action = ?, fields = ?, version = version + 1, attempts = 0, next_attempt_at = 0 "
+            "WHERE tenant_id = ? AND page_id = ?",
+            (new_action, json.dumps({**old_fields, **fields}), tenant_id, page_id)
+        )
+
+    async def record_write(self, tenant_id: str, page_id: str, action: str, fields: dict, tasks: list[dict] = (), deleted_ids: list[str] = ()):
+        """
+        Guarda una escritura pendiente (fusionándola con la que ya hubiera para esa página)
+        y aplica su efecto al espejo en la misma transacción.
+        """
+        def apply(conn):
+            self._upsert_tasks(conn, tenant_id, list(tasks), list(deleted_ids))
+            self._merge_write(conn, tenant_id, page_id, action, fields)
+        await self.write(apply)
+
+    def pending_writes(self) -> list[tuple]:
+        """(tenant_id, page_id, action, fields, version, attempts, next_attempt_at) de todas las escrituras pendientes."""
+        rows = self.query("SELECT tenant_id, page_id, action, fields, version, attempts, next_attempt_at FROM pending_writes ORDER BY rowid")
+        return [(tenant_id, page_id, action, json.loads(fields), *rest) for tenant_id, page_id, action, fields, *rest in rows]
+
+    async def complete_write(self, tenant_id: str, page_id: str, version: int, new_page_id: str = None,
+                             tasks: list[dict] = (), deleted_ids: list[str] = ()) -> bool:
+        """
+        Marca como enviada la versión `version` de la escritura y aplica al espejo el resultado
+        (`tasks`/`deleted_ids`). Si entretanto llegaron ediciones, el espejo ya refleja algo más
+        nuevo: no se toca y la fila se conserva para enviarlas después (si la página se acaba
+        de crear, ambas pasan a usar `new_page_id`). Devuelve True si no quedó nada pendiente.
+        """
+        def apply(conn):
+            completed = conn.execute("DELETE FROM pending_writes WHERE tenant_id = ? AND page_id = ? AND version = ?",
+                                     (tenant_id, page_id, version)).rowcount > 0
+            if completed:
+                self._upsert_tasks(conn, tenant_id, list(tasks), list(deleted_ids))
+            elif new_page_id:
+                conn.execute(
+                    "UPDATE pending_writes SET page_id = ?, action = CASE action WHEN 'create' THEN 'update' ELSE action END, "
+                    "unconfirmed_create = NULL WHERE tenant_id = ? AND page_id = ?", (new_page_id, tenant_id, page_id)
+                )
+                conn.execute("UPDATE tasks SET id = ? WHERE tenant_id = ? AND id = ?", (new_page_id, tenant_id, page_id))
+            return completed
+        return await self.write(apply)
+
+    async def reschedule_write(self, tenant_id: str, page_id: str, attempts: int, next_attempt_at: float):
+        await self.write(lambda conn: conn.execute(
+            "UPDATE pending_writes SET attempts = ?, next_attempt_at = ? WHERE tenant_id = ? AND page_id = ?",
+            (attempts, next_attempt_at, tenant_id, page_id)))
+
+    async def mark_create_sent(self, tenant_id: str, page_id: str, title: str, sent_at: float):
+        """Anota, antes de enviarla, que la creación de `page_id` con `title` puede llegar a Notion."""
+        def apply(conn):
+            row = conn.execute("SELECT unconfirmed_create FROM pending_writes WHERE tenant_id = ? AND page_id = ?",
+                               (tenant_id, page_id)).fetchone()
+            if row is None:
+                return
+            marker = json.loads(row[0]) if row[0] else {"since": sent_at, "titles": []}
+            if title not in marker["titles"]:
+                marker["titles"].append(title)
+            conn.execute("UPDATE pending_writes SET unconfirmed_create = ? WHERE tenant_id = ? AND page_id = ?",
+                         (json.dumps(marker), tenant_id, page_id))
+        await self.write(apply)
+
+    def unconfirmed_create(self, tenant_id: str, page_id: str) -> dict | None:
+        """Las creaciones de `page_id` enviadas sin confirmar ({"since", "titles"}), o None si no hubo ninguna."""
+        rows = self.query("SELECT unconfirmed_create FROM pending_writes WHERE tenant_id = ? AND page_id = ?", (tenant_id, page_id))
+        return json.loads(rows[0][0]) if rows and rows[0][0] else None
+
+    async def drop_write(self, tenant_id: str, page_id: str):
+        await self.write(lambda conn: conn.execute("DELETE FROM pending_writes WHERE tenant_id = ? AND page_id = ?", (tenant_id, page_id)))
+
+    # -------------------------------------------------------------------------
+    # RECORDATORIOS
+    # -------------------------------------------------------------------------
+
+    def insert_reminder(self, chat_id: int, task_title: str, remind_at: int) -> int:
+        """Encola un recordatorio nuevo y devuelve su id (asignado en memoria para poder diferir el INSERT)."""
+        reminder_id = self._next_reminder_id
+        self._next_reminder_id += 1
+        self.enqueue("INSERT INTO reminders (id, chat_id, task_title, remind_at) VALUES (?, ?, ?, ?)",
+                     (reminder_id, chat_id, task_title, remind_at))
+        return reminder_id
+
+    def pending_reminders(self) -> list[tuple]:
+        return self.query("SELECT id, chat_id, task_title, remind_at, attempts FROM reminders WHERE status = 'pending'")
+
+    async def claim_reminders(self, reminder_ids: list[int]) -> list[int]:
+        """
+        Pasa a 'sending' los recordatorios pendientes de `reminder_ids` y devuelve los que
+        reclamó. Se confirma antes de enviar nada: un recordatorio reclamado no vuelve a
+        enviarse aunque el proceso muera a mitad del envío.
+        """
+        await self.flush()  # Los INSERT diferidos de recordatorios recién creados van primero
+
+        def claim(conn):
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS claim_ids (id INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM claim_ids")
+            conn.executemany("INSERT OR IGNORE INTO claim_ids (id) VALUES (?)", [(r_id,) for r_id in reminder_ids])
+            claimed = [row[0] for row in conn.execute(
+                "SELECT id FROM reminders WHERE status = 'pending' AND id IN (SELECT id FROM claim_ids)")]
+            conn.execute("UPDATE reminders SET status = 'sending', claimed_at = strftime('%s', 'now') "
+                         "WHERE status = 'pending' AND id IN (SELECT id FROM claim_ids)")
+            return claimed
+        return await self.write(claim)
+
+    def record_reminder_outcomes(self, outcomes: list[tuple]):
+        """Encola el resultado (reminder_id, estado, intentos) de cada envío; se confirman todos en un lote."""
+        for reminder_id, status, attempts in outcomes:
+            self.enqueue("UPDATE reminders SET status = ?, attempts = ?, claimed_at = NULL WHERE id = ?",
+                         (status, attempts, reminder_id))
+
+    async def expire_reminder_claims(self) -> int:
+        """
+        Al arrancar, los recordatorios que quedaron en 'sending' pueden haberse enviado o no:
+        se marcan como 'interrupted' y no se reenvían (como mucho una vez). Devuelve cuántos eran.
+        """
+        return await self.write(lambda conn: conn.execute(
+            "UPDATE reminders SET status = 'interrupted' WHERE status = 'sending'").rowcount)
+
+    # -------------------------------------------------------------------------
+    # THREADS DE CONVERSACIÓN
+    # -------------------------------------------------------------------------
+
+    def get_chat_thread(self, chat_id: int) -> tuple[str, int] | None:
+        """Devuelve (thread_id, last_used_at) del chat, o None si no tiene thread guardado."""
+        row = self.query("SELECT thread_id, last_used_at FROM chat_threads WHERE chat_id = ?", (chat_id,))
+        return row[0] if row else None
+
+    def save_chat_thread(self, chat_id: int, thread_id: str, last_used_at: int):
+        self.enqueue("INSERT OR REPLACE INTO chat_threads (chat_id, thread_id, last_used_at) VALUES (?, ?, ?)",
+                     (chat_id, thread_id, last_used_at))